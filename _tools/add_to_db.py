@@ -1,11 +1,15 @@
 import pandas as pd
 import os
 from scats.models import Scats
+from scats.logics.ingest import after_ingest, bulk_create_scats
+from scats.logics.access_stats import is_warming_useful, warm
+from scats.logics.factors import compute_monthly_factors
 import json
 from datetime import date
 
 def add_to_db(folder_path):
     # e.g. folder_path = r'C:\Users\Jihyung\Downloads\VSDATA_202107'
+    site_months = set()
 
     for file in os.listdir(folder_path):
         if not file.endswith('.csv'): continue
@@ -17,6 +21,7 @@ def add_to_db(folder_path):
         df_json = json.loads(df.to_json(orient="records"))
 
         model_instances = []
+        file_site_months = set()
         for row in df_json:
             model_instance = Scats(**row)
             date_string = row['QT_INTERVAL_COUNT'].split(' ')[0]
@@ -26,5 +31,21 @@ def add_to_db(folder_path):
                 day=int(date_string.split('-')[2])
             )
             model_instances.append(model_instance)
+            file_site_months.add((
+                model_instance.NB_SCATS_SITE,
+                model_instance.QT_INTERVAL_COUNT.year,
+                model_instance.QT_INTERVAL_COUNT.month,
+            ))
 
-        Scats.objects.bulk_create(model_instances, batch_size=128)
+        try:
+            bulk_create_scats(model_instances, batch_size=128)
+        except ValueError as e:
+            # e.g. rows of archived months
+            print(e)
+            continue
+        site_months |= file_site_months
+
+    after_ingest(site_months)
+    compute_monthly_factors()
+    if is_warming_useful():
+        warm()
@@ -2,6 +2,9 @@ import pandas as pd
 import boto3
 from django.conf import settings
 from scats.models import Scats
+from scats.logics.ingest import after_ingest, bulk_create_scats
+from scats.logics.access_stats import is_warming_useful, warm
+from scats.logics.factors import compute_monthly_factors
 from datetime import date
 import json
 
@@ -15,6 +18,7 @@ s3 = boto3.resource(
 bucket = s3.Bucket(bucket_name)
 
 def add_to_db_from_s3():
+    site_months = set()
     for obj in bucket.objects.all():
         key = obj.key
         if key.endswith('.csv'):
@@ -23,6 +27,7 @@ def add_to_db_from_s3():
             df_json = json.loads(df.to_json(orient="records"))
 
             model_instances = []
+            file_site_months = set()
             for row in df_json:
                 model_instance = Scats(**row)
                 date_string = row['QT_INTERVAL_COUNT'].split(' ')[0]
@@ -32,7 +37,23 @@ def add_to_db_from_s3():
                     day=int(date_string.split('-')[2])
                 )
                 model_instances.append(model_instance)
+                file_site_months.add((
+                    model_instance.NB_SCATS_SITE,
+                    model_instance.QT_INTERVAL_COUNT.year,
+                    model_instance.QT_INTERVAL_COUNT.month,
+                ))
 
-            Scats.objects.bulk_create(model_instances, batch_size=128)
+            try:
+                bulk_create_scats(model_instances, batch_size=128)
+            except ValueError as e:
+                # Left in the bucket, e.g. rows of archived months.
+                print(e)
+                continue
+            site_months |= file_site_months
 
             obj.delete()
+
+    after_ingest(site_months)
+    compute_monthly_factors()
+    if is_warming_useful():
+        warm()
@@ -137,6 +137,42 @@ if not DEBUG:
     db_from_env = dj_database_url.config(conn_max_age=600)
     DATABASES['default'].update(db_from_env)
 
+# Optional dedicated database for SCATS volume data (the scats app).
+# See scats/routers.py.
+if os.environ.get('SCATS_DATABASE_URL'):
+    import dj_database_url
+    DATABASES['scats'] = dj_database_url.parse(
+        os.environ['SCATS_DATABASE_URL'], conn_max_age=600
+    )
+
+# Optional read replicas of the SCATS database, comma separated.
+# Read-only queries of the scats endpoints are spread over them round
+# robin, except for site-months ingested within SCATS_REPLICA_LAG_SECONDS,
+# which are read from the primary.
+SCATS_READ_REPLICAS = []
+for i, url in enumerate(filter(None, os.environ.get('SCATS_REPLICA_URLS', '').split(',')), start=1):
+    import dj_database_url
+    alias = f'scats_replica_{i}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'scats' if 'scats' in DATABASES else 'default'}
+    SCATS_READ_REPLICAS.append(alias)
+SCATS_REPLICA_LAG = timedelta(
+    seconds=int(os.environ.get('SCATS_REPLICA_LAG_SECONDS', 600))
+)
+
+# Optional shards of the Scats table, comma separated. Rows are placed on
+# a shard by a hash of NB_SCATS_SITE (see scats/routers.py) and moved
+# with 'python manage.py rebalance_scats_shards' when shards are added.
+# Read replicas are not used when the Scats table is sharded.
+SCATS_SHARDS = []
+for i, url in enumerate(filter(None, os.environ.get('SCATS_SHARD_URLS', '').split(',')), start=1):
+    import dj_database_url
+    alias = f'scats_shard_{i}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    SCATS_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ['scats.routers.ScatsRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -230,6 +266,78 @@ DJOSER = {
 QT_INTERVAL_COUNT_MIN = date(2021, 7, 1)
 QT_INTERVAL_COUNT_MAX = date(2021, 7, 31)
 
+# Optional directory of memory-mapped per site-month volume cubes,
+# written at ingest time. Scats data is read from the database when unset.
+SCATS_CUBE_STORE_DIR = os.environ.get('SCATS_CUBE_STORE_DIR')
+
+# Cache of encoded extract and seasonality responses. Keys include the
+# ingest manifest version of the requested site-months, and entries are
+# dropped per site and month by the ingestion tools. Use
+# 'scats.logics.result_cache.FileResultCache' with SCATS_RESULT_CACHE_DIR to
+# share the cache between workers. An empty SCATS_RESULT_CACHE_BACKEND
+# disables the cache.
+SCATS_RESULT_CACHE = {
+    'BACKEND': os.environ.get(
+        'SCATS_RESULT_CACHE_BACKEND', 'scats.logics.result_cache.LocMemResultCache'
+    ),
+    'OPTIONS': {
+        'max_bytes': int(os.environ.get('SCATS_RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    },
+}
+if os.environ.get('SCATS_RESULT_CACHE_DIR'):
+    SCATS_RESULT_CACHE['OPTIONS']['location'] = os.environ['SCATS_RESULT_CACHE_DIR']
+
+# Decoded site-month cubes shared by every worker on a host through shared
+# memory (see scats/logics/block_cache.py). Disabled when
+# SCATS_BLOCK_CACHE_MAX_BYTES is 0. SCATS_BLOCK_CACHE_PREFIX must differ
+# between deployments sharing a host.
+SCATS_BLOCK_CACHE_MAX_BYTES = int(os.environ.get('SCATS_BLOCK_CACHE_MAX_BYTES', 0))
+SCATS_BLOCK_CACHE_PREFIX = os.environ.get('SCATS_BLOCK_CACHE_PREFIX', 'scats')
+SCATS_BLOCK_CACHE_INDEX = os.environ.get('SCATS_BLOCK_CACHE_INDEX')
+
+# Identical concurrent extract and seasonality requests wait for one
+# computation. Across workers they wait on a Postgres advisory lock for at
+# most this many seconds before computing the result themselves.
+SCATS_COALESCE_TIMEOUT = int(os.environ.get('SCATS_COALESCE_TIMEOUT', 60))
+
+# Requests of the SCATS endpoints are counted to warm the caches with the
+# most requested results (see scats/logics/access_stats.py). Each worker
+# writes its counts at most every SCATS_ACCESS_FLUSH_SECONDS, and results
+# not requested within SCATS_ACCESS_RETENTION_DAYS are forgotten.
+SCATS_ACCESS_FLUSH_SECONDS = int(os.environ.get('SCATS_ACCESS_FLUSH_SECONDS', 60))
+SCATS_ACCESS_RETENTION_DAYS = int(os.environ.get('SCATS_ACCESS_RETENTION_DAYS', 90))
+
+# Background analysis jobs (see 'python manage.py run_scats_jobs'). A job
+# still running after SCATS_JOB_TIMEOUT_SECONDS is handed to another
+# worker, and failing jobs are retried up to SCATS_JOB_MAX_ATTEMPTS times.
+SCATS_JOB_TIMEOUT = timedelta(
+    seconds=int(os.environ.get('SCATS_JOB_TIMEOUT_SECONDS', 3600))
+)
+SCATS_JOB_MAX_ATTEMPTS = int(os.environ.get('SCATS_JOB_MAX_ATTEMPTS', 3))
+
+# Bulk exports are uploaded to AWS_STORAGE_BUCKET_NAME, or written to
+# SCATS_EXPORT_DIR when set (e.g. in development).
+SCATS_EXPORT_DIR = os.environ.get('SCATS_EXPORT_DIR')
+SCATS_EXPORT_MAX_SITES = int(os.environ.get('SCATS_EXPORT_MAX_SITES', 20))
+
+# Seasonality analyses of several sites (corridors) are computed in a pool
+# of SCATS_CORRIDOR_WORKERS processes per web worker, 0 or 1 to compute them
+# in the request. Every gunicorn worker has its own pool, so a host runs up
+# to WEB_CONCURRENCY x SCATS_CORRIDOR_WORKERS of them: by default the CPUs
+# of the host are shared between the WEB_CONCURRENCY gunicorn workers.
+# SCATS_CORRIDOR_CHARGE is 'site' to charge a seasonality credit point per
+# site with data, or 'request' to charge one per request.
+SCATS_CORRIDOR_MAX_SITES = int(os.environ.get('SCATS_CORRIDOR_MAX_SITES', 30))
+SCATS_CORRIDOR_WORKERS = int(os.environ.get(
+    'SCATS_CORRIDOR_WORKERS',
+    (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1))
+))
+SCATS_CORRIDOR_CHARGE = os.environ.get('SCATS_CORRIDOR_CHARGE', 'site')
+
+# Directory of the Parquet archive of historical months
+# (see 'python manage.py archive_scats').
+SCATS_ARCHIVE_DIR = os.environ.get('SCATS_ARCHIVE_DIR')
+
 FREE_PERIOD_AFTER_ACCOUNT_CREATION = timedelta(
     days=int(os.environ['FREE_PERIOD_AFTER_ACCOUNT_CREATION'])
 )
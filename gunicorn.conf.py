@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def when_ready(server):
+    # Warm the shared caches with the most requested SCATS results in the
+    # background once the workers are ready to serve. The command exits
+    # early when no cache is shared with the workers.
+    if os.environ.get('SCATS_WARM_ON_STARTUP', '1') == '1':
+        subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'manage.py'), 'warm_scats_cache'])
+
+
+def worker_exit(server, worker):
+    # Write the request counts not yet flushed by the worker.
+    from scats.logics.access_stats import flush_accesses
+
+    flush_accesses()
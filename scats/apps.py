@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ScatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'scats'
+
+    def ready(self):
+        from django.core.signals import request_finished, request_started
+        from .logics.ingest import finish_request, start_request
+
+        request_started.connect(start_request, dispatch_uid='scats_manifest_start')
+        request_finished.connect(finish_request, dispatch_uid='scats_manifest_finish')
@@ -0,0 +1,182 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from scats.models import ResultAccess
+from scats.routers import scats_database
+from . import block_cache
+from .holidays import DayFilter
+
+
+# Requests counted by this process and not yet written, by
+# (kind, site, from, to, params): (count, last accessed).
+_pending = {}
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def record_access(kind, scats_id, from_date, to_date, params=''):
+    """
+    Count a request for a result. Counts are kept in memory and written by
+    flush_accesses at most every SCATS_ACCESS_FLUSH_SECONDS, so requests do
+    not write to the primary.
+    """
+    key = (kind, scats_id, from_date, to_date, params)
+    with _pending_lock:
+        count, _ = _pending.get(key, (0, None))
+        _pending[key] = (count + 1, timezone.now())
+        due = time.monotonic() - _flushed_at >= settings.SCATS_ACCESS_FLUSH_SECONDS
+    if due:
+        flush_accesses()
+
+
+def flush_accesses():
+    """
+    Write the requests counted by this process, and delete the results not
+    requested within SCATS_ACCESS_RETENTION_DAYS.
+    """
+    global _flushed_at
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+
+    for (kind, scats_id, from_date, to_date, params), (count, last_accessed) in pending.items():
+        _add_access(
+            {
+                'kind': kind,
+                'NB_SCATS_SITE': scats_id,
+                'from_date': from_date,
+                'to_date': to_date,
+                'params': params,
+            },
+            count, last_accessed
+        )
+    ResultAccess.objects.filter(
+        last_accessed__lt=timezone.now() - timedelta(days=settings.SCATS_ACCESS_RETENTION_DAYS)
+    ).delete()
+
+
+def _add_access(lookup, count, last_accessed):
+    # One UPDATE for results requested before.
+    updated = ResultAccess.objects.filter(**lookup).update(
+        count=F('count') + count, last_accessed=last_accessed
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic(using=scats_database()):
+            ResultAccess.objects.create(count=count, last_accessed=last_accessed, **lookup)
+    except IntegrityError:
+        # Created by another process.
+        ResultAccess.objects.filter(**lookup).update(
+            count=F('count') + count, last_accessed=last_accessed
+        )
+
+
+def most_requested(top, days=30):
+    """
+    The top most requested results accessed within the last days,
+    within the range of the Scats data.
+    """
+    return list(
+        ResultAccess.objects.filter(
+            last_accessed__gte=timezone.now() - timedelta(days=days),
+            from_date__gte=settings.QT_INTERVAL_COUNT_MIN,
+            to_date__lte=settings.QT_INTERVAL_COUNT_MAX,
+        ).order_by('-count', '-last_accessed')[:top]
+    )
+
+
+def _warm_one(access, deadline):
+    from .results import (
+        design_volumes_result, extract_result, peak_hours_result,
+        seasonality_detector_result, seasonality_percentile_result,
+        seasonality_profile_result, seasonality_result,
+    )
+    from .seasonality_analysis import AGGREGATES
+
+    seasonality_results = {
+        'seasonality': seasonality_result,
+        'seasonality-detector': seasonality_detector_result,
+        'seasonality-percentile': seasonality_percentile_result,
+        'peak-hours': peak_hours_result,
+        'peak-hours-detector': partial(peak_hours_result, group='detector'),
+    }
+    for aggregate in AGGREGATES:
+        seasonality_results[f'seasonality-profile-{aggregate}'] = partial(
+            seasonality_profile_result, aggregate=aggregate
+        )
+
+    if time.monotonic() >= deadline:
+        return False
+    try:
+        if access.kind == 'extract':
+            extract_result(
+                access.NB_SCATS_SITE, access.from_date, access.to_date,
+                DayFilter.from_key(access.params)
+            )
+        elif access.kind == 'design-volumes':
+            # See results.design_volumes_params.
+            detectors, _, ranks = access.params.partition(';ranks=')
+            design_volumes_result(
+                access.NB_SCATS_SITE, access.from_date, access.to_date,
+                [int(detector) for detector in detectors.split(',')],
+                [int(rank) for rank in ranks.split(',')]
+            )
+        elif access.kind in seasonality_results:
+            # See results.seasonality_params.
+            detectors, _, filter_key = access.params.partition(';')
+            seasonality_results[access.kind](
+                access.NB_SCATS_SITE, access.from_date, access.to_date,
+                [int(detector) for detector in detectors.split(',')],
+                day_filter=DayFilter.from_key(filter_key)
+            )
+        else:
+            return False
+    finally:
+        connections.close_all()
+    return True
+
+
+def is_warming_useful():
+    """
+    Whether results warmed by one process are kept for the others: in a
+    shared result cache backend (e.g. FileResultCache) or in the block
+    cache. A per-process cache filled by a separate warming process is lost
+    with it.
+    """
+    config = getattr(settings, 'SCATS_RESULT_CACHE', None)
+    if config and config.get('BACKEND') and getattr(import_string(config['BACKEND']), 'shared', False):
+        return True
+    return block_cache.is_enabled()
+
+
+def warm(top=50, workers=4, time_budget=300, days=30):
+    """
+    Precompute the top most requested results in parallel, filling the
+    result cache, the block cache and the OS page cache of the cube store.
+
+    Results not started within time_budget seconds are skipped. Results
+    already being computed at the deadline are finished.
+    Returns the number of results computed.
+    """
+    deadline = time.monotonic() + time_budget
+    accesses = most_requested(top, days)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_warm_one, access, deadline) for access in accesses]
+        done, not_done = wait(futures, timeout=time_budget)
+        for future in not_done:
+            future.cancel()
+    return sum(
+        1 for future in futures
+        if not future.cancelled() and future.exception() is None and future.result()
+    )
@@ -0,0 +1,214 @@
+import calendar
+import glob
+import os
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from scats.models import Scats, ArchivedMonth
+from scats.routers import scats_database, scats_row_databases
+from .cube_store import VOLUME_COLUMNS, iter_months
+
+# Historical months are archived to Parquet partitioned by month and site:
+#     <SCATS_ARCHIVE_DIR>/month=2021-07/site=100/part-0.parquet
+PARQUET_COMPRESSION = 'zstd'
+
+
+def _pa():
+    # pyarrow is only needed on hosts that archive or read archived months.
+    import pyarrow
+    return pyarrow
+
+
+def _days(from_date, to_date):
+    return [from_date + timedelta(days=offset) for offset in range((to_date - from_date).days + 1)]
+
+
+def archive_schema():
+    pa = _pa()
+    return pa.schema(
+        [
+            ('id', pa.int64()),
+            ('NB_SCATS_SITE', pa.int32()),
+            ('QT_INTERVAL_COUNT', pa.date32()),
+            ('NB_DETECTOR', pa.int16()),
+        ]
+        + [(column, pa.int32()) for column in VOLUME_COLUMNS]
+        + [
+            ('NM_REGION', pa.string()),
+            ('CT_RECORDS', pa.int16()),
+            ('QT_VOLUME_24HOUR', pa.int32()),
+            ('CT_ALARM_24HOUR', pa.int16()),
+        ]
+    )
+
+
+def is_enabled():
+    return bool(getattr(settings, 'SCATS_ARCHIVE_DIR', None))
+
+
+def month_key(year, month):
+    return f'{year}-{str(month).zfill(2)}'
+
+
+def partition_path(scats_id, year, month):
+    return os.path.join(
+        settings.SCATS_ARCHIVE_DIR,
+        f'month={month_key(year, month)}',
+        f'site={scats_id}',
+        'part-0.parquet'
+    )
+
+
+def month_range(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def archived_months(from_date, to_date):
+    """
+    Return the set of (year, month) pairs between from_date and to_date
+    that have been moved to the archive.
+    """
+    if not is_enabled():
+        return set()
+    first_day = date(from_date.year, from_date.month, 1)
+    return {
+        (month.year, month.month)
+        for month in ArchivedMonth.objects.filter(
+            month__gte=first_day, month__lte=to_date
+        ).values_list('month', flat=True)
+    }
+
+
+def _write_partition(scats_id, year, month, rows):
+    pa = _pa()
+    import pyarrow.parquet as pq
+
+    path = partition_path(scats_id, year, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    table = pa.Table.from_pylist(rows, schema=archive_schema())
+    pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION)
+    os.replace(tmp_path, path)
+
+
+def archive_month(year, month, chunk_size=10000):
+    """
+    Export a month of Scats data to Parquet and remove it from the Scats table.
+
+    Every site is written before anything is deleted. When the Scats table
+    is not sharded, the deletion and the ArchivedMonth record are committed
+    together, so readers switch from the table to the archive in one step.
+    With shards, the ArchivedMonth record is created first so that readers
+    switch to the (already complete) archive before any shard is emptied.
+    Only one site is held in memory at a time.
+    """
+    first_day, last_day = month_range(year, month)
+    databases = scats_row_databases()
+
+    row_count = 0
+    for using in databases:
+        scats_data = Scats.objects.using(using).filter(
+            QT_INTERVAL_COUNT__gte=first_day,
+            QT_INTERVAL_COUNT__lte=last_day
+        ).order_by('NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'NB_DETECTOR')
+
+        scats_id, rows = None, []
+        for row in scats_data.values().iterator(chunk_size=chunk_size):
+            if row['NB_SCATS_SITE'] != scats_id and rows:
+                _write_partition(scats_id, year, month, rows)
+                rows = []
+            scats_id = row['NB_SCATS_SITE']
+            rows.append(row)
+            row_count += 1
+        if rows:
+            _write_partition(scats_id, year, month, rows)
+
+    with transaction.atomic(using=scats_database()):
+        ArchivedMonth.objects.update_or_create(
+            month=first_day, defaults={'row_count': row_count}
+        )
+        if databases == [scats_database()]:
+            _delete_month(scats_database(), first_day, last_day)
+
+    if databases != [scats_database()]:
+        for using in databases:
+            with transaction.atomic(using=using):
+                _delete_month(using, first_day, last_day)
+
+    return row_count
+
+
+def _delete_month(using, first_day, last_day):
+    Scats.objects.using(using).filter(
+        QT_INTERVAL_COUNT__gte=first_day,
+        QT_INTERVAL_COUNT__lte=last_day
+    ).delete()
+
+
+def read_rows(scats_id, from_date, to_date, detectors=None, day_filter=None):
+    """
+    Read archived Scats rows in the same format and order as
+    Scats.objects.filter(...).values().
+
+    Only the partitions of the site and months in the range are opened, and
+    the date, day filter (see holidays.DayFilter) and detector predicates
+    are pushed down to the Parquet reader.
+    """
+    import pyarrow.dataset as ds
+
+    paths = [
+        partition_path(scats_id, year, month)
+        for year, month in iter_months(from_date, to_date)
+    ]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return []
+
+    predicate = (
+        (ds.field('QT_INTERVAL_COUNT') >= from_date)
+        & (ds.field('QT_INTERVAL_COUNT') <= to_date)
+    )
+    if detectors is not None:
+        predicate = predicate & ds.field('NB_DETECTOR').isin(list(detectors))
+    if day_filter is not None:
+        predicate = predicate & ds.field('QT_INTERVAL_COUNT').isin(
+            [day for day in _days(from_date, to_date) if day_filter.matches(day)]
+        )
+
+    table = ds.dataset(paths, schema=archive_schema(), format='parquet').to_table(
+        filter=predicate
+    ).sort_by([('QT_INTERVAL_COUNT', 'ascending'), ('NB_DETECTOR', 'ascending')])
+
+    return table.to_pylist()
+
+
+def daily_totals(year, month):
+    """
+    (NB_SCATS_SITE, QT_INTERVAL_COUNT, total, NM_REGION) of every site and
+    day of an archived month, total being the sum of the non-negative
+    QT_VOLUME_24HOUR of its detectors. Grouped by the Parquet reader
+    without building rows.
+    """
+    import pyarrow.dataset as ds
+
+    # Every site partition of the month, without files being written.
+    paths = glob.glob(os.path.join(
+        settings.SCATS_ARCHIVE_DIR, f'month={month_key(year, month)}', 'site=*', 'part-0.parquet'
+    ))
+    if not paths:
+        return []
+
+    table = ds.dataset(paths, schema=archive_schema(), format='parquet').to_table(
+        columns=['NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'QT_VOLUME_24HOUR', 'NM_REGION'],
+        filter=ds.field('QT_VOLUME_24HOUR') >= 0,
+    ).group_by(['NB_SCATS_SITE', 'QT_INTERVAL_COUNT']).aggregate([
+        ('QT_VOLUME_24HOUR', 'sum'), ('NM_REGION', 'max'),
+    ])
+    return list(zip(
+        table['NB_SCATS_SITE'].to_pylist(),
+        table['QT_INTERVAL_COUNT'].to_pylist(),
+        table['QT_VOLUME_24HOUR_sum'].to_pylist(),
+        table['NM_REGION_max'].to_pylist(),
+    ))
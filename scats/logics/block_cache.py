@@ -0,0 +1,345 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .cube_store import CUBE_DTYPE
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # multiprocessing.shared_memory needs Python 3.8+.
+    resource_tracker = shared_memory = None
+
+# Every block is a shared memory segment named after its site, month and
+# ingest manifest version, holding a header followed by the cube of the
+# site-month (see cube_store.CUBE_DTYPE). 'ready' is set once the cube has
+# been copied in, so other workers never read a half written block.
+# 'created' is the time.time() at which the segment was created.
+HEADER_DTYPE = np.dtype([
+    ('ready', np.int64),
+    ('days', np.int64),
+    ('detectors', np.int64),
+    ('created', np.float64),
+])
+
+# Segments stay mapped in a worker after use. Evicted segments are only
+# freed by the OS once no worker maps them any more.
+MAX_ATTACHED_BLOCKS = 256
+
+# A worker records the access time of a block in the index at most once
+# every TOUCH_INTERVAL seconds, so LRU order is only that precise. Hits are
+# counted in memory and written with the next write to the index.
+TOUCH_INTERVAL = 1.0
+
+# A segment still not ready, or not in the index, this many seconds after it
+# was created was left by a worker that died or failed while publishing it,
+# and is unlinked by the next worker that needs the block.
+PUBLISH_TIMEOUT = 60.0
+
+_local = threading.local()
+_lock = threading.Lock()
+_attached = OrderedDict()
+_touched = {}
+_pending = Counter()
+
+
+def is_enabled():
+    return shared_memory is not None and getattr(settings, 'SCATS_BLOCK_CACHE_MAX_BYTES', 0) > 0
+
+
+def block_name(scats_id, year, month, version):
+    return '%s_%s_%d%02d_%s' % (
+        settings.SCATS_BLOCK_CACHE_PREFIX, scats_id, year, month, version
+    )
+
+
+def _index_path():
+    return getattr(settings, 'SCATS_BLOCK_CACHE_INDEX', None) or os.path.join(
+        tempfile.gettempdir(), f'{settings.SCATS_BLOCK_CACHE_PREFIX}_index.sqlite3'
+    )
+
+
+def _index():
+    """
+    Per-thread connection to the host-wide sqlite index of the blocks,
+    used for LRU eviction and metrics.
+    """
+    path = _index_path()
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        # The index only holds recency and metrics, which may be lost with
+        # the host: skip the fsync on every write.
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS blocks '
+            '(name TEXT PRIMARY KEY, size INTEGER, last_access REAL)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS metrics (name TEXT PRIMARY KEY, value INTEGER)'
+        )
+        _local.connection, _local.path = connection, path
+    return connection
+
+
+def _increment(connection, metric, value=1):
+    connection.execute(
+        'INSERT INTO metrics VALUES (?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+        (metric, value)
+    )
+
+
+def _count(metric):
+    with _lock:
+        _pending[metric] += 1
+
+
+def _flush_metrics(connection):
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    for metric, value in pending.items():
+        _increment(connection, metric, value)
+
+
+def _untrack(shm):
+    # Blocks outlive the worker that created or attached them. Stop the
+    # resource tracker from unlinking them when the worker exits.
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Still referenced by an array in use, closed on garbage collection.
+        pass
+
+
+def _keep_attached(name, shm):
+    with _lock:
+        _attached[name] = shm
+        _attached.move_to_end(name)
+        while len(_attached) > MAX_ATTACHED_BLOCKS:
+            evicted, shm = _attached.popitem(last=False)
+            _touched.pop(evicted, None)
+            _close(shm)
+
+
+def _detach(name):
+    with _lock:
+        shm = _attached.pop(name, None)
+        _touched.pop(name, None)
+    if shm is not None:
+        _close(shm)
+
+
+def _as_cube(shm):
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+    cube = np.ndarray(
+        (int(header['days']), int(header['detectors'])), dtype=CUBE_DTYPE,
+        buffer=shm.buf, offset=HEADER_DTYPE.itemsize
+    )
+    cube.flags.writeable = False
+    return cube
+
+
+def _attach(name):
+    with _lock:
+        shm = _attached.get(name)
+    if shm is None:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        _untrack(shm)
+        if np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)['ready'] != 1:
+            shm.close()
+            return None
+    _keep_attached(name, shm)
+    return _as_cube(shm)
+
+
+def _is_stale(name):
+    # Whether the segment of a block was left by a worker that died or
+    # failed while publishing it (see PUBLISH_TIMEOUT).
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    _untrack(shm)
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf).copy()
+    shm.close()
+    if time.time() - header['created'] < PUBLISH_TIMEOUT:
+        return False
+    return header['ready'] != 1 or _index().execute(
+        'SELECT 1 FROM blocks WHERE name = ?', (name,)
+    ).fetchone() is None
+
+
+def _create(name, size):
+    # New segment for a block, or None if another worker is building it.
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        if not _is_stale(name):
+            return None
+    _detach(name)
+    _unlink(name)
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        return None
+
+
+def _publish(name, cube):
+    size = HEADER_DTYPE.itemsize + cube.nbytes
+    if size > settings.SCATS_BLOCK_CACHE_MAX_BYTES:
+        return cube
+    shm = _create(name, size)
+    if shm is None:
+        return cube
+    _untrack(shm)
+
+    now = time.time()
+    try:
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['created'] = now
+        header['days'], header['detectors'] = cube.shape
+        np.ndarray(
+            cube.shape, dtype=CUBE_DTYPE, buffer=shm.buf, offset=HEADER_DTYPE.itemsize
+        )[...] = cube
+        header['ready'] = 1
+        del header
+
+        connection = _index()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)', (name, size, now)
+            )
+            _evict(connection, settings.SCATS_BLOCK_CACHE_MAX_BYTES)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+    except BaseException:
+        # Not in the index: no other worker would ever evict it.
+        _close(shm)
+        _unlink(name)
+        raise
+    _keep_attached(name, shm)
+    with _lock:
+        _touched[name] = now
+    return _as_cube(shm)
+
+
+def _unlink(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    # unlink() also unregisters the segment from the resource tracker.
+    shm.close()
+    shm.unlink()
+
+
+def _evict(connection, max_bytes):
+    total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM blocks').fetchone()[0]
+    while total > max_bytes:
+        name, size = connection.execute(
+            'SELECT name, size FROM blocks ORDER BY last_access LIMIT 1'
+        ).fetchone()
+        _unlink(name)
+        connection.execute('DELETE FROM blocks WHERE name = ?', (name,))
+        _increment(connection, 'evictions')
+        total -= size
+
+
+def get_block(scats_id, year, month, version, load):
+    """
+    Cube of a site-month from shared memory. On a miss, load() builds
+    the cube, which is then published for every worker on the host.
+    The returned array is read-only.
+
+    A hit only reads the index, unless the block was last touched by this
+    worker more than TOUCH_INTERVAL seconds ago.
+    """
+    name = block_name(scats_id, year, month, version)
+    cube = _attach(name)
+    connection = _index()
+    if cube is not None:
+        now = time.time()
+        with _lock:
+            touch = now - _touched.get(name, 0) >= TOUCH_INTERVAL
+        if touch:
+            indexed = connection.execute(
+                'UPDATE blocks SET last_access = ? WHERE name = ?', (now, name)
+            ).rowcount
+        else:
+            indexed = connection.execute(
+                'SELECT 1 FROM blocks WHERE name = ?', (name,)
+            ).fetchone()
+        if indexed:
+            _count('hits')
+            if touch:
+                with _lock:
+                    _touched[name] = now
+                _flush_metrics(connection)
+            return cube
+        # Evicted by another worker while still mapped here.
+        del cube
+        _detach(name)
+
+    _count('misses')
+    _flush_metrics(connection)
+    return _publish(name, load())
+
+
+def stats():
+    """
+    Size and metrics of the cache. Hits not yet written by other workers
+    are not counted.
+    """
+    connection = _index()
+    _flush_metrics(connection)
+    blocks, size = connection.execute(
+        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blocks'
+    ).fetchone()
+    metrics = dict(connection.execute('SELECT name, value FROM metrics').fetchall())
+    return {
+        'blocks': blocks,
+        'bytes': size,
+        'max_bytes': settings.SCATS_BLOCK_CACHE_MAX_BYTES,
+        'hits': metrics.get('hits', 0),
+        'misses': metrics.get('misses', 0),
+        'evictions': metrics.get('evictions', 0),
+    }
+
+
+def clear():
+    """
+    Unlink every block and reset the metrics.
+    """
+    connection = _index()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        _evict(connection, 0)
+        connection.execute('DELETE FROM metrics')
+        with _lock:
+            _pending.clear()
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
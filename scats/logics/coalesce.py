@@ -0,0 +1,86 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from scats.routers import scats_database
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, compute):
+    """
+    Run compute() once for concurrent calls with the same key in this
+    process. The first caller computes, the others wait for and share its
+    result (or exception).
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _flights[key] = _Flight()
+
+    if not is_leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = compute()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result
+
+
+def advisory_lock_id(key):
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'big', signed=True)
+
+
+@contextmanager
+def advisory_lock(key):
+    """
+    Hold a Postgres advisory lock on key on the scats database, so that
+    one worker across all hosts computes a result at a time.
+
+    Waits at most settings.SCATS_COALESCE_TIMEOUT seconds and then goes
+    ahead without the lock, so a stuck worker only costs a duplicate
+    computation. Does nothing on other database backends.
+    """
+    connection = connections[scats_database()]
+    if connection.vendor != 'postgresql':
+        yield
+        return
+
+    lock_id = advisory_lock_id(key)
+    deadline = time.monotonic() + settings.SCATS_COALESCE_TIMEOUT
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+            is_locked = cursor.fetchone()[0]
+            if is_locked or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if is_locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
@@ -0,0 +1,115 @@
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+
+from .result_cache import get_cached, get_or_compute
+from .results import result_etag, seasonality_params, seasonality_result
+from .seasonality_analysis import total_json
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """
+    The process pool of this web worker, started on first use, or None if
+    SCATS_CORRIDOR_WORKERS is below 2, as one process would compute the
+    sites one after the other like the request. Processes are spawned
+    rather than forked, so they do not inherit the database connections,
+    the sqlite connection of the block cache index or the mapped cubes of
+    the web worker.
+    """
+    global _pool
+    if settings.SCATS_CORRIDOR_WORKERS < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.SCATS_CORRIDOR_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def corridor_etag(scats_ids, from_date, to_date, detectors, total=False, day_filter=None):
+    """
+    Strong ETag of a corridor result, from the ETags of its sites.
+    """
+    etags = [
+        result_etag(
+            'seasonality', scats_id, from_date, to_date, seasonality_params(detectors, day_filter)
+        )
+        for scats_id in scats_ids
+    ]
+    key = ','.join(etags + ['total' if total else ''])
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()
+
+
+def site_results(scats_ids, from_date, to_date, detectors, day_filter=None):
+    """
+    {scats_id: encoded seasonality result, or None if there is no data}.
+    Results not cached are computed in the process pool and cached here.
+    """
+    params = seasonality_params(detectors, day_filter)
+    contents = {
+        scats_id: get_cached('seasonality', scats_id, from_date, to_date, params)
+        for scats_id in scats_ids
+    }
+    missing = [scats_id for scats_id in scats_ids if contents[scats_id] is None]
+
+    pool = _get_pool() if len(missing) > 1 else None
+    if pool is None:
+        for scats_id in missing:
+            contents[scats_id] = seasonality_result(
+                scats_id, from_date, to_date, detectors, day_filter
+            )
+        return contents
+
+    try:
+        futures = {
+            scats_id: pool.submit(
+                seasonality_result, scats_id, from_date, to_date, detectors, day_filter
+            )
+            for scats_id in missing
+        }
+        for scats_id, future in futures.items():
+            contents[scats_id] = get_or_compute(
+                'seasonality', scats_id, from_date, to_date, params, future.result
+            )
+    except BrokenProcessPool:
+        # A pool process died, the next request starts a new pool.
+        _reset_pool()
+        raise
+    return contents
+
+
+def corridor_result(scats_ids, from_date, to_date, detectors, total=False, day_filter=None):
+    """
+    Encoded JSON response of SeasonalityAnalysisView for several sites:
+    the result of each site (null without data) and, if total, the daily
+    sums of the sites. Returns (content, number of sites with data), or
+    (None, 0) if no site has data.
+    """
+    contents = site_results(scats_ids, from_date, to_date, detectors, day_filter)
+    results = [contents[scats_id] for scats_id in scats_ids if contents[scats_id] is not None]
+    if not results:
+        return None, 0
+
+    content = b'{"sites":{%s}' % b','.join(
+        b'"%d":%s' % (scats_id, contents[scats_id] or b'null') for scats_id in scats_ids
+    )
+    if total:
+        content += b',"total":%s' % total_json(results)
+    return content + b'}', len(results)
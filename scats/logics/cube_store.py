@@ -0,0 +1,240 @@
+import calendar
+import logging
+import os
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+VOLUME_COLUMNS = [f'V{str(i).zfill(2)}' for i in range(96)]
+
+# Volumes are stored as int16. NULL volumes are stored as the smallest int16
+# so that negative error sentinels coming from SCATS are kept as they are.
+NULL_VOLUME = np.iinfo(np.int16).min
+
+# One cube holds a whole month of a single site.
+# Shape is (days in month, number of detectors) and every cell is one row of
+# the Scats table. 'valid' is False for day/detector pairs with no row.
+CUBE_DTYPE = np.dtype([
+    ('valid', np.bool_),
+    ('id', np.int64),
+    ('volumes', np.int16, (96,)),
+    ('NM_REGION', 'S10'),
+    ('CT_RECORDS', np.int16),
+    ('QT_VOLUME_24HOUR', np.int32),
+    ('CT_ALARM_24HOUR', np.int16),
+])
+
+
+def is_enabled():
+    return bool(getattr(settings, 'SCATS_CUBE_STORE_DIR', None))
+
+
+def cube_path(scats_id, year, month):
+    return os.path.join(
+        settings.SCATS_CUBE_STORE_DIR,
+        str(scats_id),
+        f'{year}-{str(month).zfill(2)}.npy'
+    )
+
+
+def iter_months(from_date, to_date):
+    """
+    Yield (year, month) pairs covering from_date to to_date inclusive.
+    """
+    year, month = from_date.year, from_date.month
+    while (year, month) <= (to_date.year, to_date.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def month_ranges(from_date, to_date):
+    """
+    Yield (first day, last day) of every month between from_date and
+    to_date inclusive, clipped to the range.
+    """
+    for year, month in iter_months(from_date, to_date):
+        yield (
+            max(from_date, date(year, month, 1)),
+            min(to_date, date(year, month, calendar.monthrange(year, month)[1])),
+        )
+
+
+def build_cube(rows, year, month):
+    """
+    Build a cube from Scats rows (dicts as returned by .values()) of
+    a single site and month.
+    """
+    days = calendar.monthrange(year, month)[1]
+    nb_detectors = max([row['NB_DETECTOR'] for row in rows], default=0)
+    cube = np.zeros((days, nb_detectors), dtype=CUBE_DTYPE)
+
+    for row in rows:
+        cell = cube[row['QT_INTERVAL_COUNT'].day - 1, row['NB_DETECTOR'] - 1]
+        volumes = [
+            NULL_VOLUME if row[column] is None else row[column]
+            for column in VOLUME_COLUMNS
+        ]
+        if min(volumes) < NULL_VOLUME or max(volumes) > np.iinfo(np.int16).max:
+            raise ValueError(
+                f"Volumes of {row['NB_SCATS_SITE']}, {row['QT_INTERVAL_COUNT']}, "
+                f"{row['NB_DETECTOR']} do not fit in int16."
+            )
+
+        cell['valid'] = True
+        cell['id'] = row['id']
+        cell['volumes'] = volumes
+        cell['NM_REGION'] = row['NM_REGION'].encode()
+        cell['CT_RECORDS'] = row['CT_RECORDS']
+        cell['QT_VOLUME_24HOUR'] = row['QT_VOLUME_24HOUR']
+        cell['CT_ALARM_24HOUR'] = row['CT_ALARM_24HOUR']
+
+    return cube
+
+
+def write_cube(scats_id, year, month, cube):
+    """
+    Write a cube to disk.
+
+    The file is replaced atomically so that workers which still have the
+    old file mapped keep reading a consistent copy.
+    """
+    path = cube_path(scats_id, year, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, cube)
+    os.replace(tmp_path, path)
+
+
+def write_site_months(site_months):
+    """
+    (Re)build the cubes of the given (scats_id, year, month) triples
+    from the database. Called by the ingestion tools after loading data.
+    """
+    from scats.models import Scats
+    from scats.routers import site_database
+
+    if not is_enabled():
+        return
+
+    for scats_id, year, month in sorted(set(site_months)):
+        first_day = date(year, month, 1)
+        last_day = date(year, month, calendar.monthrange(year, month)[1])
+        rows = list(
+            Scats.objects.using(site_database(scats_id)).filter(
+                NB_SCATS_SITE=scats_id,
+                QT_INTERVAL_COUNT__gte=first_day,
+                QT_INTERVAL_COUNT__lte=last_day,
+            ).order_by('QT_INTERVAL_COUNT', 'NB_DETECTOR').values()
+        )
+        try:
+            cube = build_cube(rows, year, month)
+        except ValueError as e:
+            # Leave this site-month to the database.
+            logger.warning('Cube of site %s for %d-%02d not written: %s', scats_id, year, month, e)
+            remove_cube(scats_id, year, month)
+            continue
+        write_cube(scats_id, year, month, cube)
+
+
+def remove_cube(scats_id, year, month):
+    try:
+        os.remove(cube_path(scats_id, year, month))
+    except FileNotFoundError:
+        pass
+
+
+def open_cube(scats_id, year, month):
+    """
+    Map a cube read-only. Returns None if it does not exist.
+
+    Pages are shared through the OS page cache by every process that maps
+    the same file, so hot sites are only held in memory once per host.
+    """
+    if not is_enabled():
+        return None
+    try:
+        return np.load(cube_path(scats_id, year, month), mmap_mode='r')
+    except FileNotFoundError:
+        return None
+
+
+def read_rows(scats_id, from_date, to_date, detectors=None, day_filter=None):
+    """
+    Read Scats rows from the cube store, in the same format and order as
+    Scats.objects.filter(...).values(). Only the days matching day_filter
+    (see holidays.DayFilter) are read.
+
+    This is not zero-copy: every row is copied out of the mapped cube into
+    a dict of Python objects, like rows from the database. Analyses that
+    can work on arrays use the cubes themselves (see
+    data_source.get_scats_cubes).
+
+    Returns None if any month in the range is missing from the store,
+    in which case the caller should read from the database instead.
+    """
+    cubes = []
+    for year, month in iter_months(from_date, to_date):
+        cube = open_cube(scats_id, year, month)
+        if cube is None:
+            return None
+        cubes.append((year, month, cube))
+    return rows_from_cubes(scats_id, from_date, to_date, cubes, detectors, day_filter)
+
+
+def rows_from_cubes(scats_id, from_date, to_date, cubes, detectors=None, day_filter=None):
+    """
+    Scats rows between from_date and to_date from a list of
+    (year, month, cube) covering the range, of the days matching
+    day_filter.
+    """
+    rows = []
+    for year, month, cube in cubes:
+        first_day = max(from_date, date(year, month, 1))
+        last_day = min(to_date, date(year, month, cube.shape[0]))
+        days = cube[first_day.day - 1:last_day.day]
+
+        for day_index, day_cube in enumerate(days):
+            qt_interval_count = first_day + timedelta(days=day_index)
+            if day_filter is not None and not day_filter.matches(qt_interval_count):
+                continue
+            for detector_index in np.flatnonzero(day_cube['valid']):
+                nb_detector = int(detector_index) + 1
+                if detectors is not None and nb_detector not in detectors:
+                    continue
+                rows.append(
+                    cube_row(scats_id, qt_interval_count, nb_detector, day_cube[detector_index])
+                )
+    return rows
+
+
+def select_days(cube, first_day, day_filter):
+    """
+    Copy of the days of cube, the first of which is first_day, with the
+    cells of the days not matching day_filter left empty. Only the matching
+    days are copied, so the pages of a mapped cube holding excluded days
+    only are never read.
+    """
+    mask = day_filter.day_mask(first_day, cube.shape[0])
+    selected = np.zeros(cube.shape, dtype=cube.dtype)
+    selected[mask] = cube[mask]
+    return selected
+
+
+def cube_row(scats_id, qt_interval_count, nb_detector, cell):
+    row = {
+        'id': int(cell['id']),
+        'NB_SCATS_SITE': scats_id,
+        'QT_INTERVAL_COUNT': qt_interval_count,
+        'NB_DETECTOR': nb_detector,
+    }
+    for column, volume in zip(VOLUME_COLUMNS, cell['volumes'].tolist()):
+        row[column] = None if volume == NULL_VOLUME else volume
+    row['NM_REGION'] = cell['NM_REGION'].decode()
+    row['CT_RECORDS'] = int(cell['CT_RECORDS'])
+    row['QT_VOLUME_24HOUR'] = int(cell['QT_VOLUME_24HOUR'])
+    row['CT_ALARM_24HOUR'] = int(cell['CT_ALARM_24HOUR'])
+    return row
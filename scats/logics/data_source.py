@@ -0,0 +1,120 @@
+from scats.models import Scats
+from scats.routers import read_database
+from . import archive, block_cache, cube_store
+from .ingest import month_versions
+
+
+def get_scats_rows(scats_id, from_date, to_date, detectors=None, day_filter=None):
+    """
+    Return the Scats rows of a site between from_date and to_date
+    (inclusive) ordered by QT_INTERVAL_COUNT and NB_DETECTOR, as dicts.
+    Only the days matching day_filter (see holidays.DayFilter) are read.
+
+    With the block cache enabled, rows are sliced out of the site-month
+    cubes held in shared memory, and a site-month missing from it is loaded
+    whole whatever day_filter. Otherwise they are read from the cube
+    store when every month of the range is available there, or else
+    archived months are read from the Parquet archive and the rest from
+    the database, preferably from a read replica.
+    """
+    if block_cache.is_enabled():
+        cubes = get_scats_cubes(scats_id, from_date, to_date)
+        return cube_store.rows_from_cubes(scats_id, from_date, to_date, cubes, detectors, day_filter)
+
+    return _read_rows(scats_id, from_date, to_date, detectors, day_filter)
+
+
+def get_scats_cubes(scats_id, from_date, to_date, detectors=None, day_filter=None):
+    """
+    Return (year, month, cube) of every month between from_date and to_date
+    (see cube_store.CUBE_DTYPE), from the block cache, the cube store or
+    else built from rows. Cells outside the range, of other detectors
+    than the given ones or of days not matching day_filter may be empty.
+    """
+    if block_cache.is_enabled():
+        versions = month_versions(scats_id, from_date, to_date)
+        return [
+            (year, month, block_cache.get_block(
+                scats_id, year, month, versions.get((year, month), 0),
+                lambda: _load_cube(scats_id, year, month)
+            ))
+            for year, month in cube_store.iter_months(from_date, to_date)
+        ]
+
+    cubes = []
+    for year, month in cube_store.iter_months(from_date, to_date):
+        cube = cube_store.open_cube(scats_id, year, month)
+        if cube is None:
+            first_day, last_day = archive.month_range(year, month)
+            rows = _read_rows(
+                scats_id, max(first_day, from_date), min(last_day, to_date), detectors, day_filter
+            )
+            cube = cube_store.build_cube(rows, year, month)
+        cubes.append((year, month, cube))
+    return cubes
+
+
+def _load_cube(scats_id, year, month):
+    cube = cube_store.open_cube(scats_id, year, month)
+    if cube is not None:
+        return cube
+    first_day, last_day = archive.month_range(year, month)
+    return cube_store.build_cube(_read_rows(scats_id, first_day, last_day), year, month)
+
+
+def _read_rows(scats_id, from_date, to_date, detectors=None, day_filter=None):
+    rows = cube_store.read_rows(scats_id, from_date, to_date, detectors, day_filter)
+    if rows is not None:
+        return rows
+
+    using = read_database(scats_id, from_date, to_date)
+    archived = archive.archived_months(from_date, to_date)
+    if not archived:
+        return _read_database_rows(scats_id, from_date, to_date, detectors, using, day_filter)
+
+    rows = []
+    for is_archived, segment_from, segment_to in _segments(from_date, to_date, archived):
+        if is_archived:
+            rows += archive.read_rows(scats_id, segment_from, segment_to, detectors, day_filter)
+        else:
+            rows += _read_database_rows(
+                scats_id, segment_from, segment_to, detectors, using, day_filter
+            )
+    return rows
+
+
+def _segments(from_date, to_date, archived):
+    """
+    Split from_date to to_date into consecutive (is_archived, from, to)
+    segments of archived and non-archived months.
+    """
+    segments = []
+    for year, month in cube_store.iter_months(from_date, to_date):
+        is_archived = (year, month) in archived
+        first_day, last_day = archive.month_range(year, month)
+        first_day, last_day = max(first_day, from_date), min(last_day, to_date)
+        if segments and segments[-1][0] == is_archived:
+            segments[-1][2] = last_day
+        else:
+            segments.append([is_archived, first_day, last_day])
+    return segments
+
+
+def _read_database_rows(scats_id, from_date, to_date, detectors=None, using=None, day_filter=None):
+    scats_data = Scats.objects.using(using).filter(
+        NB_SCATS_SITE=scats_id,
+        QT_INTERVAL_COUNT__gte=from_date,
+        QT_INTERVAL_COUNT__lte=to_date
+    )
+    if day_filter is not None:
+        # Excluded days are left out by the date predicate, so they are
+        # never read or transferred.
+        scats_data = scats_data.filter(day_filter.q('QT_INTERVAL_COUNT', from_date, to_date))
+    if detectors is not None:
+        scats_data = scats_data.filter(NB_DETECTOR__in=detectors)
+
+    # (NB_SCATS_SITE, QT_INTERVAL_COUNT, NB_DETECTOR) is unique,
+    # so no .distinct() is needed.
+    scats_data = scats_data.order_by('QT_INTERVAL_COUNT', 'NB_DETECTOR')
+
+    return list(scats_data.values())
@@ -0,0 +1,62 @@
+from datetime import date
+
+import numpy as np
+
+DEFAULT_RANKS = [30, 100]
+MAX_RANK = 1000
+
+
+def design_volumes(partials, means, ranks):
+    """
+    Design volumes of consecutive seasonality partials: the average daily
+    traffic over the days with data (AADT for a year), and for each rank
+    the rank-th highest hourly volume, its K-factor (volume / AADT) and
+    its day and hour.
+
+    Hourly volumes are the filled daily volumes of the partials (see
+    SeasonalityPartial.volumes) summed by hour. Only the max(ranks)
+    highest hours seen so far are kept, selected with a partial sort after
+    each partial.
+    """
+    top = max(ranks)
+    values = np.zeros(0)
+    keys = np.zeros(0, np.int64)  # day ordinal * 24 + hour
+    total = 0.0
+    nb_days = 0
+    for partial in partials:
+        hourly = partial.volumes(means)[:, :96].reshape(len(partial.days), 24, 4).sum(axis=2)
+        total += hourly.sum()
+        nb_days += len(partial.days)
+        values = np.concatenate([values, hourly.ravel()])
+        keys = np.concatenate([keys, (partial.days[:, np.newaxis] * 24 + np.arange(24)).ravel()])
+        if len(values) > top:
+            keep = np.argpartition(-values, top - 1)[:top]
+            values, keys = values[keep], keys[keep]
+
+    if nb_days == 0:
+        return None
+
+    # Highest first, earliest first among equal volumes.
+    order = np.lexsort((keys, -values))
+    values, keys = values[order].tolist(), keys[order].tolist()
+    aadt = total / nb_days
+
+    design_hours = []
+    for rank in ranks:
+        if rank > len(values):
+            design_hours.append({'rank': rank, 'volume': None, 'K': None})
+            continue
+        day, hour = divmod(keys[rank - 1], 24)
+        design_hours.append({
+            'rank': rank,
+            'volume': values[rank - 1],
+            'K': round(values[rank - 1] / aadt, 4) if aadt else None,
+            'QT_INTERVAL_COUNT': date.fromordinal(day).isoformat(),
+            'hour': hour,
+        })
+
+    return {
+        'NB_DAYS': nb_days,
+        'AADT': round(aadt, 1),
+        'design_hours': design_hours,
+    }
@@ -0,0 +1,117 @@
+import csv
+import gzip
+import math
+import os
+import tempfile
+from datetime import date
+
+import boto3
+from django.conf import settings
+
+from scats.models import Scats
+from .cube_store import month_ranges
+from .data_source import get_scats_rows
+
+# Same columns as the extract endpoint.
+EXPORT_COLUMNS = [field.name for field in Scats._meta.fields]
+
+
+def export_cost(params):
+    """
+    Scats credit points charged for an export: one per site and started
+    7 days, like the equivalent extract requests.
+    """
+    days = (date.fromisoformat(params['to']) - date.fromisoformat(params['from'])).days + 1
+    return len(params['scats_ids']) * math.ceil(days / 7)
+
+
+def export_key(job_id):
+    return f'exports/scats-export-{job_id}.csv.gz'
+
+
+def local_path(key):
+    return os.path.join(settings.SCATS_EXPORT_DIR, key)
+
+
+def write_export(f, scats_ids, from_date, to_date):
+    """
+    Write Scats rows of the sites between from_date and to_date as gzipped
+    CSV to the binary file f. Only one site-month is held in memory at a
+    time. Returns the number of rows written.
+    """
+    row_count = 0
+    with gzip.open(f, 'wt', newline='') as gz:
+        writer = csv.writer(gz)
+        writer.writerow(EXPORT_COLUMNS)
+        for scats_id in scats_ids:
+            for first_day, last_day in month_ranges(from_date, to_date):
+                for row in get_scats_rows(scats_id, first_day, last_day):
+                    writer.writerow([row[column] for column in EXPORT_COLUMNS])
+                    row_count += 1
+    return row_count
+
+
+def run_export(job):
+    """
+    Write the export of a job to SCATS_EXPORT_DIR, or else upload it to the
+    storage bucket. Returns the storage key, or None if there is no data.
+    """
+    key = export_key(job.pk)
+    if settings.SCATS_EXPORT_DIR:
+        path = local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+    else:
+        fd, tmp_path = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(fd)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            row_count = write_export(
+                f, job.params['scats_ids'],
+                date.fromisoformat(job.params['from']),
+                date.fromisoformat(job.params['to']),
+            )
+        if row_count == 0:
+            return None
+
+        if settings.SCATS_EXPORT_DIR:
+            os.replace(tmp_path, path)
+        else:
+            # upload_file streams the file in multipart chunks.
+            _s3_client().upload_file(tmp_path, settings.AWS_STORAGE_BUCKET_NAME, key)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return key
+
+
+def delete_export(key):
+    """
+    Delete an export written by run_export.
+    """
+    if settings.SCATS_EXPORT_DIR:
+        try:
+            os.remove(local_path(key))
+        except FileNotFoundError:
+            pass
+    else:
+        _s3_client().delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+
+
+def _s3_client():
+    s3 = boto3.resource(
+        service_name='s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    )
+    return s3.meta.client
+
+
+def presigned_url(key):
+    return _s3_client().generate_presigned_url(
+        ClientMethod='get_object', ExpiresIn=3600,
+        Params={
+            'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
+            'Key': key,
+        },
+    )
@@ -0,0 +1,134 @@
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from scats.models import ArchivedMonth, MonthlyFactor, Scats
+from scats.routers import scats_database, scats_row_databases
+from . import archive
+from .cube_store import iter_months
+
+
+def latest_month():
+    """
+    First day of the latest month with Scats data, in the Scats table or
+    in the archive, or None if there is no data.
+    """
+    months = [
+        Scats.objects.using(using).aggregate(day=Max('QT_INTERVAL_COUNT'))['day']
+        for using in scats_row_databases()
+    ]
+    if archive.is_enabled():
+        months.append(ArchivedMonth.objects.aggregate(month=Max('month'))['month'])
+    months = [month for month in months if month is not None]
+    if not months:
+        return None
+    return max(months).replace(day=1)
+
+
+def factor_year(last_month=None):
+    """
+    (first day, last day) of the 12 months ending with last_month, by
+    default the latest month with data, or None if there is no data.
+    """
+    if last_month is None:
+        last_month = latest_month()
+        if last_month is None:
+            return None
+    first_day = date(last_month.year - 1, last_month.month, 1) + timedelta(days=31)
+    first_day = first_day.replace(day=1)
+    next_month = date(last_month.year, last_month.month, 1) + timedelta(days=31)
+    return first_day, next_month.replace(day=1) - timedelta(days=1)
+
+
+def daily_totals(from_date, to_date):
+    """
+    (scats_ids, totals, regions): the sites with data between from_date and
+    to_date, the daily traffic of each site, (sites, days) with NaN for days
+    without data, and the region of each site. Daily traffic is the sum of
+    QT_VOLUME_24HOUR over the detectors of the day, ignoring negative
+    volumes.
+
+    The totals are grouped by the database, with one query per database
+    holding Scats rows, and by the Parquet reader for archived months.
+    """
+    archived = archive.archived_months(from_date, to_date)
+    days = []
+    for using in scats_row_databases():
+        days += Scats.objects.using(using).filter(
+            QT_INTERVAL_COUNT__gte=from_date,
+            QT_INTERVAL_COUNT__lte=to_date,
+            QT_VOLUME_24HOUR__gte=0,
+        ).values_list('NB_SCATS_SITE', 'QT_INTERVAL_COUNT').annotate(
+            total=Sum('QT_VOLUME_24HOUR'), region=Max('NM_REGION')
+        ).order_by()
+    for year, month in sorted(archived):
+        days += archive.daily_totals(year, month)
+
+    scats_ids = sorted(set(scats_id for scats_id, _, _, _ in days))
+    index = {scats_id: i for i, scats_id in enumerate(scats_ids)}
+    totals = np.full((len(scats_ids), (to_date - from_date).days + 1), np.nan)
+    regions = [''] * len(scats_ids)
+    if days:
+        sites, dates, day_totals, day_regions = zip(*days)
+        rows = np.array([index[scats_id] for scats_id in sites])
+        columns = np.array([(day - from_date).days for day in dates])
+        totals[rows, columns] = day_totals
+        for row, region in zip(rows.tolist(), day_regions):
+            regions[row] = regions[row] or region
+    return scats_ids, totals, regions
+
+
+def monthly_factors(totals, from_date, to_date):
+    """
+    (adt, nb_days, aadt) of daily totals (see daily_totals) of all sites
+    at once: the average daily traffic of each site and month, (sites,
+    months), with NaN for months without data, the number of days with
+    data, and the average over the whole range, (sites,).
+    """
+    month_starts = [
+        (max(from_date, date(year, month, 1)) - from_date).days
+        for year, month in iter_months(from_date, to_date)
+    ]
+    has_data = ~np.isnan(totals)
+    sums = np.add.reduceat(np.where(has_data, totals, 0), month_starts, axis=1)
+    nb_days = np.add.reduceat(has_data, month_starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        adt = sums / nb_days
+        aadt = sums.sum(axis=1) / nb_days.sum(axis=1)
+    return adt, nb_days, aadt
+
+
+def compute_monthly_factors(last_month=None):
+    """
+    Recompute the monthly factors of every site over the factor year and
+    replace the stored ones. Called by the ingestion tools after loading
+    data. Returns the number of factors stored.
+    """
+    dates = factor_year(last_month)
+    if dates is None:
+        return 0
+    from_date, to_date = dates
+
+    scats_ids, totals, regions = daily_totals(from_date, to_date)
+    adt, nb_days, aadt = monthly_factors(totals, from_date, to_date)
+
+    months = [date(year, month, 1) for year, month in iter_months(from_date, to_date)]
+    now = timezone.now()
+    factors = [
+        MonthlyFactor(
+            NB_SCATS_SITE=scats_id, NM_REGION=regions[i], month=month,
+            nb_days=int(nb_days[i, j]), adt=float(adt[i, j]), aadt=float(aadt[i]),
+            factor=float(adt[i, j] / aadt[i]), computed_at=now,
+        )
+        for i, scats_id in enumerate(scats_ids)
+        for j, month in enumerate(months)
+        if nb_days[i, j] and aadt[i] > 0
+    ]
+
+    with transaction.atomic(using=scats_database()):
+        MonthlyFactor.objects.all().delete()
+        MonthlyFactor.objects.bulk_create(factors, batch_size=1000)
+    return len(factors)
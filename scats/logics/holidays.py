@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Q
+
+# Victorian public holidays, including substitute days, the Friday before
+# the AFL Grand Final and Melbourne Cup day.
+PUBLIC_HOLIDAYS = frozenset([
+    # 2020
+    date(2020, 1, 1), date(2020, 1, 27), date(2020, 3, 9), date(2020, 4, 10),
+    date(2020, 4, 11), date(2020, 4, 12), date(2020, 4, 13), date(2020, 4, 25),
+    date(2020, 6, 8), date(2020, 10, 23), date(2020, 11, 3), date(2020, 12, 25),
+    date(2020, 12, 26), date(2020, 12, 28),
+    # 2021
+    date(2021, 1, 1), date(2021, 1, 26), date(2021, 3, 8), date(2021, 4, 2),
+    date(2021, 4, 3), date(2021, 4, 4), date(2021, 4, 5), date(2021, 4, 25),
+    date(2021, 6, 14), date(2021, 9, 24), date(2021, 11, 2), date(2021, 12, 25),
+    date(2021, 12, 26), date(2021, 12, 27), date(2021, 12, 28),
+    # 2022
+    date(2022, 1, 1), date(2022, 1, 3), date(2022, 1, 26), date(2022, 3, 14),
+    date(2022, 4, 15), date(2022, 4, 16), date(2022, 4, 17), date(2022, 4, 18),
+    date(2022, 4, 25), date(2022, 6, 13), date(2022, 9, 22), date(2022, 9, 23),
+    date(2022, 11, 1), date(2022, 12, 25), date(2022, 12, 26), date(2022, 12, 27),
+    # 2023
+    date(2023, 1, 1), date(2023, 1, 2), date(2023, 1, 26), date(2023, 3, 13),
+    date(2023, 4, 7), date(2023, 4, 8), date(2023, 4, 9), date(2023, 4, 10),
+    date(2023, 4, 25), date(2023, 6, 12), date(2023, 9, 29), date(2023, 11, 7),
+    date(2023, 12, 25), date(2023, 12, 26),
+    # 2024
+    date(2024, 1, 1), date(2024, 1, 26), date(2024, 3, 11), date(2024, 3, 29),
+    date(2024, 3, 30), date(2024, 3, 31), date(2024, 4, 1), date(2024, 4, 25),
+    date(2024, 6, 10), date(2024, 9, 27), date(2024, 11, 5), date(2024, 12, 25),
+    date(2024, 12, 26),
+    # 2025
+    date(2025, 1, 1), date(2025, 1, 27), date(2025, 3, 10), date(2025, 4, 18),
+    date(2025, 4, 19), date(2025, 4, 20), date(2025, 4, 21), date(2025, 4, 25),
+    date(2025, 6, 9), date(2025, 9, 26), date(2025, 11, 4), date(2025, 12, 25),
+    date(2025, 12, 26),
+])
+
+# Victorian government school terms (first and last day). School holidays
+# are the days between consecutive terms.
+SCHOOL_TERMS = [
+    (date(2020, 1, 28), date(2020, 3, 24)), (date(2020, 4, 15), date(2020, 6, 26)),
+    (date(2020, 7, 13), date(2020, 9, 18)), (date(2020, 10, 5), date(2020, 12, 18)),
+    (date(2021, 1, 27), date(2021, 4, 1)), (date(2021, 4, 19), date(2021, 6, 25)),
+    (date(2021, 7, 12), date(2021, 9, 17)), (date(2021, 10, 4), date(2021, 12, 17)),
+    (date(2022, 1, 28), date(2022, 4, 8)), (date(2022, 4, 26), date(2022, 6, 24)),
+    (date(2022, 7, 11), date(2022, 9, 16)), (date(2022, 10, 3), date(2022, 12, 20)),
+    (date(2023, 1, 27), date(2023, 4, 6)), (date(2023, 4, 24), date(2023, 6, 23)),
+    (date(2023, 7, 10), date(2023, 9, 15)), (date(2023, 10, 2), date(2023, 12, 20)),
+    (date(2024, 1, 29), date(2024, 3, 28)), (date(2024, 4, 15), date(2024, 6, 28)),
+    (date(2024, 7, 15), date(2024, 9, 20)), (date(2024, 10, 7), date(2024, 12, 20)),
+    (date(2025, 1, 28), date(2025, 4, 4)), (date(2025, 4, 22), date(2025, 7, 4)),
+    (date(2025, 7, 21), date(2025, 9, 19)), (date(2025, 10, 6), date(2025, 12, 19)),
+]
+
+# Days covered by the calendars above, to be extended every year. Days
+# outside of them cannot be excluded, so exclusions are refused for ranges
+# going past them rather than silently excluding nothing.
+CALENDAR_COVERAGE = {
+    'public_holidays': (date(2020, 1, 1), date(2025, 12, 31)),
+    'school_holidays': (SCHOOL_TERMS[0][0], SCHOOL_TERMS[-1][1]),
+}
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def is_public_holiday(day):
+    return day in PUBLIC_HOLIDAYS
+
+
+def is_school_holiday(day):
+    """
+    Whether day falls between two school terms. Days before the first or
+    after the last term of the calendar are not school holidays.
+    """
+    for (_, last_day), (next_first_day, _) in zip(SCHOOL_TERMS, SCHOOL_TERMS[1:]):
+        if last_day < day < next_first_day:
+            return True
+    return False
+
+
+EXCLUSIONS = {
+    'public_holidays': is_public_holiday,
+    'school_holidays': is_school_holiday,
+}
+
+
+class DayFilter:
+    """
+    Days of the week to keep (0 is Monday, None for all) and kinds of
+    calendar days to exclude (see EXCLUSIONS).
+    """
+    def __init__(self, weekdays=None, exclude=()):
+        self.weekdays = None if weekdays is None else tuple(sorted(set(weekdays)))
+        self.exclude = tuple(sorted(set(exclude)))
+
+    @classmethod
+    def parse(cls, days=None, exclude=None):
+        """
+        DayFilter of the 'days' (e.g. 'tue,wed,thu') and 'exclude' (e.g.
+        'public_holidays,school_holidays') parameters, or None if both are
+        empty. Raises ValueError with a message for the user.
+        """
+        weekdays = None
+        if days:
+            try:
+                weekdays = [WEEKDAYS.index(day) for day in days.lower().split(',')]
+            except ValueError:
+                raise ValueError(f"'days' must be days of {','.join(WEEKDAYS)} separated by comma.")
+
+        exclusions = exclude.lower().split(',') if exclude else []
+        if any(exclusion not in EXCLUSIONS for exclusion in exclusions):
+            raise ValueError(f"'exclude' must be {' or '.join(EXCLUSIONS)} separated by comma.")
+
+        if weekdays is None and not exclusions:
+            return None
+        return cls(weekdays, exclusions)
+
+    def check_coverage(self, from_date, to_date):
+        """
+        Raise ValueError with a message for the user if the exclusions are
+        asked for days between from_date and to_date that the calendars do
+        not cover (see CALENDAR_COVERAGE).
+        """
+        for exclusion in self.exclude:
+            first_day, last_day = CALENDAR_COVERAGE[exclusion]
+            if from_date < first_day or to_date > last_day:
+                raise ValueError(
+                    f"'exclude={exclusion}' is only available between {first_day} and {last_day}."
+                )
+
+    def key(self):
+        """
+        Encoding of the filter as parameters, parsed by from_key.
+        """
+        parts = []
+        if self.weekdays is not None:
+            parts.append('days=' + ','.join(WEEKDAYS[weekday] for weekday in self.weekdays))
+        if self.exclude:
+            parts.append('exclude=' + ','.join(self.exclude))
+        return '&'.join(parts)
+
+    @classmethod
+    def from_key(cls, key):
+        params = dict(part.split('=', 1) for part in key.split('&') if part)
+        return cls.parse(params.get('days'), params.get('exclude'))
+
+    def matches(self, day):
+        if self.weekdays is not None and day.weekday() not in self.weekdays:
+            return False
+        return not any(EXCLUSIONS[exclusion](day) for exclusion in self.exclude)
+
+    def excluded_dates(self, from_date, to_date):
+        """
+        Calendar days between from_date and to_date excluded by the filter
+        whatever their day of the week.
+        """
+        return [
+            from_date + timedelta(days=offset)
+            for offset in range((to_date - from_date).days + 1)
+            if any(
+                EXCLUSIONS[exclusion](from_date + timedelta(days=offset))
+                for exclusion in self.exclude
+            )
+        ]
+
+    def day_mask(self, first_day, nb_days):
+        """
+        Whether each of nb_days consecutive days from first_day matches.
+        """
+        return np.array([
+            self.matches(first_day + timedelta(days=offset)) for offset in range(nb_days)
+        ], dtype=np.bool_)
+
+    def q(self, field, from_date, to_date):
+        """
+        Q object of the days matching between from_date and to_date, on a
+        date field, for the SQL date predicate.
+        """
+        q = Q()
+        if self.weekdays is not None:
+            # week_day is 1 for Sunday to 7 for Saturday.
+            q &= Q(**{f'{field}__week_day__in': [(weekday + 1) % 7 + 1 for weekday in self.weekdays]})
+        excluded = self.excluded_dates(from_date, to_date)
+        if excluded:
+            q &= ~Q(**{f'{field}__in': excluded})
+        return q
@@ -0,0 +1,159 @@
+import threading
+from datetime import date
+
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from scats.models import Scats, IngestManifest
+from scats.routers import site_database
+from . import archive, cube_store, result_cache
+
+
+# Rows are upserted on the natural key in SQL, which bulk_create cannot do
+# in Django 3.2. The key is the unique constraint scats_scats_natural_key.
+NATURAL_KEY = ['NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'NB_DETECTOR']
+UPSERT_SQL = 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({key}) DO UPDATE SET {updates}'
+
+# Ingest manifest of the sites read during the current request, so that
+# the ETag, the result cache key and the replica lag check of a request
+# share one query to the primary (see ScatsConfig.ready).
+_request = threading.local()
+
+
+def bulk_create_scats(model_instances, batch_size=128):
+    """
+    Insert Scats instances, each into the database (shard) of its site.
+    Rows that already exist are updated in place and keep their id, so that
+    corrected data loaded again is kept. Of instances with the same natural
+    key, the last wins.
+
+    Raises ValueError without inserting anything if any instance falls in
+    an archived month: archived months are only read from the archive, so
+    rows loaded into the Scats table would never be returned.
+    """
+    if model_instances:
+        days = [model_instance.QT_INTERVAL_COUNT for model_instance in model_instances]
+        archived = archive.archived_months(min(days), max(days)) & set(
+            (day.year, day.month) for day in days
+        )
+        if archived:
+            raise ValueError(
+                'Scats data cannot be loaded into archived months: '
+                + ', '.join(archive.month_key(year, month) for year, month in sorted(archived))
+            )
+
+    by_database = {}
+    for model_instance in model_instances:
+        by_database.setdefault(site_database(model_instance.NB_SCATS_SITE), {})[
+            tuple(getattr(model_instance, column) for column in NATURAL_KEY)
+        ] = model_instance
+
+    for using, instances in by_database.items():
+        upsert_scats(using, list(instances.values()), batch_size)
+
+
+def upsert_scats(using, model_instances, batch_size=128):
+    """
+    Insert Scats instances into the given database in one transaction,
+    updating the rows that already exist on the natural key.
+    """
+    with transaction.atomic(using=using):
+        for start in range(0, len(model_instances), batch_size):
+            _upsert_scats(using, model_instances[start:start + batch_size])
+
+
+def _upsert_scats(using, instances):
+    connection = connections[using]
+    # The id of new rows is assigned by the database.
+    fields = [field for field in Scats._meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    sql = UPSERT_SQL.format(
+        table=quote(Scats._meta.db_table),
+        columns=', '.join(quote(field.column) for field in fields),
+        values=', '.join([row] * len(instances)),
+        key=', '.join(quote(column) for column in NATURAL_KEY),
+        updates=', '.join(
+            f'{quote(field.column)} = EXCLUDED.{quote(field.column)}'
+            for field in fields if field.column not in NATURAL_KEY
+        ),
+    )
+    params = [
+        field.get_db_prep_save(getattr(instance, field.attname), connection)
+        for instance in instances
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def start_request(**kwargs):
+    _request.manifest = {}
+
+
+def finish_request(**kwargs):
+    _request.manifest = None
+
+
+def manifest(scats_id, from_date, to_date):
+    """
+    {(year, month): (version, ingested_at)} of the ingested site-months
+    between from_date and to_date. Within a request, the manifest of a
+    site is only read once.
+    """
+    first_day = date(from_date.year, from_date.month, 1)
+    memo = getattr(_request, 'manifest', None)
+    if memo is None:
+        rows = IngestManifest.objects.filter(
+            NB_SCATS_SITE=scats_id, month__gte=first_day, month__lte=to_date,
+        ).values_list('month', 'version', 'ingested_at')
+    else:
+        if scats_id not in memo:
+            memo[scats_id] = list(
+                IngestManifest.objects.filter(NB_SCATS_SITE=scats_id).values_list(
+                    'month', 'version', 'ingested_at'
+                )
+            )
+        rows = [row for row in memo[scats_id] if first_day <= row[0] <= to_date]
+    return {
+        (month.year, month.month): (version, ingested_at)
+        for month, version, ingested_at in rows
+    }
+
+
+def month_versions(scats_id, from_date, to_date):
+    """
+    {(year, month): version} of the ingested site-months between
+    from_date and to_date.
+    """
+    return {
+        month: version
+        for month, (version, _) in manifest(scats_id, from_date, to_date).items()
+    }
+
+
+def record_ingest(site_months):
+    """
+    Bump the IngestManifest of the given (scats_id, year, month) triples.
+    """
+    now = timezone.now()
+    for scats_id, year, month in sorted(set(site_months)):
+        updated = IngestManifest.objects.filter(
+            NB_SCATS_SITE=scats_id, month=date(year, month, 1)
+        ).update(version=F('version') + 1, ingested_at=now)
+        if not updated:
+            IngestManifest.objects.create(
+                NB_SCATS_SITE=scats_id, month=date(year, month, 1), ingested_at=now
+            )
+
+
+def after_ingest(site_months):
+    """
+    Called by the ingestion tools once Scats data of the given
+    (scats_id, year, month) triples has been loaded.
+    """
+    site_months = set(site_months)
+    record_ingest(site_months)
+    cube_store.write_site_months(site_months)
+    result_cache.invalidate_site_months(site_months)
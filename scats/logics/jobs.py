@@ -0,0 +1,170 @@
+import time
+import traceback
+from collections import namedtuple
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from scats.models import AnalysisJob
+from .exports import export_cost
+
+NO_DATA_ERROR = "There was no data found. Please try again with a different request."
+TIMEOUT_ERROR = "The job did not finish in time. Please try again with a shorter range."
+
+
+def seasonality_job(job):
+    from .results import seasonality_result
+
+    return seasonality_result(
+        job.params['scats_id'],
+        date.fromisoformat(job.params['from']),
+        date.fromisoformat(job.params['to']),
+        job.params['detectors'],
+    )
+
+
+def export_job(job):
+    from .exports import run_export
+
+    return run_export(job)
+
+
+def discard_export(key):
+    from .exports import delete_export
+
+    delete_export(key)
+
+
+# compute(job) returns the result, or None if there is no data.
+# The result is stored in the 'field' of the job, and 'cost(params)'
+# credit points of 'credit_field' are deducted on success. 'discard(result)'
+# deletes what compute stored outside the database when the result is
+# not kept, or is None.
+JobKind = namedtuple('JobKind', ['compute', 'field', 'credit_field', 'cost', 'discard'])
+
+JOB_KINDS = {
+    'seasonality': JobKind(seasonality_job, 'result', 'seasonality_credit', lambda params: 1, None),
+    'export': JobKind(export_job, 'output', 'scats_credit', export_cost, discard_export),
+}
+
+CREDIT_ERRORS = {
+    'scats_credit': 'Access denied. Please purchase scats credit points or sign up for the monthly subscription.',
+    'seasonality_credit': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.',
+}
+
+
+def create_job(user, kind, params):
+    return AnalysisJob.objects.create(user=user, kind=kind, params=params)
+
+
+def claim_job():
+    """
+    Lock and mark as running the oldest pending job, or a running job whose
+    worker has not finished it within SCATS_JOB_TIMEOUT (e.g. because it
+    died). Jobs locked by other workers are skipped, so any number of
+    workers can poll the table concurrently.
+
+    Timed out jobs that have used up their SCATS_JOB_MAX_ATTEMPTS are marked
+    as failed instead, so a job that kills its worker is not retried forever.
+    """
+    now = timezone.now()
+    timed_out = Q(status=AnalysisJob.RUNNING, started_at__lt=now - settings.SCATS_JOB_TIMEOUT)
+    AnalysisJob.objects.filter(
+        timed_out, attempts__gte=settings.SCATS_JOB_MAX_ATTEMPTS
+    ).update(status=AnalysisJob.FAILED, error=TIMEOUT_ERROR, finished_at=now)
+
+    with transaction.atomic(using='default'):
+        job = AnalysisJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=AnalysisJob.PENDING)
+            | (timed_out & Q(attempts__lt=settings.SCATS_JOB_MAX_ATTEMPTS))
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = AnalysisJob.RUNNING
+        job.started_at = now
+        job.attempts = F('attempts') + 1
+        job.save(update_fields=['status', 'started_at', 'attempts'])
+    job.refresh_from_db(fields=['attempts'])
+    return job
+
+
+def _claimed(job):
+    # The job, unless it was reclaimed by another worker since.
+    return AnalysisJob.objects.filter(
+        pk=job.pk, status=AnalysisJob.RUNNING, started_at=job.started_at
+    )
+
+
+def run_job(job):
+    kind = JOB_KINDS[job.kind]
+    try:
+        content = kind.compute(job)
+    except Exception:
+        if job.attempts < settings.SCATS_JOB_MAX_ATTEMPTS:
+            _claimed(job).update(status=AnalysisJob.PENDING)
+        else:
+            _fail(job, traceback.format_exc())
+        return
+
+    if content is None:
+        _fail(job, NO_DATA_ERROR)
+        return
+
+    _succeed(job, kind, content)
+
+
+def _fail(job, error):
+    _claimed(job).update(
+        status=AnalysisJob.FAILED, error=error, finished_at=timezone.now()
+    )
+
+
+def _succeed(job, kind, content):
+    """
+    Store the result and charge the credit points in one transaction, so a
+    job is charged exactly once and only if its result is available.
+    A result the user cannot be charged for is discarded.
+    """
+    with transaction.atomic(using='default'):
+        if not _claimed(job).select_for_update().values_list('pk', flat=True):
+            return
+        user = get_user_model().objects.select_for_update().get(pk=job.user_id)
+        charged = user.subscribed or timezone.now() < user.free_until
+        if not charged:
+            cost = kind.cost(job.params)
+            if getattr(user, kind.credit_field) >= cost:
+                setattr(user, kind.credit_field, getattr(user, kind.credit_field) - cost)
+                user.save(update_fields=[kind.credit_field])
+                charged = True
+        if charged:
+            _claimed(job).update(
+                status=AnalysisJob.SUCCEEDED, error='', finished_at=timezone.now(),
+                **{kind.field: content}
+            )
+        else:
+            _fail(job, CREDIT_ERRORS[kind.credit_field])
+
+    if not charged and kind.discard is not None:
+        kind.discard(content)
+
+
+def run_worker(poll_interval=1.0, stop_when_idle=False):
+    """
+    Run jobs until interrupted, or until there are none left if
+    stop_when_idle. Returns the number of jobs run.
+    """
+    count = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            if stop_when_idle:
+                return count
+            connections.close_all()
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
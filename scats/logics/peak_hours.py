@@ -0,0 +1,91 @@
+import json
+from datetime import timedelta
+
+import numpy as np
+
+# Intervals in which the peak hours are searched: the whole hour must fall
+# within the period.
+PERIODS = {
+    'AM': (0, 48),
+    'PM': (48, 96),
+}
+
+
+def rolling_hours(volumes):
+    """
+    (hourly, highest): the volume of the hour starting at each interval and
+    its highest 15-minute volume, (..., 93), from volumes (..., 96) with
+    NaN for invalid volumes. Hours with an invalid volume are NaN.
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(volumes, 4, axis=-1)
+    return windows.sum(axis=-1), windows.max(axis=-1)
+
+
+def peak_hours(volumes):
+    """
+    Peak hour of each period (see PERIODS) of volumes (..., 96), NaN for
+    invalid volumes: {period: (start, volume, PHF)}, arrays of shape (...),
+    start being the first interval of the hour, or -1 if no hour of the
+    period is valid. The peak hour factor (PHF) is the volume of the hour
+    divided by 4 times its highest 15-minute volume, NaN if it is 0.
+    """
+    hourly, highest = rolling_hours(volumes)
+    peaks = {}
+    for period, (first, last) in PERIODS.items():
+        period_hourly = hourly[..., first:last - 3]
+        valid = ~np.isnan(period_hourly)
+        offset = np.where(valid, period_hourly, -np.inf).argmax(axis=-1)
+        start = np.where(valid.any(axis=-1), first + offset, -1)
+        index = np.maximum(start, 0)[..., np.newaxis]
+        volume = np.take_along_axis(hourly, index, axis=-1)[..., 0]
+        peak = np.take_along_axis(highest, index, axis=-1)[..., 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            phf = np.where(peak > 0, volume / (4 * peak), np.nan)
+        peaks[period] = (start, volume, phf)
+    return peaks
+
+
+def peak_rows(cube, first_day, detectors, group=''):
+    """
+    Yield the encoded JSON row of the peak hours of each day of cube (see
+    cube_store.CUBE_DTYPE) with data, the first of which is first_day. With
+    group='detector', one row per day and reporting detector, otherwise the
+    peak hours of the site total. An interval of the site total is invalid
+    if any reporting detector has an invalid (negative or NULL) volume.
+    """
+    detectors = sorted(set(d for d in detectors if 1 <= d <= cube.shape[1]))
+    index = [d - 1 for d in detectors]
+    present = cube['valid'][:, index]
+    volumes = np.where(
+        present[:, :, np.newaxis], cube['volumes'][:, index].astype(np.float64), 0
+    )
+    volumes[volumes < 0] = np.nan
+
+    if group == 'detector':
+        cells = np.argwhere(present).tolist()
+    else:
+        # The site total as a single detector.
+        cells = [[day, 0] for day in np.flatnonzero(present.any(axis=1)).tolist()]
+        volumes = volumes.sum(axis=1, keepdims=True)
+
+    peaks = {
+        period: [array.tolist() for array in arrays]
+        for period, arrays in peak_hours(volumes).items()
+    }
+    for day, column in cells:
+        row = {'QT_INTERVAL_COUNT': (first_day + timedelta(days=day)).isoformat()}
+        if group == 'detector':
+            row['NB_DETECTOR'] = detectors[column]
+        for period, (start, volume, phf) in peaks.items():
+            row.update(_peak(period, start[day][column], volume[day][column], phf[day][column]))
+        yield json.dumps(row, separators=(',', ':')).encode()
+
+
+def _peak(period, start, volume, phf):
+    if start < 0:
+        return {f'{period}_PEAK_START': None, f'{period}_PEAK_VOLUME': None, f'{period}_PHF': None}
+    return {
+        f'{period}_PEAK_START': '%02d:%02d' % divmod(start * 15, 60),
+        f'{period}_PEAK_VOLUME': int(volume),
+        f'{period}_PHF': None if np.isnan(phf) else round(phf, 3),
+    }
@@ -0,0 +1,308 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .coalesce import advisory_lock, single_flight
+from .cube_store import iter_months
+
+# Part of every result key, and so of every ETag. Bump it whenever the
+# encoding of any result changes, so that results cached and ETags sent
+# before are not served for the new format.
+RESULT_FORMAT_VERSION = 1
+
+
+class LocMemResultCache:
+    """
+    Per-process LRU cache of encoded responses, bounded by max_bytes.
+
+    Every backend implements get(key, scats_id),
+    set(key, content, scats_id, months), invalidate(scats_id, year, month)
+    and clear(). Backends shared between workers set shared = True.
+    """
+    shared = False
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._site_months = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, scats_id):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def set(self, key, content, scats_id, months):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = content
+            self._site_months[key] = (scats_id, frozenset(months))
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                self._delete(next(iter(self._entries)))
+
+    def invalidate(self, scats_id, year, month):
+        with self._lock:
+            for key, (site, months) in list(self._site_months.items()):
+                if site == scats_id and (year, month) in months:
+                    self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._site_months.clear()
+            self._size = 0
+
+    def _delete(self, key):
+        content = self._entries.pop(key, None)
+        if content is not None:
+            self._size -= len(content)
+            del self._site_months[key]
+
+
+class FileResultCache:
+    """
+    LRU cache of encoded responses in a directory, bounded by max_bytes and
+    shared by every process that can see the directory.
+
+    Entries are stored as <LOCATION>/<site>/<from month>_<to month>_<key hash>
+    so that they can be invalidated per site and month without an index.
+    Recency is tracked with the file modification time.
+
+    Each process keeps a running total of the size of the directory, and
+    only scans it to evict entries once the total is over max_bytes. Entries
+    written by other processes are counted by the next scan, which happens
+    at least every SCAN_INTERVAL seconds.
+    """
+    shared = True
+    SCAN_INTERVAL = 60
+
+    def __init__(self, location, max_bytes=512 * 1024 * 1024):
+        self.location = location
+        self.max_bytes = max_bytes
+        self._size = None
+        self._scanned_at = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key, scats_id, months):
+        months = sorted(months)
+        name = '_'.join([
+            '%d%02d' % months[0], '%d%02d' % months[-1],
+            hashlib.sha256(key.encode()).hexdigest()
+        ])
+        return os.path.join(self.location, str(scats_id), name)
+
+    def get(self, key, scats_id):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        site_dir = os.path.join(self.location, str(scats_id))
+        try:
+            names = [name for name in os.listdir(site_dir) if name.endswith(digest)]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+
+        path = os.path.join(site_dir, names[0])
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def set(self, key, content, scats_id, months):
+        if len(content) > self.max_bytes:
+            return
+        path = self._path(key, scats_id, months)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(content) - replaced
+            scan = (
+                self._size is None
+                or self._size > self.max_bytes
+                or time.monotonic() - self._scanned_at >= self.SCAN_INTERVAL
+            )
+        if scan:
+            self._evict()
+
+    def invalidate(self, scats_id, year, month):
+        site_dir = os.path.join(self.location, str(scats_id))
+        try:
+            names = os.listdir(site_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            parts = name.split('_')
+            if len(parts) != 3 or name.endswith('.tmp'):
+                continue
+            if parts[0] <= '%d%02d' % (year, month) <= parts[1]:
+                self._remove(os.path.join(site_dir, name))
+
+    def clear(self):
+        for path, size, _ in self._entries():
+            self._remove(path, size)
+
+    def _remove(self, path, size=None):
+        try:
+            if size is None:
+                size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _entries(self):
+        entries = []
+        try:
+            site_dirs = list(os.scandir(self.location))
+        except FileNotFoundError:
+            return entries
+        for site_dir in site_dirs:
+            if not site_dir.is_dir():
+                continue
+            for entry in os.scandir(site_dir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for path, entry_size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        with self._lock:
+            self._size = size
+            self._scanned_at = time.monotonic()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    The configured result cache backend (settings.SCATS_RESULT_CACHE),
+    or None if caching is disabled.
+    """
+    global _cache
+    config = getattr(settings, 'SCATS_RESULT_CACHE', None)
+    if not config or not config.get('BACKEND'):
+        return None
+    with _cache_lock:
+        if _cache is None or _cache[0] != config:
+            backend = import_string(config['BACKEND'])
+            _cache = (config, backend(**config.get('OPTIONS', {})))
+        return _cache[1]
+
+
+def data_version(scats_id, from_date, to_date):
+    """
+    Version of the Scats data of a site between from_date and to_date,
+    from the ingest manifest. Changes whenever a month of the range is
+    (re)ingested.
+    """
+    from .ingest import month_versions
+
+    versions = month_versions(scats_id, from_date, to_date)
+    return ','.join(
+        '%d%02d.%d' % (year, month, versions[year, month]) for year, month in sorted(versions)
+    )
+
+
+def result_key(kind, scats_id, from_date, to_date, params=''):
+    return ':'.join([
+        f'v{RESULT_FORMAT_VERSION}', kind, str(scats_id), f'{from_date}', f'{to_date}', str(params),
+        data_version(scats_id, from_date, to_date),
+    ])
+
+
+def get_cached(kind, scats_id, from_date, to_date, params=''):
+    """
+    Return the cached encoded result, or None.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return None
+    return cache.get(result_key(kind, scats_id, from_date, to_date, params), scats_id)
+
+
+def get_or_compute(kind, scats_id, from_date, to_date, params, compute):
+    """
+    Return the cached encoded result, or compute(), cache and return it.
+    compute() returns None when there is nothing to cache.
+
+    Concurrent requests for the same result wait for a single computation,
+    within the process and, with a shared backend, across workers through
+    a database advisory lock.
+    """
+    key = result_key(kind, scats_id, from_date, to_date, params)
+    cache = get_result_cache()
+    if cache is None:
+        return single_flight(key, compute)
+
+    content = cache.get(key, scats_id)
+    if content is not None:
+        return content
+
+    is_shared = getattr(cache, 'shared', False)
+
+    def compute_and_cache():
+        with advisory_lock(key) if is_shared else nullcontext():
+            if is_shared:
+                # Another worker may have computed it while we waited.
+                content = cache.get(key, scats_id)
+                if content is not None:
+                    return content
+            content = compute()
+            if content is not None:
+                cache.set(key, content, scats_id, list(iter_months(from_date, to_date)))
+            return content
+
+    return single_flight(key, compute_and_cache)
+
+
+def invalidate_site_months(site_months):
+    """
+    Drop cached results of the given (scats_id, year, month) triples.
+    Called by the ingestion tools after loading data.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return
+    for scats_id, year, month in set(site_months):
+        cache.invalidate(scats_id, year, month)
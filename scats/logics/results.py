@@ -0,0 +1,289 @@
+import hashlib
+import json
+
+from rest_framework.renderers import JSONRenderer
+
+from scats.serializers import ScatsSerializer
+from .cube_store import month_ranges, select_days
+from .data_source import get_scats_cubes, get_scats_rows
+from .design_volumes import design_volumes
+from .peak_hours import peak_rows
+from .result_cache import get_or_compute, result_key
+from .seasonality_analysis import (
+    SeasonalityPartial, detector_rows, percentile_json, profile_json, table_json,
+)
+
+
+def result_etag(kind, scats_id, from_date, to_date, params=''):
+    """
+    Strong ETag of a result. It only depends on the request and the ingest
+    manifest versions of the site-months, so it can be checked without
+    reading any Scats data.
+    """
+    key = result_key(kind, scats_id, from_date, to_date, params)
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()
+
+
+def filter_params(day_filter):
+    return '' if day_filter is None else day_filter.key()
+
+
+def seasonality_params(detectors, day_filter=None):
+    params = ','.join(str(detector) for detector in sorted(set(detectors)))
+    if day_filter is not None:
+        params += ';' + day_filter.key()
+    return params
+
+
+def extract_result(scats_id, from_date, to_date, day_filter=None):
+    """
+    Encoded JSON response of ExtractScatsDataView, or None if there is no data.
+    """
+    def compute():
+        scats_data = get_scats_rows(scats_id, from_date, to_date, day_filter=day_filter)
+        if len(scats_data) == 0:
+            return None
+        serializer = ScatsSerializer(scats_data, many=True)
+        return JSONRenderer().render(serializer.data)
+
+    return get_or_compute('extract', scats_id, from_date, to_date, filter_params(day_filter), compute)
+
+
+def _month_cube(scats_id, first_day, last_day, detectors, day_filter=None):
+    # Days first_day to last_day, within one month, of the cube of the site,
+    # without the days not matching day_filter. Rows read from the database
+    # are filtered by the query, and only the matching days of a cube from
+    # the cube store or the block cache are copied. A site-month missing from
+    # the block cache is still loaded whole, as blocks are shared by requests
+    # with any filter.
+    [(_, _, cube)] = get_scats_cubes(scats_id, first_day, last_day, detectors, day_filter)
+    cube = cube[first_day.day - 1:last_day.day]
+    if day_filter is not None:
+        cube = select_days(cube, first_day, day_filter)
+    return cube
+
+
+def seasonality_days(scats_id, first_day, last_day, detectors, day_filter=None):
+    """
+    Encoded SeasonalityPartial of first_day to last_day, within one month.
+    Cached like results, so that extending a range only processes the
+    new months.
+    """
+    def compute():
+        return SeasonalityPartial.from_cube(
+            _month_cube(scats_id, first_day, last_day, detectors, day_filter), first_day, detectors
+        ).to_bytes()
+
+    return get_or_compute(
+        'seasonality-days', scats_id, first_day, last_day,
+        seasonality_params(detectors, day_filter), compute
+    )
+
+
+def iter_seasonality_months(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Yield the encoded SeasonalityPartial of every month of the range, in
+    date order, computing (and caching) each month when it is reached.
+    """
+    for first_day, last_day in month_ranges(from_date, to_date):
+        yield seasonality_days(scats_id, first_day, last_day, detectors, day_filter)
+
+
+def seasonality_months(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Encoded SeasonalityPartial of every month of the range, in date order.
+    """
+    return list(iter_seasonality_months(scats_id, from_date, to_date, detectors, day_filter))
+
+
+def _partials(months):
+    # Decode one month at a time.
+    return (SeasonalityPartial.from_bytes(content) for content in months)
+
+
+def seasonality_result(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Encoded JSON response of SeasonalityAnalysisView, or None if there is no data.
+
+    The range is processed month by month in two passes: the first sums the
+    detector volumes for the range-wide means, the second fills and encodes
+    the days of each month. Only one month is decoded at a time.
+    """
+    def compute():
+        months = seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+        means, nb_days = SeasonalityPartial.detector_means(_partials(months))
+        if nb_days == 0:
+            return None
+        return table_json(partial.json_rows(means) for partial in _partials(months))
+
+    return get_or_compute(
+        'seasonality', scats_id, from_date, to_date, seasonality_params(detectors, day_filter), compute
+    )
+
+
+def seasonality_profile_result(scats_id, from_date, to_date, detectors, aggregate, day_filter=None):
+    """
+    Encoded JSON response of SeasonalityAnalysisView with an aggregate
+    (see seasonality_analysis.AGGREGATES), or None if there is no data.
+    Computed in two passes over the cached month partials like
+    seasonality_result.
+    """
+    def compute():
+        months = seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+        means, nb_days = SeasonalityPartial.detector_means(_partials(months))
+        if nb_days == 0:
+            return None
+        return profile_json(_partials(months), means, aggregate)
+
+    return get_or_compute(
+        f'seasonality-profile-{aggregate}', scats_id, from_date, to_date,
+        seasonality_params(detectors, day_filter), compute
+    )
+
+
+def seasonality_percentile_result(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Encoded JSON response of SeasonalityAnalysisView with
+    aggregate=percentile (see seasonality_analysis.percentile_json), or
+    None if there is no data. Computed from the cached month partials,
+    without filling invalid volumes.
+    """
+    def compute():
+        months = seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+        if not any(len(partial.days) for partial in _partials(months)):
+            return None
+        return percentile_json(_partials(months))
+
+    return get_or_compute(
+        'seasonality-percentile', scats_id, from_date, to_date,
+        seasonality_params(detectors, day_filter), compute
+    )
+
+
+def design_volumes_result(scats_id, from_date, to_date, detectors, ranks):
+    """
+    Encoded JSON response of DesignVolumesView (see
+    design_volumes.design_volumes), or None if there is no data.
+    Computed in two passes over the cached month partials like
+    seasonality_result.
+    """
+    def compute():
+        months = seasonality_months(scats_id, from_date, to_date, detectors)
+        means, nb_days = SeasonalityPartial.detector_means(_partials(months))
+        if nb_days == 0:
+            return None
+        content = design_volumes(_partials(months), means, ranks)
+        return json.dumps(content, separators=(',', ':')).encode()
+
+    return get_or_compute(
+        'design-volumes', scats_id, from_date, to_date,
+        design_volumes_params(detectors, ranks), compute
+    )
+
+
+def design_volumes_params(detectors, ranks):
+    return seasonality_params(detectors) + ';ranks=' + ','.join(str(rank) for rank in ranks)
+
+
+def peak_hours_result(scats_id, from_date, to_date, detectors, group='', day_filter=None):
+    """
+    Encoded JSON response of PeakHoursView (see peak_hours.peak_rows), or
+    None if there is no data. The cubes are read one month at a time.
+    """
+    def compute():
+        rows = [
+            row
+            for first_day, last_day in month_ranges(from_date, to_date)
+            for row in peak_rows(
+                _month_cube(scats_id, first_day, last_day, detectors, day_filter),
+                first_day, detectors, group
+            )
+        ]
+        if not rows:
+            return None
+        return b'{"data":[%s]}' % b','.join(rows)
+
+    return get_or_compute(
+        peak_hours_kind(group), scats_id, from_date, to_date,
+        seasonality_params(detectors, day_filter), compute
+    )
+
+
+def peak_hours_kind(group):
+    return 'peak-hours-detector' if group == 'detector' else 'peak-hours'
+
+
+def seasonality_stream(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Seasonality analysis as NDJSON, one encoded line per day, or None if
+    there is no data.
+
+    The fill needs the detector means of the whole range, so every month
+    partial is read once before the first line: from the result cache for
+    months analysed before, otherwise from the Scats data. The months are
+    then read again one at a time as the lines are sent, so only one month
+    is held in memory and later months are filled and encoded while the
+    first ones are being sent. Without a result cache, the second pass
+    recomputes each month.
+    """
+    means, nb_days = SeasonalityPartial.detector_means(_partials(
+        iter_seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+    ))
+    if nb_days == 0:
+        return None
+
+    def lines():
+        for partial in _partials(
+            iter_seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+        ):
+            yield from partial.ndjson_lines(means)
+
+    return lines()
+
+
+def _detector_rows(scats_id, from_date, to_date, detectors, day_filter=None):
+    # Encoded rows of seasonality_detector_result, or None if there is no data.
+    # The means come from the cached month partials, read one at a time,
+    # then the cubes are read again one month at a time for the volumes of
+    # each detector.
+    means, nb_days = SeasonalityPartial.detector_means(_partials(
+        iter_seasonality_months(scats_id, from_date, to_date, detectors, day_filter)
+    ))
+    if nb_days == 0:
+        return None
+
+    def rows():
+        for first_day, last_day in month_ranges(from_date, to_date):
+            yield from detector_rows(
+                _month_cube(scats_id, first_day, last_day, detectors, day_filter),
+                first_day, means, detectors
+            )
+
+    return rows()
+
+
+def seasonality_detector_result(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    Encoded JSON response of SeasonalityAnalysisView with group=detector,
+    or None if there is no data.
+    """
+    def compute():
+        rows = _detector_rows(scats_id, from_date, to_date, detectors, day_filter)
+        if rows is None:
+            return None
+        return b'{"data":[%s]}' % b','.join(rows)
+
+    return get_or_compute(
+        'seasonality-detector', scats_id, from_date, to_date,
+        seasonality_params(detectors, day_filter), compute
+    )
+
+
+def seasonality_detector_stream(scats_id, from_date, to_date, detectors, day_filter=None):
+    """
+    seasonality_detector_result as NDJSON, or None if there is no data.
+    """
+    rows = _detector_rows(scats_id, from_date, to_date, detectors, day_filter)
+    if rows is None:
+        return None
+    return (row + b'\n' for row in rows)
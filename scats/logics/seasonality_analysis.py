@@ -1,48 +1,304 @@
+import calendar
+import io
+import json
+import warnings
+from datetime import date, timedelta
+
 import pandas as pd
 import numpy as np
 
 COLUMNS = [f'V{str(i).zfill(2)}' for i in range(96)] + ['CT_ALARM_24HOUR']
 
-def seasonality_analysis(scats_data):
-    # convert django object instances to pandas dataframe.
-    df = pd.DataFrame(list(scats_data.values()))
+# Table schema and row format of the JSON result. Volumes are whole floats,
+# whose repr is the same as their pandas encoding.
+_SCHEMA = json.dumps(
+    pd.io.json.build_table_schema(pd.DataFrame(
+        columns=COLUMNS, dtype=float,
+        index=pd.Index([], name='QT_INTERVAL_COUNT', dtype=object),
+    )),
+    separators=(',', ':'),
+).encode()
+_ROW_FORMAT = '{"QT_INTERVAL_COUNT":"%sT00:00:00.000",' + ','.join(
+    f'"{column}":%r' for column in COLUMNS
+) + '}'
+
+
+class SeasonalityPartial:
+    """
+    Intermediate results of the seasonality analysis of a range of days.
+
+    Partials of consecutive ranges are merged into the partial of the whole
+    range, so that extending a range only processes the new days. The fill
+    of invalid volumes with the range-wide detector means is applied when
+    the result is produced. Long ranges are produced one partial at a time
+    with detector_means and json_rows, without merging.
+
+    days:    ordinals of the days with data, (days,)
+    known:   per day sums of the valid volumes, (days, 96)
+    missing: invalid (negative or NULL) volumes of the detectors reporting
+             on a day, (days, detectors, 96)
+    alarms:  per day sums of CT_ALARM_24HOUR, (days,)
+    sums, counts: per detector sums and counts of the valid volumes,
+             (detectors, 96)
+    """
+    def __init__(self, days, known, missing, alarms, sums, counts):
+        self.days = days
+        self.known = known
+        self.missing = missing
+        self.alarms = alarms
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def from_cube(cls, cube, first_day, detectors=None):
+        """
+        Partial of the days of cube (see cube_store.CUBE_DTYPE), the first of
+        which is first_day. Only the given detectors are analysed.
+        """
+        present = cube['valid'].copy()
+        if detectors is not None:
+            selected = np.zeros(cube.shape[1], dtype=np.bool_)
+            selected[[d - 1 for d in detectors if 1 <= d <= cube.shape[1]]] = True
+            present &= selected
+
+        has_data = present.any(axis=1)
+        present = present[has_data]
+        volumes = cube['volumes'][has_data].astype(np.int64)
+        valid = present[:, :, np.newaxis] & (volumes >= 0)
+        valid_volumes = np.where(valid, volumes, 0)
+
+        return cls(
+            days=first_day.toordinal() + np.flatnonzero(has_data),
+            known=valid_volumes.sum(axis=1),
+            missing=present[:, :, np.newaxis] & ~valid,
+            alarms=np.where(
+                present, cube['CT_ALARM_24HOUR'][has_data].astype(np.int64), 0
+            ).sum(axis=1),
+            sums=valid_volumes.sum(axis=0),
+            counts=valid.sum(axis=0),
+        )
+
+    @classmethod
+    def merge(cls, partials):
+        """
+        Partial of consecutive ranges, given in date order.
+        """
+        nb_detectors = max([p.sums.shape[0] for p in partials], default=0)
+
+        def pad(array, axis):
+            width = [(0, 0)] * array.ndim
+            width[axis] = (0, nb_detectors - array.shape[axis])
+            return np.pad(array, width)
+
+        return cls(
+            days=np.concatenate([np.zeros(0, np.int64)] + [p.days for p in partials]),
+            known=np.concatenate([np.zeros((0, 96), np.int64)] + [p.known for p in partials]),
+            missing=np.concatenate(
+                [np.zeros((0, nb_detectors, 96), np.bool_)]
+                + [pad(p.missing, 1) for p in partials]
+            ),
+            alarms=np.concatenate([np.zeros(0, np.int64)] + [p.alarms for p in partials]),
+            sums=sum([pad(p.sums, 0) for p in partials], np.zeros((nb_detectors, 96), np.int64)),
+            counts=sum([pad(p.counts, 0) for p in partials], np.zeros((nb_detectors, 96), np.int64)),
+        )
+
+    def to_bytes(self):
+        f = io.BytesIO()
+        np.savez(
+            f, days=self.days, known=self.known, alarms=self.alarms,
+            sums=self.sums, counts=self.counts,
+            missing=np.packbits(self.missing, axis=None),
+            missing_shape=np.array(self.missing.shape),
+        )
+        return f.getvalue()
+
+    @classmethod
+    def from_bytes(cls, content):
+        arrays = np.load(io.BytesIO(content))
+        shape = tuple(arrays['missing_shape'])
+        missing = np.unpackbits(
+            arrays['missing'], count=int(np.prod(shape))
+        ).astype(np.bool_).reshape(shape)
+        return cls(
+            arrays['days'], arrays['known'], missing, arrays['alarms'],
+            arrays['sums'], arrays['counts'],
+        )
+
+    @staticmethod
+    def detector_means(partials):
+        """
+        Means of the valid volumes of every detector and time period over
+        consecutive partials, holding one partial in memory at a time.
+        Returns (means, number of days with data).
+        """
+        sums = counts = np.zeros((0, 96), np.int64)
+        nb_days = 0
+        for partial in partials:
+            nb_detectors = max(sums.shape[0], partial.sums.shape[0])
+            sums = _pad_detectors(sums, nb_detectors) + _pad_detectors(partial.sums, nb_detectors)
+            counts = _pad_detectors(counts, nb_detectors) + _pad_detectors(partial.counts, nb_detectors)
+            nb_days += len(partial.days)
+        return _means(sums, counts), nb_days
+
+    def volumes(self, means):
+        """
+        Daily volumes of every time period summed over the detectors, with
+        invalid volumes replaced by means (see detector_means), rounded
+        half up, followed by the daily alarm count. Detector and time
+        period pairs with no valid volume in the range count as 0.
+        """
+        fill = np.zeros(self.known.shape)
+        for detector_index in range(min(self.missing.shape[1], means.shape[0])):
+            fill += self.missing[:, detector_index, :] * means[detector_index]
+        return np.floor(np.column_stack([self.known + fill, self.alarms]) + 0.5)
+
+    def to_json(self):
+        """
+        Encoded JSON of the result, in the format of pandas
+        DataFrame.to_json(orient='table'), written directly from the volumes.
+        """
+        return table_json([self.json_rows(_means(self.sums, self.counts))])
+
+    def json_rows(self, means):
+        """
+        Encoded JSON rows of the days, separated by commas (see table_json).
+        """
+        return ','.join(
+            _ROW_FORMAT % (date.fromordinal(int(day)).isoformat(), *volumes)
+            for day, volumes in zip(self.days, self.volumes(means).tolist())
+        ).encode()
+
+    def ndjson_lines(self, means):
+        """
+        Yield one encoded JSON line per day.
+        """
+        for day, volumes in zip(self.days, self.volumes(means).tolist()):
+            line = {'QT_INTERVAL_COUNT': date.fromordinal(int(day)).isoformat()}
+            line.update(zip(COLUMNS, volumes))
+            yield json.dumps(line, separators=(',', ':')).encode() + b'\n'
+
+
+def detector_rows(cube, first_day, means, detectors):
+    """
+    Yield the encoded JSON row of each day of cube (see
+    cube_store.CUBE_DTYPE) with data, the first of which is first_day: the
+    volumes of every reporting detector, with invalid volumes replaced by
+    means (see SeasonalityPartial.detector_means) and rounded half up, and
+    their alarm counts. Detectors are rounded separately, so their sum may
+    differ from the site total by the rounding.
+    """
+    detectors = sorted(set(d for d in detectors if 1 <= d <= cube.shape[1]))
+    index = [d - 1 for d in detectors]
+    means = _pad_detectors(means, max(means.shape[0], cube.shape[1]))[index]
+    present = cube['valid'][:, index]
+    volumes = cube['volumes'][:, index].astype(np.int64)
+    filled = np.floor(np.where(volumes >= 0, volumes, means) + 0.5).astype(np.int64).tolist()
+    alarms = cube['CT_ALARM_24HOUR'][:, index].astype(np.int64).tolist()
+
+    for day_index in np.flatnonzero(present.any(axis=1)).tolist():
+        reporting = np.flatnonzero(present[day_index]).tolist()
+        yield json.dumps({
+            'QT_INTERVAL_COUNT': (first_day + timedelta(days=day_index)).isoformat(),
+            'volumes': {str(detectors[i]): filled[day_index][i] for i in reporting},
+            'CT_ALARM_24HOUR': {str(detectors[i]): alarms[day_index][i] for i in reporting},
+        }, separators=(',', ':')).encode()
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Labels and group index of day ordinals of each profile aggregate.
+AGGREGATES = {
+    'dow': (list(calendar.day_name), lambda days: (days - 1) % 7),
+    'month': (
+        list(calendar.month_name)[1:],
+        lambda days: (days - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12,
+    ),
+    'weekday_weekend': (['weekday', 'weekend'], lambda days: ((days - 1) % 7 >= 5).astype(np.int64)),
+}
+
+_PROFILE_ROW_FORMAT = '{"GROUP":"%s","NB_DAYS":%d,' + ','.join(
+    f'"{column}":%r' for column in COLUMNS
+) + '}'
+
+
+def profile_json(partials, means, aggregate):
+    """
+    Encoded JSON profiles of consecutive partials: the mean daily volumes
+    (see SeasonalityPartial.volumes) of the days of each group of the
+    aggregate (see AGGREGATES), rounded to 2 decimals. Groups without days
+    are left out. Holds one partial in memory at a time.
+    """
+    labels, group_of = AGGREGATES[aggregate]
+    sums = np.zeros((len(labels), len(COLUMNS)))
+    counts = np.zeros(len(labels), np.int64)
+    for partial in partials:
+        groups = group_of(partial.days)
+        np.add.at(sums, groups, partial.volumes(means))
+        counts += np.bincount(groups, minlength=len(labels))
+
+    means = np.round(sums / np.maximum(counts, 1)[:, np.newaxis], 2).tolist()
+    rows = ','.join(
+        _PROFILE_ROW_FORMAT % (label, count, *means[index])
+        for index, (label, count) in enumerate(zip(labels, counts.tolist())) if count
+    )
+    return b'{"aggregate":"%s","data":[%s]}' % (aggregate.encode(), rows.encode())
+
+
+PERCENTILES = [10, 50, 85, 90]
 
-    # Calculate mean volumes for each NB_DETECTOR and time period pair.
-    # 1. Make a copy of df called df2.
-    # 2. Make df2_volumes which is the volumes only columns of df2.
-    # 2. Convert negative volumes in df2_volume to np.nan.
-    # 3. Group by NB_DETECTOR and calculate mean volumes for specific
-    #    NB_DETECTOR and time period (e.g. V00). This dataframe is called
-    #    df_mean.
-    # 4. If any of the mean values are still np.nan, convert to 0.
-    df2 = df.copy()
 
-    df2_volumes = df2.loc[:, 'V00':'V95']
-    df2_volumes[df2_volumes < 0] = np.nan
+def percentile_json(partials):
+    """
+    Encoded JSON percentile bands of consecutive partials: the PERCENTILES
+    of the site total of each interval across the days, rounded to 2
+    decimals. Invalid volumes are not filled: the interval of a day with an
+    invalid volume is left out of its percentiles, and is null if no day
+    of the interval is valid.
+    """
+    volumes = np.concatenate([np.zeros((0, 96))] + [
+        np.where(partial.missing.any(axis=1), np.nan, partial.known) for partial in partials
+    ])
+    with warnings.catch_warnings():
+        # All-NaN intervals
+        warnings.simplefilter('ignore', RuntimeWarning)
+        bands = np.round(np.nanpercentile(volumes, PERCENTILES, axis=0), 2)
 
-    df.loc[:, 'V00':'V95'] = df2_volumes
+    rows = []
+    for percentile, band in zip(PERCENTILES, bands.tolist()):
+        row = {'GROUP': f'P{percentile}', 'NB_DAYS': len(volumes)}
+        row.update(
+            (column, None if np.isnan(value) else value) for column, value in zip(COLUMNS[:96], band)
+        )
+        rows.append(row)
+    return json.dumps({'aggregate': 'percentile', 'data': rows}, separators=(',', ':')).encode()
 
-    df_mean = df.loc[:, 'NB_DETECTOR':'V95'].groupby('NB_DETECTOR').mean()
-    df_mean.fillna(0)
 
-    # Handle negative values
-    # 1. Loop through each qt_interval_count and create df_specific_day.
-    # 2. For each df_specific_day, fill np.nan with df_mean.
-    #    Then, sum them up and append it to dfs.
-    # 3. Concatenate all dataframes in dfs to create df_final.
-    # 4. Convert df_final to json and return it.
-    dfs = []
-    for qt_interval_count in df['QT_INTERVAL_COUNT'].unique():
-        df_specific_day = df[df['QT_INTERVAL_COUNT'] == qt_interval_count].copy()
+def table_json(chunks):
+    """
+    Encoded JSON result of chunks of rows (see SeasonalityPartial.json_rows).
+    """
+    return b'{"schema":%s,"data":[%s]}' % (_SCHEMA, b','.join(chunk for chunk in chunks if chunk))
 
-        df_specific_day.set_index('NB_DETECTOR', drop=False, inplace=True)
 
-        df_specific_day.loc[:, 'NB_DETECTOR':'V95'] = df_specific_day.loc[:, 'NB_DETECTOR':'V95'].fillna(df_mean)
+def total_json(results):
+    """
+    Encoded JSON result of the daily sums of encoded JSON results (see
+    table_json), over the days of any of them.
+    """
+    totals = {}
+    for content in results:
+        for row in json.loads(content)['data']:
+            day = row['QT_INTERVAL_COUNT'][:10]
+            volumes = np.array([row[column] for column in COLUMNS])
+            totals[day] = totals[day] + volumes if day in totals else volumes
+    return table_json([','.join(
+        _ROW_FORMAT % (day, *totals[day].tolist()) for day in sorted(totals)
+    ).encode()])
 
-        dfs.append(df_specific_day.groupby('QT_INTERVAL_COUNT').sum().loc[:, COLUMNS])
 
-    df_final = pd.concat(dfs, axis='index')
+def _pad_detectors(array, nb_detectors):
+    return np.pad(array, [(0, nb_detectors - array.shape[0]), (0, 0)])
 
-    df_final = np.floor(df_final + 0.5)
 
-    return df_final.to_json(orient='table')
+def _means(sums, counts):
+    return np.divide(sums, counts, out=np.zeros(sums.shape), where=counts > 0)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from scats.logics import archive
+from scats.logics.cube_store import iter_months
+
+
+class Command(BaseCommand):
+    help = (
+        'Move months of Scats data older than a threshold from the Scats '
+        'table to the Parquet archive.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=24,
+            help='Keep this many most recent months in the Scats table '
+                 '(counted back from QT_INTERVAL_COUNT_MAX).'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only print the months that would be archived.'
+        )
+
+    def handle(self, *args, **options):
+        if not archive.is_enabled():
+            raise CommandError('SCATS_ARCHIVE_DIR is not set.')
+        if options['months'] < 1:
+            raise CommandError("'--months' must be at least 1.")
+
+        year, month = settings.QT_INTERVAL_COUNT_MAX.year, settings.QT_INTERVAL_COUNT_MAX.month
+        for _ in range(options['months']):
+            year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        last_day = archive.month_range(year, month)[1]
+
+        already_archived = archive.archived_months(settings.QT_INTERVAL_COUNT_MIN, last_day)
+        months = [
+            (year, month)
+            for year, month in iter_months(settings.QT_INTERVAL_COUNT_MIN, last_day)
+            if (year, month) not in already_archived
+        ]
+
+        for year, month in months:
+            if options['dry_run']:
+                self.stdout.write(archive.month_key(year, month))
+                continue
+            row_count = archive.archive_month(year, month)
+            self.stdout.write(
+                f'Archived {archive.month_key(year, month)} ({row_count} rows).'
+            )
+
+        if months and not options['dry_run']:
+            self.stdout.write(
+                'Run VACUUM FULL on the scats_scats table to return the freed space to the operating system.'
+            )
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scats.logics.factors import compute_monthly_factors
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the monthly seasonal adjustment factors of every site '
+        'over the 12 months ending with the latest month with data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--last-month',
+            help='Last month of the factor year, YYYY-MM (default: latest month with data).'
+        )
+
+    def handle(self, *args, **options):
+        last_month = options['last_month']
+        if last_month:
+            try:
+                last_month = date.fromisoformat(f'{last_month}-01')
+            except ValueError:
+                raise CommandError("'--last-month' must be of format YYYY-MM.")
+
+        count = compute_monthly_factors(last_month)
+        self.stdout.write(f'Stored {count} monthly factors.')
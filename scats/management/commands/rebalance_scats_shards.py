@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from scats.logics.ingest import upsert_scats
+from scats.models import Scats
+from scats.routers import scats_database, shard_for_site, shards
+
+
+def move_site(scats_id, source, target, batch_size):
+    """
+    Copy the Scats rows of a site from source to target, then delete
+    them from source.
+
+    Rows that already exist on target are replaced on the natural key, so
+    an interrupted move can be run again. The source rows are only deleted
+    if target then holds as many rows of the site as source. Moved rows
+    get a new id on target.
+    """
+    scats_data = Scats.objects.using(source).filter(NB_SCATS_SITE=scats_id)
+
+    row_count = 0
+    model_instances = []
+    for row in scats_data.values().iterator(chunk_size=batch_size):
+        model_instances.append(Scats(**row))
+        if len(model_instances) == batch_size:
+            upsert_scats(target, model_instances, batch_size)
+            row_count += len(model_instances)
+            model_instances = []
+    if model_instances:
+        upsert_scats(target, model_instances, batch_size)
+        row_count += len(model_instances)
+
+    with transaction.atomic(using=source):
+        source_count = scats_data.count()
+        target_count = Scats.objects.using(target).filter(NB_SCATS_SITE=scats_id).count()
+        if source_count != target_count:
+            raise CommandError(
+                f'{scats_id}: {source} has {source_count} rows but {target} has '
+                f'{target_count} after the copy. The rows on {source} were kept.'
+            )
+        scats_data.delete()
+
+    return row_count
+
+
+class Command(BaseCommand):
+    help = (
+        'Move Scats rows to the shard of their site. Run after changing '
+        'SCATS_SHARD_URLS. Sites being moved are incomplete on their new '
+        'shard until their move has finished.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--include-primary', action='store_true',
+            help='Also move rows out of the SCATS database, when sharding '
+                 'an existing Scats table.'
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only print the sites that would be moved.'
+        )
+
+    def handle(self, *args, **options):
+        shard_aliases = shards()
+        if not shard_aliases:
+            raise CommandError('SCATS_SHARD_URLS is not set.')
+
+        sources = list(shard_aliases)
+        if options['include_primary'] and scats_database() not in sources:
+            sources.insert(0, scats_database())
+
+        for source in sources:
+            sites = Scats.objects.using(source).order_by(
+                'NB_SCATS_SITE'
+            ).values_list('NB_SCATS_SITE', flat=True).distinct()
+
+            for scats_id in list(sites):
+                target = shard_for_site(scats_id, shard_aliases)
+                if target == source:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'{scats_id}: {source} -> {target}')
+                    continue
+                row_count = move_site(scats_id, source, target, options['batch_size'])
+                self.stdout.write(f'{scats_id}: {source} -> {target} ({row_count} rows)')
@@ -0,0 +1,49 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from scats.logics.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background analysis jobs. Any number of these workers can run '
+        'on any number of hosts against the same database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes.'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait before polling again when there are no jobs.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when there are no jobs left.'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("'--workers' must be at least 1.")
+
+        if options['workers'] == 1:
+            count = run_worker(options['poll_interval'], options['once'])
+            self.stdout.write(f'Ran {count} jobs.')
+            return
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker, args=(options['poll_interval'], options['once'])
+            )
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scats.logics import block_cache
+
+
+class Command(BaseCommand):
+    help = 'Print the metrics of the shared memory block cache of this host.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Drop every cached block and reset the metrics.'
+        )
+
+    def handle(self, *args, **options):
+        if not block_cache.is_enabled():
+            raise CommandError('SCATS_BLOCK_CACHE_MAX_BYTES is not set.')
+
+        if options['clear']:
+            block_cache.clear()
+            self.stdout.write('Cleared the block cache.')
+            return
+
+        for name, value in block_cache.stats().items():
+            self.stdout.write(f'{name}: {value}')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scats.logics import access_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute the most requested extract and seasonality results '
+        'to warm the caches after a deploy or an ingest.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=50,
+            help='Number of most requested results to precompute.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of results computed in parallel.'
+        )
+        parser.add_argument(
+            '--time-budget', type=int, default=300,
+            help='Stop starting new computations after this many seconds.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Only count requests made within this many days.'
+        )
+
+    def handle(self, *args, **options):
+        if options['top'] < 1 or options['workers'] < 1:
+            raise CommandError("'--top' and '--workers' must be at least 1.")
+        if not access_stats.is_warming_useful():
+            self.stdout.write(
+                'Nothing to warm: the result cache is not shared and the block cache is disabled.'
+            )
+            return
+
+        computed = access_stats.warm(
+            top=options['top'],
+            workers=options['workers'],
+            time_budget=options['time_budget'],
+            days=options['days'],
+        )
+        self.stdout.write(f'Warmed {computed} results.')
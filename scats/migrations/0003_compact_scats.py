@@ -0,0 +1,55 @@
+# Generated by Django 3.2.6 on 2026-10-19 14:44
+
+from django.db import migrations, models
+
+VOLUME_COLUMNS = [f'V{str(i).zfill(2)}' for i in range(96)]
+
+# Duplicate (site, date, detector) rows have always been dropped at read
+# time with .distinct(). Keep the first one before adding the unique key.
+DELETE_DUPLICATES_SQL = """
+DELETE FROM scats_scats a USING scats_scats b
+WHERE a."NB_SCATS_SITE" = b."NB_SCATS_SITE"
+  AND a."QT_INTERVAL_COUNT" = b."QT_INTERVAL_COUNT"
+  AND a."NB_DETECTOR" = b."NB_DETECTOR"
+  AND a.id > b.id;
+"""
+
+# A single ALTER TABLE so that the table is only rewritten once.
+COMPACT_SQL = 'ALTER TABLE scats_scats ' \
+    'ADD CONSTRAINT scats_scats_natural_key UNIQUE ("NB_SCATS_SITE", "QT_INTERVAL_COUNT", "NB_DETECTOR"), ' + \
+    ', '.join(f'ALTER COLUMN "{column}" TYPE smallint' for column in VOLUME_COLUMNS) + ';'
+
+UNCOMPACT_SQL = 'ALTER TABLE scats_scats DROP CONSTRAINT scats_scats_natural_key, ' + \
+    ', '.join(f'ALTER COLUMN "{column}" TYPE integer' for column in VOLUME_COLUMNS) + ';'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0002_archivedmonth'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(DELETE_DUPLICATES_SQL, migrations.RunSQL.noop),
+                migrations.RunSQL(COMPACT_SQL, UNCOMPACT_SQL),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='scats',
+                    constraint=models.UniqueConstraint(
+                        fields=('NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'NB_DETECTOR'),
+                        name='scats_scats_natural_key',
+                    ),
+                ),
+            ] + [
+                migrations.AlterField(
+                    model_name='scats',
+                    name=column,
+                    field=models.SmallIntegerField(null=True),
+                )
+                for column in VOLUME_COLUMNS
+            ],
+        ),
+    ]
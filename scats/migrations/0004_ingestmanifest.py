@@ -0,0 +1,26 @@
+# Generated by Django 3.2.6 on 2026-10-19 14:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0003_compact_scats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('NB_SCATS_SITE', models.IntegerField()),
+                ('month', models.DateField()),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('ingested_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('NB_SCATS_SITE', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-19 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0004_ingestmanifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('NB_SCATS_SITE', models.IntegerField()),
+                ('from_date', models.DateField()),
+                ('to_date', models.DateField()),
+                ('params', models.TextField(blank=True)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('last_accessed', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('kind', 'NB_SCATS_SITE', 'from_date', 'to_date', 'params')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-19 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0006_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='output',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.6 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0007_analysisjob_output'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyFactor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('NB_SCATS_SITE', models.IntegerField()),
+                ('NM_REGION', models.CharField(blank=True, max_length=10)),
+                ('month', models.DateField()),
+                ('nb_days', models.PositiveSmallIntegerField()),
+                ('adt', models.FloatField()),
+                ('aadt', models.FloatField()),
+                ('factor', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlyfactor',
+            index=models.Index(fields=['NM_REGION', 'month'], name='scats_month_NM_REGI_8e765c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyfactor',
+            unique_together={('NB_SCATS_SITE', 'month')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0008_monthlyfactor'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='resultaccess',
+            name='kind',
+            field=models.CharField(max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scats', '0009_resultaccess_kind_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='resultaccess',
+            index=models.Index(fields=['last_accessed'], name='scats_resul_last_ac_2edfab_idx'),
+        ),
+    ]
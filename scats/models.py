@@ -1,110 +1,235 @@
 from django.db import models
+from django.conf import settings
 
 
 class Scats(models.Model):
     NB_SCATS_SITE = models.IntegerField()
     QT_INTERVAL_COUNT = models.DateField()
     NB_DETECTOR = models.PositiveSmallIntegerField()
-    V00 = models.IntegerField(null=True)
-    V01 = models.IntegerField(null=True)
-    V02 = models.IntegerField(null=True)
-    V03 = models.IntegerField(null=True)
-    V04 = models.IntegerField(null=True)
-    V05 = models.IntegerField(null=True)
-    V06 = models.IntegerField(null=True)
-    V07 = models.IntegerField(null=True)
-    V08 = models.IntegerField(null=True)
-    V09 = models.IntegerField(null=True)
-    V10 = models.IntegerField(null=True)
-    V11 = models.IntegerField(null=True)
-    V12 = models.IntegerField(null=True)
-    V13 = models.IntegerField(null=True)
-    V14 = models.IntegerField(null=True)
-    V15 = models.IntegerField(null=True)
-    V16 = models.IntegerField(null=True)
-    V17 = models.IntegerField(null=True)
-    V18 = models.IntegerField(null=True)
-    V19 = models.IntegerField(null=True)
-    V20 = models.IntegerField(null=True)
-    V21 = models.IntegerField(null=True)
-    V22 = models.IntegerField(null=True)
-    V23 = models.IntegerField(null=True)
-    V24 = models.IntegerField(null=True)
-    V25 = models.IntegerField(null=True)
-    V26 = models.IntegerField(null=True)
-    V27 = models.IntegerField(null=True)
-    V28 = models.IntegerField(null=True)
-    V29 = models.IntegerField(null=True)
-    V30 = models.IntegerField(null=True)
-    V31 = models.IntegerField(null=True)
-    V32 = models.IntegerField(null=True)
-    V33 = models.IntegerField(null=True)
-    V34 = models.IntegerField(null=True)
-    V35 = models.IntegerField(null=True)
-    V36 = models.IntegerField(null=True)
-    V37 = models.IntegerField(null=True)
-    V38 = models.IntegerField(null=True)
-    V39 = models.IntegerField(null=True)
-    V40 = models.IntegerField(null=True)
-    V41 = models.IntegerField(null=True)
-    V42 = models.IntegerField(null=True)
-    V43 = models.IntegerField(null=True)
-    V44 = models.IntegerField(null=True)
-    V45 = models.IntegerField(null=True)
-    V46 = models.IntegerField(null=True)
-    V47 = models.IntegerField(null=True)
-    V48 = models.IntegerField(null=True)
-    V49 = models.IntegerField(null=True)
-    V50 = models.IntegerField(null=True)
-    V51 = models.IntegerField(null=True)
-    V52 = models.IntegerField(null=True)
-    V53 = models.IntegerField(null=True)
-    V54 = models.IntegerField(null=True)
-    V55 = models.IntegerField(null=True)
-    V56 = models.IntegerField(null=True)
-    V57 = models.IntegerField(null=True)
-    V58 = models.IntegerField(null=True)
-    V59 = models.IntegerField(null=True)
-    V60 = models.IntegerField(null=True)
-    V61 = models.IntegerField(null=True)
-    V62 = models.IntegerField(null=True)
-    V63 = models.IntegerField(null=True)
-    V64 = models.IntegerField(null=True)
-    V65 = models.IntegerField(null=True)
-    V66 = models.IntegerField(null=True)
-    V67 = models.IntegerField(null=True)
-    V68 = models.IntegerField(null=True)
-    V69 = models.IntegerField(null=True)
-    V70 = models.IntegerField(null=True)
-    V71 = models.IntegerField(null=True)
-    V72 = models.IntegerField(null=True)
-    V73 = models.IntegerField(null=True)
-    V74 = models.IntegerField(null=True)
-    V75 = models.IntegerField(null=True)
-    V76 = models.IntegerField(null=True)
-    V77 = models.IntegerField(null=True)
-    V78 = models.IntegerField(null=True)
-    V79 = models.IntegerField(null=True)
-    V80 = models.IntegerField(null=True)
-    V81 = models.IntegerField(null=True)
-    V82 = models.IntegerField(null=True)
-    V83 = models.IntegerField(null=True)
-    V84 = models.IntegerField(null=True)
-    V85 = models.IntegerField(null=True)
-    V86 = models.IntegerField(null=True)
-    V87 = models.IntegerField(null=True)
-    V88 = models.IntegerField(null=True)
-    V89 = models.IntegerField(null=True)
-    V90 = models.IntegerField(null=True)
-    V91 = models.IntegerField(null=True)
-    V92 = models.IntegerField(null=True)
-    V93 = models.IntegerField(null=True)
-    V94 = models.IntegerField(null=True)
-    V95 = models.IntegerField(null=True)
+    V00 = models.SmallIntegerField(null=True)
+    V01 = models.SmallIntegerField(null=True)
+    V02 = models.SmallIntegerField(null=True)
+    V03 = models.SmallIntegerField(null=True)
+    V04 = models.SmallIntegerField(null=True)
+    V05 = models.SmallIntegerField(null=True)
+    V06 = models.SmallIntegerField(null=True)
+    V07 = models.SmallIntegerField(null=True)
+    V08 = models.SmallIntegerField(null=True)
+    V09 = models.SmallIntegerField(null=True)
+    V10 = models.SmallIntegerField(null=True)
+    V11 = models.SmallIntegerField(null=True)
+    V12 = models.SmallIntegerField(null=True)
+    V13 = models.SmallIntegerField(null=True)
+    V14 = models.SmallIntegerField(null=True)
+    V15 = models.SmallIntegerField(null=True)
+    V16 = models.SmallIntegerField(null=True)
+    V17 = models.SmallIntegerField(null=True)
+    V18 = models.SmallIntegerField(null=True)
+    V19 = models.SmallIntegerField(null=True)
+    V20 = models.SmallIntegerField(null=True)
+    V21 = models.SmallIntegerField(null=True)
+    V22 = models.SmallIntegerField(null=True)
+    V23 = models.SmallIntegerField(null=True)
+    V24 = models.SmallIntegerField(null=True)
+    V25 = models.SmallIntegerField(null=True)
+    V26 = models.SmallIntegerField(null=True)
+    V27 = models.SmallIntegerField(null=True)
+    V28 = models.SmallIntegerField(null=True)
+    V29 = models.SmallIntegerField(null=True)
+    V30 = models.SmallIntegerField(null=True)
+    V31 = models.SmallIntegerField(null=True)
+    V32 = models.SmallIntegerField(null=True)
+    V33 = models.SmallIntegerField(null=True)
+    V34 = models.SmallIntegerField(null=True)
+    V35 = models.SmallIntegerField(null=True)
+    V36 = models.SmallIntegerField(null=True)
+    V37 = models.SmallIntegerField(null=True)
+    V38 = models.SmallIntegerField(null=True)
+    V39 = models.SmallIntegerField(null=True)
+    V40 = models.SmallIntegerField(null=True)
+    V41 = models.SmallIntegerField(null=True)
+    V42 = models.SmallIntegerField(null=True)
+    V43 = models.SmallIntegerField(null=True)
+    V44 = models.SmallIntegerField(null=True)
+    V45 = models.SmallIntegerField(null=True)
+    V46 = models.SmallIntegerField(null=True)
+    V47 = models.SmallIntegerField(null=True)
+    V48 = models.SmallIntegerField(null=True)
+    V49 = models.SmallIntegerField(null=True)
+    V50 = models.SmallIntegerField(null=True)
+    V51 = models.SmallIntegerField(null=True)
+    V52 = models.SmallIntegerField(null=True)
+    V53 = models.SmallIntegerField(null=True)
+    V54 = models.SmallIntegerField(null=True)
+    V55 = models.SmallIntegerField(null=True)
+    V56 = models.SmallIntegerField(null=True)
+    V57 = models.SmallIntegerField(null=True)
+    V58 = models.SmallIntegerField(null=True)
+    V59 = models.SmallIntegerField(null=True)
+    V60 = models.SmallIntegerField(null=True)
+    V61 = models.SmallIntegerField(null=True)
+    V62 = models.SmallIntegerField(null=True)
+    V63 = models.SmallIntegerField(null=True)
+    V64 = models.SmallIntegerField(null=True)
+    V65 = models.SmallIntegerField(null=True)
+    V66 = models.SmallIntegerField(null=True)
+    V67 = models.SmallIntegerField(null=True)
+    V68 = models.SmallIntegerField(null=True)
+    V69 = models.SmallIntegerField(null=True)
+    V70 = models.SmallIntegerField(null=True)
+    V71 = models.SmallIntegerField(null=True)
+    V72 = models.SmallIntegerField(null=True)
+    V73 = models.SmallIntegerField(null=True)
+    V74 = models.SmallIntegerField(null=True)
+    V75 = models.SmallIntegerField(null=True)
+    V76 = models.SmallIntegerField(null=True)
+    V77 = models.SmallIntegerField(null=True)
+    V78 = models.SmallIntegerField(null=True)
+    V79 = models.SmallIntegerField(null=True)
+    V80 = models.SmallIntegerField(null=True)
+    V81 = models.SmallIntegerField(null=True)
+    V82 = models.SmallIntegerField(null=True)
+    V83 = models.SmallIntegerField(null=True)
+    V84 = models.SmallIntegerField(null=True)
+    V85 = models.SmallIntegerField(null=True)
+    V86 = models.SmallIntegerField(null=True)
+    V87 = models.SmallIntegerField(null=True)
+    V88 = models.SmallIntegerField(null=True)
+    V89 = models.SmallIntegerField(null=True)
+    V90 = models.SmallIntegerField(null=True)
+    V91 = models.SmallIntegerField(null=True)
+    V92 = models.SmallIntegerField(null=True)
+    V93 = models.SmallIntegerField(null=True)
+    V94 = models.SmallIntegerField(null=True)
+    V95 = models.SmallIntegerField(null=True)
     NM_REGION = models.CharField(max_length=10)
     CT_RECORDS = models.SmallIntegerField()
     QT_VOLUME_24HOUR = models.IntegerField()
     CT_ALARM_24HOUR = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            # Created with the smallint volumes by migration 0003_compact_scats.
+            models.UniqueConstraint(
+                fields=['NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'NB_DETECTOR'],
+                name='scats_scats_natural_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.NB_SCATS_SITE}, {self.QT_INTERVAL_COUNT}, {self.NB_DETECTOR}'
+
+
+class ArchivedMonth(models.Model):
+    """
+    A month of Scats data that has been moved from the Scats table
+    to the Parquet archive (see scats/logics/archive.py).
+    """
+    month = models.DateField(unique=True)
+    row_count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.month:%Y-%m}'
+
+
+class IngestManifest(models.Model):
+    """
+    When Scats data of a site-month was last loaded by the ingestion tools.
+    'version' is incremented on every load of the site-month.
+    """
+    NB_SCATS_SITE = models.IntegerField()
+    month = models.DateField()
+    version = models.PositiveIntegerField(default=1)
+    ingested_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('NB_SCATS_SITE', 'month')]
+
+    def __str__(self):
+        return f'{self.NB_SCATS_SITE}, {self.month:%Y-%m}, {self.version}'
+
+
+class ResultAccess(models.Model):
+    """
+    How often an extract or seasonality result was requested, used to warm
+    the caches with the most requested sites and ranges
+    (see scats/logics/access_stats.py).
+    """
+    kind = models.CharField(max_length=64)
+    NB_SCATS_SITE = models.IntegerField()
+    from_date = models.DateField()
+    to_date = models.DateField()
+    params = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=1)
+    last_accessed = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('kind', 'NB_SCATS_SITE', 'from_date', 'to_date', 'params')]
+        indexes = [models.Index(fields=['last_accessed'])]
+
+    def __str__(self):
+        return f'{self.kind}, {self.NB_SCATS_SITE}, {self.from_date} - {self.to_date}, {self.count}'
+
+
+class MonthlyFactor(models.Model):
+    """
+    Monthly seasonal adjustment factor of a site: the average daily traffic
+    of the month divided by the AADT of the site over the factor year
+    (see scats/logics/factors.py).
+    """
+    NB_SCATS_SITE = models.IntegerField()
+    NM_REGION = models.CharField(max_length=10, blank=True)
+    month = models.DateField()
+    nb_days = models.PositiveSmallIntegerField()
+    adt = models.FloatField()
+    aadt = models.FloatField()
+    factor = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('NB_SCATS_SITE', 'month')]
+        indexes = [models.Index(fields=['NM_REGION', 'month'])]
+
+    def __str__(self):
+        return f'{self.NB_SCATS_SITE}, {self.month:%Y-%m}, {self.factor:.3f}'
+
+
+class AnalysisJob(models.Model):
+    """
+    An analysis run in the background by 'python manage.py run_scats_jobs'
+    (see scats/logics/jobs.py). Stored in the default database with the
+    users, so that credit points are charged in the same transaction
+    that completes the job.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='analysis_jobs'
+    )
+    kind = models.CharField(max_length=20)
+    params = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.BinaryField(null=True)
+    # Storage key of the file written by the job, e.g. an export.
+    output = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
     def __str__(self):
-        return f'{self.NB_SCATS_SITE}, {self.QT_INTERVAL_COUNT}, {self.NB_DETECTOR}'
\ No newline at end of file
+        return f'{self.kind}, {self.user_id}, {self.status}'
@@ -0,0 +1,19 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON. Successful seasonality analyses are streamed
+    one day per line by the view; this renders everything else (e.g.
+    errors) as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, separators=(',', ':')).encode() + b'\n'
@@ -0,0 +1,155 @@
+import itertools
+import threading
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+SCATS_APP_LABEL = 'scats'
+SCATS_DATABASE = 'scats'
+
+# Models of the scats app that reference users and stay in 'default'.
+DEFAULT_DATABASE_MODELS = {'analysisjob'}
+
+
+def scats_database():
+    """
+    Database alias holding SCATS volume data. A dedicated 'scats' database
+    is used when configured, otherwise everything lives in 'default'.
+    """
+    if SCATS_DATABASE in settings.DATABASES:
+        return SCATS_DATABASE
+    return 'default'
+
+
+def read_replicas():
+    return list(getattr(settings, 'SCATS_READ_REPLICAS', []))
+
+
+def shards():
+    return list(getattr(settings, 'SCATS_SHARDS', []))
+
+
+def shard_for_site(scats_id, shard_aliases=None):
+    """
+    Shard holding the Scats rows of a site, by a stable hash of the site id.
+    """
+    shard_aliases = shards() if shard_aliases is None else shard_aliases
+    return shard_aliases[zlib.crc32(str(scats_id).encode()) % len(shard_aliases)]
+
+
+def site_database(scats_id):
+    """
+    Database alias holding the Scats rows of a site.
+    """
+    if shards():
+        return shard_for_site(scats_id)
+    return scats_database()
+
+
+def scats_row_databases():
+    """
+    Every database alias holding Scats rows.
+    """
+    return shards() or [scats_database()]
+
+
+class ScatsRouter:
+    """
+    Route the scats app to the dedicated SCATS database, so that heavy
+    analysis queries do not compete with users, sessions and djstripe
+    for the same buffer cache and connections.
+
+    Read replicas are never written to or migrated. Read-only Scats
+    queries are sent to them explicitly with read_database().
+
+    When shards are configured, the Scats table is split over them by
+    site and the other scats models stay in the SCATS database. Saving a
+    Scats instance is routed by its site. Queries have to pick their shard
+    with site_database().
+
+    Models in DEFAULT_DATABASE_MODELS stay in the default database.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name in DEFAULT_DATABASE_MODELS:
+            return 'default'
+        if model._meta.app_label == SCATS_APP_LABEL:
+            return scats_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.model_name in DEFAULT_DATABASE_MODELS:
+            return 'default'
+        if model._meta.app_label == SCATS_APP_LABEL:
+            instance = hints.get('instance')
+            if shards() and model._meta.model_name == 'scats' and instance is not None:
+                return shard_for_site(instance.NB_SCATS_SITE)
+            return scats_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        is_scats = [
+            obj._meta.app_label == SCATS_APP_LABEL
+            and obj._meta.model_name not in DEFAULT_DATABASE_MODELS
+            for obj in (obj1, obj2)
+        ]
+        if any(is_scats) and scats_database() != 'default':
+            return all(is_scats)
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in read_replicas():
+            return False
+        if db in shards():
+            # Shards only hold the Scats table (RunSQL operations on it
+            # have no model_name).
+            return app_label == SCATS_APP_LABEL and model_name in (None, 'scats')
+        if scats_database() == 'default':
+            return None
+        if app_label == SCATS_APP_LABEL and model_name in DEFAULT_DATABASE_MODELS:
+            return db == 'default'
+        if app_label == SCATS_APP_LABEL:
+            return db == SCATS_DATABASE
+        return db != SCATS_DATABASE
+
+
+_lock = threading.Lock()
+_round_robin = {}
+
+
+def _select_replica(replicas):
+    with _lock:
+        key = tuple(replicas)
+        if key not in _round_robin:
+            _round_robin[key] = itertools.cycle(replicas)
+        return next(_round_robin[key])
+
+
+def recently_ingested(scats_id, from_date, to_date):
+    """
+    Whether any month of the range was ingested recently enough that
+    the replicas may not have caught up yet.
+    """
+    from scats.logics.ingest import manifest
+
+    recent = timezone.now() - settings.SCATS_REPLICA_LAG
+    return any(
+        ingested_at > recent
+        for _, ingested_at in manifest(scats_id, from_date, to_date).values()
+    )
+
+
+def read_database(scats_id, from_date, to_date):
+    """
+    Database alias to read Scats data of a site between from_date and
+    to_date from. Reads go to a replica unless there are none, or the
+    data has only just been ingested, in which case the primary is used.
+    With sharding, reads always go to the shard of the site.
+    """
+    if shards():
+        return shard_for_site(scats_id)
+
+    replicas = read_replicas()
+    if not replicas or recently_ingested(scats_id, from_date, to_date):
+        return scats_database()
+    return _select_replica(replicas)
@@ -1,8 +1,23 @@
 from rest_framework import serializers
-from .models import Scats
+from .models import Scats, AnalysisJob, MonthlyFactor
 
 
 class ScatsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Scats
         fields = '__all__'
+
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AnalysisJob
+        fields = [
+            'id', 'kind', 'params', 'status', 'error',
+            'created_at', 'started_at', 'finished_at',
+        ]
+
+
+class MonthlyFactorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MonthlyFactor
+        fields = ['NB_SCATS_SITE', 'NM_REGION', 'month', 'nb_days', 'adt', 'aadt', 'factor']
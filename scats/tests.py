@@ -1,4 +1,4 @@
-from django.test import TestCase, override_settings
+from django.test import TestCase, SimpleTestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -9,6 +9,46 @@ import pandas as pd
 import numpy as np
 from datetime import date, datetime, timedelta
 from django.conf import settings
+from .models import Scats, ArchivedMonth, IngestManifest, ResultAccess, AnalysisJob, MonthlyFactor
+from .serializers import ScatsSerializer
+from .routers import ScatsRouter, read_database, recently_ingested, scats_database, shard_for_site
+from .logics.ingest import record_ingest, bulk_create_scats, month_versions, start_request, finish_request
+from .management.commands.rebalance_scats_shards import move_site
+from .logics.result_cache import LocMemResultCache, FileResultCache, get_result_cache, get_or_compute
+from .logics import cube_store, archive, block_cache, corridor
+from .logics.data_source import get_scats_rows
+from .logics.coalesce import single_flight
+from .logics import access_stats
+from .logics.access_stats import flush_accesses, is_warming_useful, record_access, most_requested, warm
+from .logics.seasonality_analysis import (
+    COLUMNS, PERCENTILES, SeasonalityPartial, detector_rows, percentile_json, profile_json,
+)
+from .logics.results import result_etag, seasonality_days, seasonality_result, seasonality_stream
+from .logics.jobs import TIMEOUT_ERROR, run_worker, claim_job
+from .logics.exports import export_key, write_export
+from .logics.corridor import corridor_result, site_results
+from .logics.holidays import DayFilter
+from .logics.design_volumes import design_volumes
+from .logics.factors import compute_monthly_factors, daily_totals, factor_year, monthly_factors
+from .logics.peak_hours import peak_hours, peak_rows
+from .views import charge_credit
+import os
+import tempfile
+import threading
+import gzip
+import csv
+from io import BytesIO
+import shutil
+import time
+import sqlite3
+from unittest import skipUnless
+from unittest.mock import Mock, patch, call
+from concurrent.futures import Future
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
 
 class PublicScatsApiTests(TestCase):
@@ -46,6 +86,8 @@ class PublicScatsApiTests(TestCase):
 @override_settings(QT_INTERVAL_COUNT_MIN=date(2000, 1, 1), QT_INTERVAL_COUNT_MAX=date(2030, 1, 1), FREE_PERIOD_AFTER_ACCOUNT_CREATION = timedelta(days=2))
 class PrivateUsersApiTests(TestCase):
     """Test the private users API"""
+    databases = '__all__'
+
     @classmethod
     def setUpTestData(cls):
         # create scats objects and build the db
@@ -782,7 +824,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -824,7 +866,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -903,7 +945,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -1132,7 +1174,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation_20210701.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -1208,7 +1250,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -1226,7 +1268,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -1268,7 +1310,7 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation_detectors_1_2_3.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
@@ -1344,14 +1386,14 @@ class PrivateUsersApiTests(TestCase):
         validation_df = pd.read_csv(r'C:\Users\Jihyung\Desktop\scats_seasonality\backend\scats\test_data\validation.csv', index_col='QT_INTERVAL_COUNT').dropna(axis='index')
         validation_df.index = pd.to_datetime(validation_df.index)
 
-        res_df = pd.io.json.read_json(json.dumps(res.data), orient='table')
+        res_df = pd.io.json.read_json(json.dumps(json.loads(res.content)), orient='table')
         res_df.index = pd.to_datetime(res_df.index)
         res_df.index = res_df.index.tz_localize(None)
 
         self.assertAlmostEqual(np.absolute((validation_df - res_df).to_numpy()).sum(), 0, places=0)
 
         prev_val = 0
-        for data in res.data['data']:
+        for data in json.loads(res.content)['data']:
             i = datetime.strptime(data['QT_INTERVAL_COUNT'].split('T')[0], "%Y-%m-%d").timestamp()
             self.assertGreater(i, prev_val)
             prev_val = i
@@ -1360,6 +1402,346 @@ class PrivateUsersApiTests(TestCase):
         self.assertEqual(user.seasonality_credit, 2)
         self.assertEqual(user.subscribed, False)
 
+    def test_seasonality_analysis_view_streams_ndjson(self):
+        """
+        Test that seasonality analysis view streams one line per day with
+        the same volumes as the JSON output when NDJSON is requested.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=3
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:seasonality-analysis')+'?scats_id=100&from=2021-07-01&to=2021-07-05&detectors=all'
+        res_json = client.get(url)
+        res = client.get(url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertNotEqual(res['ETag'], res_json['ETag'])
+
+        lines = [json.loads(line) for line in b''.join(res.streaming_content).splitlines()]
+        self.assertEqual(
+            [line['QT_INTERVAL_COUNT'] for line in lines],
+            ['2021-07-01', '2021-07-02', '2021-07-03', '2021-07-04', '2021-07-05']
+        )
+        for line, data in zip(lines, json.loads(res_json.content)['data']):
+            self.assertEqual(line['V00'], data['V00'])
+            self.assertEqual(line['CT_ALARM_24HOUR'], data['CT_ALARM_24HOUR'])
+
+        res = client.get(url.replace('to=2021-07-05', 'to=2021-06-05') + '&format=ndjson')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+
+        user.refresh_from_db()
+        self.assertEqual(user.seasonality_credit, 1)
+
+    def test_seasonality_analysis_view_group_by_detector(self):
+        """
+        Test that seasonality analysis view returns the volumes of each
+        detector per day with group=detector.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=3
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:seasonality-analysis')+'?scats_id=100&from=2021-07-01&to=2021-07-05&detectors=1,2'
+        res = client.get(url + '&group=approach')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(url + '&group=detector')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = json.loads(res.content)['data']
+        self.assertEqual(
+            [day['QT_INTERVAL_COUNT'] for day in data],
+            ['2021-07-01', '2021-07-02', '2021-07-03', '2021-07-04', '2021-07-05']
+        )
+        for day in data:
+            self.assertLessEqual(set(day['volumes']), {'1', '2'})
+            for volumes in day['volumes'].values():
+                self.assertEqual(len(volumes), 96)
+
+        user.refresh_from_db()
+        self.assertEqual(user.seasonality_credit, 2)
+
+    @override_settings(SCATS_CORRIDOR_WORKERS=0, SCATS_CORRIDOR_CHARGE='site')
+    def test_seasonality_analysis_view_several_sites(self):
+        """
+        Test that seasonality analysis view returns the result of several
+        sites and their total, charging one credit point per site with data.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=2
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:seasonality-analysis')+'?from=2021-07-01&to=2021-07-05&detectors=all'
+        res = client.get(url + '&scats_id=100,999998,999999')
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        res = client.get(url + '&scats_id=100,999999&total=1')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        content = json.loads(res.content)
+        self.assertIsNone(content['sites']['999999'])
+        self.assertEqual(content['total'], content['sites']['100'])
+
+        user.refresh_from_db()
+        self.assertEqual(user.seasonality_credit, 1)
+
+    def test_seasonality_analysis_view_aggregate_profiles(self):
+        """
+        Test that seasonality analysis view returns day of week profiles
+        with aggregate=dow, and rejects unknown aggregates.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=3
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:seasonality-analysis')+'?scats_id=100&from=2021-07-01&to=2021-07-14&detectors=all'
+        res = client.get(url + '&aggregate=year')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(url + '&aggregate=dow')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        content = json.loads(res.content)
+        self.assertEqual(content['aggregate'], 'dow')
+        # The data of the site ends on Monday 2021-07-05.
+        self.assertEqual(
+            [day['GROUP'] for day in content['data']],
+            ['Monday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        )
+        self.assertEqual([day['NB_DAYS'] for day in content['data']], [1] * 5)
+        flush_accesses()
+        self.assertTrue(ResultAccess.objects.filter(kind='seasonality-profile-dow').exists())
+
+        user.refresh_from_db()
+        self.assertEqual(user.seasonality_credit, 2)
+
+        res = client.get(url + '&aggregate=percentile')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        content = json.loads(res.content)
+        self.assertEqual([band['GROUP'] for band in content['data']], ['P10', 'P50', 'P85', 'P90'])
+        self.assertLessEqual(content['data'][0]['V32'], content['data'][3]['V32'])
+        self.assertEqual([band['NB_DAYS'] for band in content['data']], [5] * 4)
+        flush_accesses()
+        self.assertTrue(ResultAccess.objects.filter(kind='seasonality-percentile').exists())
+
+    def test_extract_and_seasonality_views_filter_days(self):
+        """
+        Test that extract and seasonality analysis views only return the
+        days of the week asked for, and reject unknown filters.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            subscribed=True
+        )
+        client.force_authenticate(user=user)
+
+        res = client.get(
+            reverse('scats:extract-scats-data')+'?scats_id=100&from=2021-07-01&to=2021-07-07&days=sat,sun'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(set(row['QT_INTERVAL_COUNT'] for row in json.loads(res.content))),
+            ['2021-07-03', '2021-07-04']
+        )
+
+        url = reverse('scats:seasonality-analysis')+'?scats_id=100&from=2021-07-01&to=2021-07-14&detectors=all'
+        res = client.get(url + '&exclude=holidays')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(url + '&days=thu,fri&exclude=public_holidays')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [day['QT_INTERVAL_COUNT'] for day in json.loads(res.content)['data']],
+            ['2021-07-01T00:00:00.000', '2021-07-02T00:00:00.000']
+        )
+
+        # The data of the site falls in the school holidays.
+        res = client.get(url + '&exclude=school_holidays')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['error'], "There was no data found. Please try again with a different request.")
+
+        # The calendars do not cover 2026.
+        res = client.get(
+            reverse('scats:seasonality-analysis')
+            + '?scats_id=100&from=2025-12-01&to=2026-01-31&detectors=all&exclude=public_holidays'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('2025-12-31', res.data['error'])
+
+    def test_design_volumes_view(self):
+        """
+        Test that design volumes view returns the AADT and the Nth highest
+        hours, and charges a seasonality credit point.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=2
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:design-volumes')+'?scats_id=100&from=2021-07-01&to=2021-07-31&detectors=all'
+        res = client.get(url + '&ranks=0')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(url + '&ranks=1,30')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        content = json.loads(res.content)
+        self.assertEqual(content['NB_DAYS'], 5)
+        self.assertGreater(content['AADT'], 0)
+        self.assertEqual([hour['rank'] for hour in content['design_hours']], [1, 30])
+        self.assertGreaterEqual(content['design_hours'][0]['volume'], content['design_hours'][1]['volume'])
+
+        user.refresh_from_db()
+        self.assertEqual(user.seasonality_credit, 1)
+
+    def test_monthly_factors_of_data_loaded_before_the_ingest_manifest(self):
+        """
+        Test that monthly factors are computed from the Scats data, also for
+        site-months without ingest manifest, with one aggregated query.
+        """
+        IngestManifest.objects.all().delete()
+        self.assertEqual(factor_year(), (date(2020, 8, 1), date(2021, 7, 31)))
+
+        with self.assertNumQueries(1):
+            scats_ids, totals, regions = daily_totals(date(2021, 7, 1), date(2021, 7, 31))
+        self.assertIn(100, scats_ids)
+        site = scats_ids.index(100)
+        for day in range(5):
+            self.assertEqual(
+                totals[site, day],
+                sum(
+                    row.QT_VOLUME_24HOUR
+                    for row in Scats.objects.filter(NB_SCATS_SITE=100, QT_INTERVAL_COUNT=date(2021, 7, day + 1))
+                    if row.QT_VOLUME_24HOUR >= 0
+                )
+            )
+        self.assertTrue(np.isnan(totals[site, 5:]).all())
+
+        self.assertGreater(compute_monthly_factors(), 0)
+        factor = MonthlyFactor.objects.get(NB_SCATS_SITE=100)
+        self.assertEqual((factor.month, factor.nb_days, factor.factor), (date(2021, 7, 1), 5, 1.0))
+        self.assertEqual(factor.NM_REGION, regions[site])
+
+    def test_peak_hours_view(self):
+        """
+        Test that peak hours view returns the AM and PM peak hours of each
+        day, and charges a scats credit point.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            scats_credit=2
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:peak-hours')+'?scats_id=100&from=2021-07-01&to=2021-07-31&detectors=all'
+        res = client.get(url + '&group=site')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        content = json.loads(res.content)
+        self.assertEqual(len(content['data']), 5)
+        self.assertIn('AM_PEAK_START', content['data'][0])
+        self.assertIn('PM_PHF', content['data'][0])
+
+        user.refresh_from_db()
+        self.assertEqual(user.scats_credit, 1)
+
+    def test_monthly_factors_view(self):
+        """
+        Test that monthly factors view returns the factors computed after
+        the ingest, by site or by region.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP'
+        )
+        client.force_authenticate(user=user)
+
+        res = client.get(reverse('scats:monthly-factors'))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.get(reverse('scats:monthly-factors')+'?scats_id=100')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # Only July 2021 is loaded, so it is the average month.
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['month'], '2021-07-01')
+        self.assertAlmostEqual(res.data[0]['factor'], 1.0)
+
+        res = client.get(reverse('scats:monthly-factors')+'?region='+res.data[0]['NM_REGION'])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(100, [factor['NB_SCATS_SITE'] for factor in res.data])
+
     def test_seasonality_analysis_view_successful_with_no_scats_credit_no_seasonality_credit_no_subscription_newly_created_account(self):
         """
         Test that seasonality analysis view is successful with no scats credit,
@@ -1453,3 +1835,1716 @@ class PrivateUsersApiTests(TestCase):
         self.assertEqual(user.scats_credit, 3)
         self.assertEqual(user.seasonality_credit, 3)
         self.assertEqual(user.subscribed, True)
+
+    def test_extract_scats_data_view_returns_not_modified_for_matching_etag_without_deducting_credit(self):
+        """
+        Test that extract scats data view returns 304 for a matching
+        If-None-Match header and does not deduct scats credit for it.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            scats_credit=3
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:extract-scats-data')+'?scats_id=100&from=2021-07-01&to=2021-07-05'
+        res = client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', res)
+        self.assertEqual(user.scats_credit, 2)
+
+        res_not_modified = client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res_not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res_not_modified['ETag'], res['ETag'])
+        self.assertEqual(user.scats_credit, 2)
+
+        res_other_range = client.get(
+            reverse('scats:extract-scats-data')+'?scats_id=100&from=2021-07-01&to=2021-07-04',
+            HTTP_IF_NONE_MATCH=res['ETag']
+        )
+        self.assertEqual(res_other_range.status_code, status.HTTP_200_OK)
+        self.assertEqual(user.scats_credit, 1)
+
+    def test_seasonality_analysis_view_returns_not_modified_for_matching_etag_without_deducting_credit(self):
+        """
+        Test that seasonality analysis view returns 304 for a matching
+        If-None-Match header and does not deduct seasonality credit for it.
+        """
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            company_name='3DP',
+            seasonality_credit=3
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        user.date_joined = user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        user.save()
+        client.force_authenticate(user=user)
+
+        url = reverse('scats:seasonality-analysis')+'?scats_id=100&from=2021-07-01&to=2021-07-05&detectors=1,2'
+        res = client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(user.seasonality_credit, 2)
+
+        res_not_modified = client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res_not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(user.seasonality_credit, 2)
+
+        record_ingest([(100, 2021, 7)])
+        res_reingested = client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res_reingested.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res_reingested['ETag'], res['ETag'])
+        self.assertEqual(user.seasonality_credit, 1)
+
+
+class CubeStoreTests(TestCase):
+    """Test the memory-mapped per site-month cube store"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.cube_store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cube_store_dir)
+
+        volumes = {f'V{str(i).zfill(2)}': i for i in range(96)}
+        volumes['V10'] = -1022
+        volumes['V11'] = None
+        for day in [1, 2, 31]:
+            for nb_detector in [1, 3]:
+                Scats.objects.create(
+                    NB_SCATS_SITE=100,
+                    QT_INTERVAL_COUNT=date(2021, 7, day),
+                    NB_DETECTOR=nb_detector,
+                    NM_REGION='CCS',
+                    CT_RECORDS=96,
+                    QT_VOLUME_24HOUR=4560,
+                    CT_ALARM_24HOUR=0,
+                    **volumes
+                )
+
+    def test_read_rows_matches_database(self):
+        """
+        Test that rows read from the cube store are the same as
+        rows read from the database.
+        """
+        db_rows = get_scats_rows(100, date(2021, 7, 2), date(2021, 7, 31))
+
+        with override_settings(SCATS_CUBE_STORE_DIR=self.cube_store_dir):
+            self.assertIsNone(cube_store.read_rows(100, date(2021, 7, 2), date(2021, 7, 31)))
+
+            cube_store.write_site_months([(100, 2021, 7)])
+            cube_rows = cube_store.read_rows(100, date(2021, 7, 2), date(2021, 7, 31))
+
+        self.assertEqual(len(cube_rows), 4)
+        self.assertEqual(cube_rows, db_rows)
+        self.assertEqual(cube_rows[0]['V10'], -1022)
+        self.assertIsNone(cube_rows[0]['V11'])
+
+    def test_read_rows_filters_detectors(self):
+        """
+        Test that rows read from the cube store are filtered by detectors.
+        """
+        with override_settings(SCATS_CUBE_STORE_DIR=self.cube_store_dir):
+            cube_store.write_site_months([(100, 2021, 7)])
+            cube_rows = cube_store.read_rows(100, date(2021, 7, 1), date(2021, 7, 1), [3])
+
+        self.assertEqual([row['NB_DETECTOR'] for row in cube_rows], [3])
+
+    def test_site_months_that_cannot_be_stored_are_left_to_the_database(self):
+        """
+        Test that a site-month the cube store cannot hold is logged and
+        removed from it.
+        """
+        with override_settings(SCATS_CUBE_STORE_DIR=self.cube_store_dir):
+            cube_store.write_site_months([(100, 2021, 7)])
+            build_cube = patch(
+                'scats.logics.cube_store.build_cube', side_effect=ValueError('Volume out of range.')
+            )
+            with build_cube, self.assertLogs('scats.logics.cube_store', 'WARNING') as logs:
+                cube_store.write_site_months([(100, 2021, 7)])
+            self.assertIn('Cube of site 100 for 2021-07 not written', logs.output[0])
+            self.assertIsNone(cube_store.read_rows(100, date(2021, 7, 2), date(2021, 7, 31)))
+
+    def test_read_rows_returns_none_if_month_is_missing(self):
+        """
+        Test that the database is used if a month is missing from the cube store.
+        """
+        with override_settings(SCATS_CUBE_STORE_DIR=self.cube_store_dir):
+            cube_store.write_site_months([(100, 2021, 7)])
+            self.assertIsNone(cube_store.read_rows(100, date(2021, 7, 1), date(2021, 8, 1)))
+
+
+class ArchiveTests(TestCase):
+    """Test the Parquet archive of historical months"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+        volumes = {f'V{str(i).zfill(2)}': i for i in range(96)}
+        volumes['V11'] = None
+        for qt_interval_count in [date(2021, 7, 30), date(2021, 7, 31), date(2021, 8, 1)]:
+            for nb_scats_site in [100, 101]:
+                for nb_detector in [1, 2]:
+                    Scats.objects.create(
+                        NB_SCATS_SITE=nb_scats_site,
+                        QT_INTERVAL_COUNT=qt_interval_count,
+                        NB_DETECTOR=nb_detector,
+                        NM_REGION='CCS',
+                        CT_RECORDS=96,
+                        QT_VOLUME_24HOUR=4560,
+                        CT_ALARM_24HOUR=0,
+                        **volumes
+                    )
+
+    def test_archived_month_is_read_from_archive(self):
+        """
+        Test that an archived month is removed from the Scats table
+        and is still returned for requests spanning archived and
+        non-archived months.
+        """
+        rows = get_scats_rows(100, date(2021, 7, 31), date(2021, 8, 1), [2])
+
+        with override_settings(SCATS_ARCHIVE_DIR=self.archive_dir):
+            row_count = archive.archive_month(2021, 7)
+            self.assertEqual(row_count, 8)
+            self.assertFalse(Scats.objects.filter(QT_INTERVAL_COUNT__lt=date(2021, 8, 1)).exists())
+            self.assertEqual(ArchivedMonth.objects.get().month, date(2021, 7, 1))
+
+            self.assertEqual(
+                get_scats_rows(100, date(2021, 7, 31), date(2021, 8, 1), [2]),
+                rows
+            )
+
+
+    def test_archived_months_are_not_ingested(self):
+        """
+        Test that loading rows of an archived month is refused without
+        inserting anything, since they would never be read.
+        """
+        def scats(qt_interval_count):
+            return Scats(
+                NB_SCATS_SITE=102, QT_INTERVAL_COUNT=qt_interval_count, NB_DETECTOR=1,
+                NM_REGION='CCS', CT_RECORDS=96, QT_VOLUME_24HOUR=0, CT_ALARM_24HOUR=0,
+            )
+
+        with override_settings(SCATS_ARCHIVE_DIR=self.archive_dir):
+            archive.archive_month(2021, 7)
+            with self.assertRaisesMessage(ValueError, '2021-07'):
+                bulk_create_scats([scats(date(2021, 8, 2)), scats(date(2021, 7, 2))])
+            self.assertFalse(Scats.objects.filter(NB_SCATS_SITE=102).exists())
+
+            bulk_create_scats([scats(date(2021, 8, 2))])
+            self.assertEqual(Scats.objects.filter(NB_SCATS_SITE=102).count(), 1)
+
+    def test_daily_totals_span_archive_and_table(self):
+        """
+        Test that daily totals of the monthly factors are grouped from the
+        archive for archived months and from the Scats table for the rest.
+        """
+        with override_settings(SCATS_ARCHIVE_DIR=self.archive_dir):
+            archive.archive_month(2021, 7)
+            scats_ids, totals, regions = daily_totals(date(2021, 7, 30), date(2021, 8, 1))
+
+        self.assertEqual(scats_ids, [100, 101])
+        np.testing.assert_array_equal(totals, [[9120] * 3, [9120] * 3])
+        self.assertEqual(regions, ['CCS', 'CCS'])
+
+class ScatsModelTests(TestCase):
+    """Test the compact Scats table"""
+    databases = '__all__'
+
+    def create_scats(self, nb_detector):
+        volumes = {f'V{str(i).zfill(2)}': 1 for i in range(96)}
+        return Scats.objects.create(
+            NB_SCATS_SITE=100,
+            QT_INTERVAL_COUNT=date(2021, 7, 1),
+            NB_DETECTOR=nb_detector,
+            NM_REGION='CCS',
+            CT_RECORDS=96,
+            QT_VOLUME_24HOUR=96,
+            CT_ALARM_24HOUR=0,
+            **volumes
+        )
+
+    def test_rows_of_same_site_are_kept_separately(self):
+        """
+        Test that saving and deleting a row only affects that row, and that
+        the natural key is unique.
+        """
+        self.create_scats(1)
+        scats = self.create_scats(2)
+        self.create_scats(3)
+        self.assertEqual(Scats.objects.filter(NB_SCATS_SITE=100).count(), 3)
+
+        scats.delete()
+        self.assertEqual(
+            list(Scats.objects.order_by('NB_DETECTOR').values_list('NB_DETECTOR', flat=True)),
+            [1, 3]
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic(using=scats_database()):
+            self.create_scats(1)
+
+    def test_ingesting_again_replaces_rows(self):
+        """
+        Test that rows loaded again replace the stored ones on the natural
+        key, and that rows of other detectors are left as they are.
+        """
+        def scats(nb_detector, volume):
+            return Scats(
+                NB_SCATS_SITE=100, QT_INTERVAL_COUNT=date(2021, 7, 1), NB_DETECTOR=nb_detector,
+                NM_REGION='CCS', CT_RECORDS=96, QT_VOLUME_24HOUR=96 * volume, CT_ALARM_24HOUR=0,
+                **{f'V{str(i).zfill(2)}': volume for i in range(96)}
+            )
+
+        bulk_create_scats([scats(1, 1), scats(2, 1)])
+        bulk_create_scats([scats(2, 5), scats(3, 1), scats(3, 2)])
+
+        self.assertEqual(
+            list(Scats.objects.order_by('NB_DETECTOR').values_list('NB_DETECTOR', 'V00', 'QT_VOLUME_24HOUR')),
+            [(1, 1, 96), (2, 5, 480), (3, 2, 192)]
+        )
+
+    def test_id_is_kept_when_ingesting_again(self):
+        """
+        Test that a row loaded again keeps its id, which is returned by
+        the extract endpoint.
+        """
+        scats = self.create_scats(1)
+        scats.V00 = 5
+        bulk_create_scats([Scats(**{
+            field.attname: getattr(scats, field.attname)
+            for field in Scats._meta.concrete_fields if not field.primary_key
+        })])
+        self.assertEqual(Scats.objects.get(NB_DETECTOR=1).V00, 5)
+        self.assertEqual(
+            ScatsSerializer(get_scats_rows(100, date(2021, 7, 1), date(2021, 7, 1)), many=True).data[0]['id'],
+            scats.id
+        )
+
+
+class ScatsRouterTests(SimpleTestCase):
+    """Test routing of the scats app to the dedicated SCATS database"""
+    def setUp(self):
+        self.router = ScatsRouter()
+
+    def test_scats_app_uses_default_database_if_not_configured(self):
+        """
+        Test that the scats app stays on the default database if no
+        dedicated SCATS database is configured.
+        """
+        self.assertEqual(self.router.db_for_read(Scats), 'default')
+        self.assertEqual(self.router.db_for_write(Scats), 'default')
+        self.assertIsNone(self.router.allow_migrate('default', 'scats'))
+
+    @patch('scats.routers.scats_database', return_value='scats')
+    def test_scats_app_uses_scats_database_if_configured(self, _):
+        """
+        Test that only the scats app is routed and migrated to
+        the dedicated SCATS database.
+        """
+        self.assertEqual(self.router.db_for_read(Scats), 'scats')
+        self.assertEqual(self.router.db_for_write(ArchivedMonth), 'scats')
+        self.assertIsNone(self.router.db_for_write(get_user_model()))
+
+        self.assertTrue(self.router.allow_migrate('scats', 'scats'))
+        self.assertFalse(self.router.allow_migrate('default', 'scats'))
+        self.assertTrue(self.router.allow_migrate('default', 'users'))
+        self.assertFalse(self.router.allow_migrate('scats', 'users'))
+
+    @override_settings(SCATS_READ_REPLICAS=['replica_1', 'replica_2'])
+    @patch('scats.routers.recently_ingested', return_value=False)
+    def test_reads_are_spread_over_replicas_round_robin(self, _):
+        """
+        Test that reads are sent to the replicas in turn.
+        """
+        aliases = [read_database(100, date(2021, 7, 1), date(2021, 7, 7)) for _ in range(4)]
+        self.assertEqual(sorted(aliases), ['replica_1', 'replica_1', 'replica_2', 'replica_2'])
+        self.assertNotEqual(aliases[0], aliases[1])
+
+    @override_settings(SCATS_READ_REPLICAS=['replica_1', 'replica_2'])
+    @patch('scats.routers.recently_ingested', return_value=True)
+    def test_recently_ingested_data_is_read_from_primary(self, _):
+        """
+        Test that data which has only just been ingested is read from the primary.
+        """
+        self.assertEqual(read_database(100, date(2021, 7, 1), date(2021, 7, 7)), 'default')
+        self.assertFalse(ScatsRouter().allow_migrate('replica_1', 'scats'))
+
+
+class IngestManifestTests(TestCase):
+    """Test the ingest manifest"""
+    databases = '__all__'
+
+    def test_record_ingest_bumps_version_and_marks_data_recent(self):
+        """
+        Test that recording an ingest bumps the version of the site-month
+        and makes the site-month count as recently ingested.
+        """
+        self.assertFalse(recently_ingested(100, date(2021, 7, 5), date(2021, 7, 6)))
+
+        record_ingest([(100, 2021, 7), (101, 2021, 7)])
+        record_ingest([(100, 2021, 7)])
+
+        self.assertEqual(IngestManifest.objects.get(NB_SCATS_SITE=100).version, 2)
+        self.assertEqual(IngestManifest.objects.get(NB_SCATS_SITE=101).version, 1)
+        self.assertTrue(recently_ingested(100, date(2021, 7, 5), date(2021, 7, 6)))
+        self.assertFalse(recently_ingested(100, date(2021, 8, 1), date(2021, 8, 6)))
+
+    def test_manifest_is_read_once_per_request(self):
+        """
+        Test that the ETag, the result cache key and the replica lag check
+        of a request share one query of the ingest manifest.
+        """
+        record_ingest([(100, 2021, 7), (100, 2021, 8)])
+        start_request()
+        try:
+            with self.assertNumQueries(1, using=scats_database()):
+                self.assertEqual(month_versions(100, date(2021, 7, 1), date(2021, 7, 31)), {(2021, 7): 1})
+                self.assertEqual(month_versions(100, date(2021, 7, 1), date(2021, 8, 31)), {(2021, 7): 1, (2021, 8): 1})
+                self.assertTrue(recently_ingested(100, date(2021, 8, 1), date(2021, 8, 6)))
+        finally:
+            finish_request()
+        with self.assertNumQueries(1, using=scats_database()):
+            month_versions(100, date(2021, 7, 1), date(2021, 7, 31))
+
+
+class ScatsShardingTests(SimpleTestCase):
+    """Test site-hash sharding of the Scats table"""
+    @override_settings(SCATS_SHARDS=['shard_1', 'shard_2', 'shard_3'])
+    def test_sites_are_spread_over_shards_by_stable_hash(self):
+        """
+        Test that a site always maps to the same shard and
+        that sites are spread over every shard.
+        """
+        shard_aliases = [shard_for_site(scats_id) for scats_id in range(1, 4001)]
+        self.assertEqual(shard_aliases, [shard_for_site(scats_id) for scats_id in range(1, 4001)])
+        for alias in ['shard_1', 'shard_2', 'shard_3']:
+            self.assertGreater(shard_aliases.count(alias), 1000)
+
+        self.assertEqual(read_database(100, date(2021, 7, 1), date(2021, 7, 7)), shard_for_site(100))
+
+    @override_settings(SCATS_SHARDS=['shard_1', 'shard_2'])
+    def test_router_routes_scats_instances_by_site(self):
+        """
+        Test that saving a Scats instance goes to the shard of its site and
+        that shards only migrate the Scats table.
+        """
+        router = ScatsRouter()
+        for scats_id in [100, 101, 102]:
+            self.assertEqual(
+                router.db_for_write(Scats, instance=Scats(NB_SCATS_SITE=scats_id)),
+                shard_for_site(scats_id)
+            )
+        self.assertEqual(router.db_for_write(IngestManifest), 'default')
+
+        self.assertTrue(router.allow_migrate('shard_1', 'scats', 'scats'))
+        self.assertTrue(router.allow_migrate('shard_1', 'scats'))
+        self.assertFalse(router.allow_migrate('shard_1', 'scats', 'ingestmanifest'))
+        self.assertFalse(router.allow_migrate('shard_1', 'users', 'user'))
+
+
+@skipUnless(len(settings.SCATS_SHARDS) > 1, 'Set SCATS_SHARD_URLS to at least two local databases.')
+class ScatsShardedDatabaseTests(TestCase):
+    """Test ingestion, reads and rebalancing against real shards"""
+    databases = '__all__'
+
+    def scats_instances(self, scats_ids):
+        volumes = {f'V{str(i).zfill(2)}': 1 for i in range(96)}
+        return [
+            Scats(
+                NB_SCATS_SITE=scats_id,
+                QT_INTERVAL_COUNT=date(2021, 7, 1),
+                NB_DETECTOR=1,
+                NM_REGION='CCS',
+                CT_RECORDS=96,
+                QT_VOLUME_24HOUR=96,
+                CT_ALARM_24HOUR=0,
+                **volumes
+            )
+            for scats_id in scats_ids
+        ]
+
+    def test_rows_are_ingested_and_read_from_shard_of_site(self):
+        """
+        Test that ingested rows are stored on the shard of their site only
+        and are read back from there.
+        """
+        bulk_create_scats(self.scats_instances(range(100, 120)))
+
+        for scats_id in range(100, 120):
+            for alias in settings.SCATS_SHARDS:
+                self.assertEqual(
+                    Scats.objects.using(alias).filter(NB_SCATS_SITE=scats_id).exists(),
+                    alias == shard_for_site(scats_id)
+                )
+            self.assertEqual(len(get_scats_rows(scats_id, date(2021, 7, 1), date(2021, 7, 1))), 1)
+
+    def test_rebalance_moves_rows_to_shard_of_site(self):
+        """
+        Test that rebalancing moves rows stored on the wrong shard.
+        """
+        wrong_shard = [
+            scats_id for scats_id in range(100, 120)
+            if shard_for_site(scats_id) != settings.SCATS_SHARDS[0]
+        ]
+        Scats.objects.using(settings.SCATS_SHARDS[0]).bulk_create(self.scats_instances(wrong_shard))
+
+        call_command('rebalance_scats_shards', stdout=StringIO())
+
+        for scats_id in wrong_shard:
+            self.assertFalse(
+                Scats.objects.using(settings.SCATS_SHARDS[0]).filter(NB_SCATS_SITE=scats_id).exists()
+            )
+            self.assertTrue(
+                Scats.objects.using(shard_for_site(scats_id)).filter(NB_SCATS_SITE=scats_id).exists()
+            )
+
+    def test_rebalance_replaces_conflicting_rows_and_checks_counts(self):
+        """
+        Test that rows already on the target shard are replaced by the moved
+        rows, and that the source rows are kept if the counts differ.
+        """
+        source = settings.SCATS_SHARDS[0]
+        scats_id = next(
+            scats_id for scats_id in range(100, 120) if shard_for_site(scats_id) != source
+        )
+        target = shard_for_site(scats_id)
+        [moved] = self.scats_instances([scats_id])
+        moved.V00 = 7
+        Scats.objects.using(source).bulk_create([moved])
+        Scats.objects.using(target).bulk_create(self.scats_instances([scats_id]))
+
+        self.assertEqual(move_site(scats_id, source, target, 100), 1)
+        self.assertEqual(Scats.objects.using(target).get(NB_SCATS_SITE=scats_id).V00, 7)
+        self.assertFalse(Scats.objects.using(source).filter(NB_SCATS_SITE=scats_id).exists())
+
+        [extra] = self.scats_instances([scats_id])
+        extra.NB_DETECTOR = 2
+        Scats.objects.using(target).bulk_create([extra])
+        Scats.objects.using(source).bulk_create(self.scats_instances([scats_id]))
+        with self.assertRaises(CommandError):
+            move_site(scats_id, source, target, 100)
+        self.assertTrue(Scats.objects.using(source).filter(NB_SCATS_SITE=scats_id).exists())
+
+
+class ResultCacheTests(SimpleTestCase):
+    """Test the result cache backends"""
+    def check_backend(self, cache):
+        cache.set('a', b'a' * 40, 100, [(2021, 6), (2021, 7)])
+        cache.set('b', b'b' * 40, 100, [(2021, 8)])
+        self.assertEqual(cache.get('a', 100), b'a' * 40)
+
+        # 'b' is the least recently used entry and is evicted.
+        cache.set('c', b'c' * 40, 101, [(2021, 7)])
+        self.assertIsNone(cache.get('b', 100))
+        self.assertEqual(cache.get('a', 100), b'a' * 40)
+        self.assertEqual(cache.get('c', 101), b'c' * 40)
+
+        # Only entries of the site and month are invalidated.
+        cache.invalidate(100, 2021, 7)
+        self.assertIsNone(cache.get('a', 100))
+        self.assertEqual(cache.get('c', 101), b'c' * 40)
+
+        cache.clear()
+        self.assertIsNone(cache.get('c', 101))
+
+    def test_locmem_result_cache(self):
+        """
+        Test LRU eviction under the byte budget and invalidation per site
+        and month of the local memory backend.
+        """
+        self.check_backend(LocMemResultCache(max_bytes=100))
+
+    def test_file_result_cache(self):
+        """
+        Test LRU eviction under the byte budget and invalidation per site
+        and month of the file backend.
+        """
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.check_backend(FileResultCache(location, max_bytes=100))
+
+    def test_file_result_cache_scans_only_over_budget(self):
+        """
+        Test that the directory is only scanned once the running total of
+        the file backend is over the byte budget.
+        """
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        cache = FileResultCache(location, max_bytes=100)
+        with patch.object(cache, '_entries', wraps=cache._entries) as entries:
+            cache.set('a', b'a' * 40, 100, [(2021, 7)])
+            cache.set('b', b'b' * 40, 100, [(2021, 8)])
+            cache.set('b', b'b' * 40, 100, [(2021, 8)])
+            cache.invalidate(100, 2021, 8)
+            cache.set('c', b'c' * 40, 101, [(2021, 7)])
+            self.assertEqual(entries.call_count, 1)
+
+            cache.set('d', b'd' * 40, 101, [(2021, 8)])
+            self.assertEqual(entries.call_count, 2)
+        self.assertIsNone(cache.get('a', 100))
+        self.assertEqual(cache.get('d', 101), b'd' * 40)
+
+
+class CoalescingTests(SimpleTestCase):
+    """Test single-flight coalescing of identical computations"""
+    def test_concurrent_calls_share_one_computation(self):
+        """
+        Test that concurrent calls with the same key wait for one
+        computation and all get its result.
+        """
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            release.wait(5)
+            return b'result'
+
+        compute = Mock(side_effect=compute)
+        results = []
+
+        def request():
+            results.append(single_flight('seasonality:100', compute))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=request) for _ in range(4)]
+        for follower in followers:
+            follower.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(results, [b'result'] * 5)
+
+        # Later calls compute again.
+        single_flight('seasonality:100', compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_errors_are_raised_to_every_caller(self):
+        """
+        Test that an exception of the computation is not swallowed.
+        """
+        with self.assertRaises(ValueError):
+            single_flight('seasonality:100', Mock(side_effect=ValueError))
+
+
+class ChargeCreditTests(TestCase):
+    """Test that credit points are deducted atomically"""
+    def test_charge_credit(self):
+        """
+        Test that every charge deducts one point, also through a stale
+        user instance, and that no charge is made without credit.
+        """
+        user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            scats_credit=2
+        )
+        stale_user = get_user_model().objects.get(pk=user.pk)
+
+        self.assertTrue(charge_credit(user, 'scats_credit'))
+        self.assertTrue(charge_credit(stale_user, 'scats_credit'))
+        self.assertEqual(stale_user.scats_credit, 0)
+        self.assertFalse(charge_credit(user, 'scats_credit'))
+        self.assertEqual(user.scats_credit, 0)
+
+
+class AnalysisJobTests(TestCase):
+    """Test background analysis jobs"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            seasonality_credit=1
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        self.user.date_joined = self.user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    def create_job(self):
+        return self.client.post(
+            reverse('scats:seasonality-analysis-job'),
+            {'scats_id': 100, 'from': '2021-07-01', 'to': '2021-07-31', 'detectors': '1,2'},
+            format='json'
+        )
+
+    @patch('scats.logics.results.seasonality_result', Mock(return_value=b'{"data":[]}'))
+    def test_job_is_charged_on_success_only(self):
+        """
+        Test that a job is created, run by a worker and charged once
+        when it succeeds, and that its result can be fetched.
+        """
+        res = self.create_job()
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], AnalysisJob.PENDING)
+        job_url = reverse('scats:job', kwargs={'job_id': res.data['id']})
+        result_url = reverse('scats:job-result', kwargs={'job_id': res.data['id']})
+
+        self.assertEqual(self.client.get(result_url).status_code, status.HTTP_409_CONFLICT)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.seasonality_credit, 1)
+
+        self.assertEqual(run_worker(stop_when_idle=True), 1)
+
+        self.assertEqual(self.client.get(job_url).data['status'], AnalysisJob.SUCCEEDED)
+        res = self.client.get(result_url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.content, b'{"data":[]}')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.seasonality_credit, 0)
+
+        # No credit left when the second job finishes.
+        self.user.seasonality_credit = 1
+        self.user.save()
+        self.create_job()
+        self.user.seasonality_credit = 0
+        self.user.save()
+        run_worker(stop_when_idle=True)
+        self.assertEqual(AnalysisJob.objects.filter(status=AnalysisJob.FAILED).count(), 1)
+
+    @patch('scats.logics.results.seasonality_result', Mock(return_value=None))
+    def test_job_without_data_fails_without_charge(self):
+        """
+        Test that a job finding no data fails and is not charged.
+        """
+        res = self.create_job()
+        run_worker(stop_when_idle=True)
+
+        res = self.client.get(reverse('scats:job', kwargs={'job_id': res.data['id']}))
+        self.assertEqual(res.data['status'], AnalysisJob.FAILED)
+        self.assertIn('no data found', res.data['error'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.seasonality_credit, 1)
+
+    def test_jobs_of_other_users_are_not_found(self):
+        """
+        Test that users cannot see jobs of other users.
+        """
+        job = AnalysisJob.objects.create(
+            user=get_user_model().objects.create_user(
+                email='other@test.com', password='testpass123',
+                first_name='Jane', last_name='Doe'
+            ),
+            kind='seasonality', params={}
+        )
+        res = self.client.get(reverse('scats:job', kwargs={'job_id': job.id}))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(SCATS_JOB_TIMEOUT=timedelta(minutes=5))
+    def test_abandoned_jobs_are_reclaimed(self):
+        """
+        Test that a running job whose worker died is claimed again after
+        the timeout, and that a claimed job is not claimed twice.
+        """
+        self.create_job()
+        job = claim_job()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_job())
+
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            started_at=job.started_at - timedelta(minutes=6)
+        )
+        reclaimed = claim_job()
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    @override_settings(SCATS_JOB_TIMEOUT=timedelta(minutes=5), SCATS_JOB_MAX_ATTEMPTS=2)
+    def test_abandoned_jobs_fail_after_max_attempts(self):
+        """
+        Test that a job whose worker died on every attempt is marked as
+        failed instead of being claimed again.
+        """
+        self.create_job()
+        for attempt in range(2):
+            job = claim_job()
+            self.assertEqual(job.attempts, attempt + 1)
+            AnalysisJob.objects.filter(pk=job.pk).update(
+                started_at=job.started_at - timedelta(minutes=6)
+            )
+
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertEqual(job.error, TIMEOUT_ERROR)
+
+
+def export_rows(scats_id, from_date, to_date):
+    return [
+        {
+            'id': scats_id * 100 + from_date.day,
+            'NB_SCATS_SITE': scats_id, 'QT_INTERVAL_COUNT': from_date, 'NB_DETECTOR': 1,
+            **{f'V{str(i).zfill(2)}': i for i in range(96)},
+            'NM_REGION': 'CCS', 'CT_RECORDS': 96, 'QT_VOLUME_24HOUR': 4560, 'CT_ALARM_24HOUR': 0,
+        }
+    ]
+
+
+class ExportJobTests(TestCase):
+    """Test bulk export jobs"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_dir)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test@test.com',
+            password='testpass123',
+            first_name='John',
+            last_name='Doe',
+            scats_credit=10
+        )
+        # This step is necessary to make sure that
+        # user is not on the free period after creating account.
+        self.user.date_joined = self.user.date_joined - (settings.FREE_PERIOD_AFTER_ACCOUNT_CREATION + timedelta(minutes=1))
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+    @patch('scats.logics.exports.get_scats_rows', Mock(side_effect=export_rows))
+    def test_export_job(self):
+        """
+        Test that an export of several sites and a long range is written in
+        the background, downloaded, and charged one scats credit point per
+        site and started 7 days.
+        """
+        with self.settings(SCATS_EXPORT_DIR=self.export_dir):
+            res = self.client.post(
+                reverse('scats:export-job'),
+                {'scats_ids': '100,101', 'from': '2021-07-01', 'to': '2021-07-31'},
+                format='json'
+            )
+            self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+            job_id = res.data['id']
+
+            run_worker(stop_when_idle=True)
+
+            res = self.client.get(reverse('scats:job-result', kwargs={'job_id': job_id}))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertTrue(res.data['url'].endswith(
+                reverse('scats:job-download', kwargs={'job_id': job_id})
+            ))
+
+            res = self.client.get(reverse('scats:job-download', kwargs={'job_id': job_id}))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            content = gzip.decompress(b''.join(res.streaming_content)).decode()
+
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0][:4], ['id', 'NB_SCATS_SITE', 'QT_INTERVAL_COUNT', 'NB_DETECTOR'])
+        self.assertEqual([row[1] for row in rows[1:]], ['100', '101'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.scats_credit, 0)
+
+    def test_export_job_requires_enough_credit(self):
+        """
+        Test that an export costing more than the user's credit is refused.
+        """
+        res = self.client.post(
+            reverse('scats:export-job'),
+            {'scats_ids': [100, 101, 102], 'from': '2021-07-01', 'to': '2021-07-31'},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(AnalysisJob.objects.count(), 0)
+
+    def test_export_job_range_is_limited(self):
+        """
+        Test that an export of more than 365 days is refused.
+        """
+        res = self.client.post(
+            reverse('scats:export-job'),
+            {'scats_ids': [100], 'from': '2021-01-01', 'to': '2022-01-01'},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(AnalysisJob.objects.count(), 0)
+
+    @patch('scats.logics.exports.get_scats_rows', Mock(side_effect=export_rows))
+    def test_export_is_deleted_when_credit_is_spent(self):
+        """
+        Test that an export is deleted, and the job failed, when the user
+        spent their credit before the job finished.
+        """
+        with self.settings(SCATS_EXPORT_DIR=self.export_dir):
+            res = self.client.post(
+                reverse('scats:export-job'),
+                {'scats_ids': '100,101', 'from': '2021-07-01', 'to': '2021-07-31'},
+                format='json'
+            )
+            self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+            self.user.scats_credit = 0
+            self.user.save()
+
+            run_worker(stop_when_idle=True)
+
+        job = AnalysisJob.objects.get(pk=res.data['id'])
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertEqual(job.output, '')
+        self.assertFalse(os.path.exists(os.path.join(self.export_dir, export_key(job.pk))))
+
+
+class ExportWriterTests(SimpleTestCase):
+    """Test the streaming export writer"""
+    @patch('scats.logics.exports.get_scats_rows', side_effect=export_rows)
+    def test_rows_are_read_one_site_month_at_a_time(self, get_scats_rows):
+        """
+        Test that the export reads one site-month at a time.
+        """
+        f = BytesIO()
+        row_count = write_export(f, [100, 101], date(2021, 6, 15), date(2021, 7, 10))
+
+        self.assertEqual(row_count, 4)
+        self.assertEqual(get_scats_rows.call_args_list, [
+            call(100, date(2021, 6, 15), date(2021, 6, 30)),
+            call(100, date(2021, 7, 1), date(2021, 7, 10)),
+            call(101, date(2021, 6, 15), date(2021, 6, 30)),
+            call(101, date(2021, 7, 1), date(2021, 7, 10)),
+        ])
+        rows = list(csv.reader(StringIO(gzip.decompress(f.getvalue()).decode())))
+        self.assertEqual(rows[1][0], '10015')
+        self.assertEqual(len(rows), 5)
+
+
+class SeasonalityEngineTests(SimpleTestCase):
+    """Test the incremental seasonality analysis engine"""
+    def make_cube(self, year, month, cells):
+        """
+        cells maps (day, detector) to (V00, V01, CT_ALARM_24HOUR).
+        Other volumes are 1.
+        """
+        cube = np.zeros((31, 2), dtype=cube_store.CUBE_DTYPE)
+        for (day, detector), (v00, v01, alarms) in cells.items():
+            cell = cube[day - 1, detector - 1]
+            cell['valid'] = True
+            cell['volumes'] = [v00, v01] + [1] * 94
+            cell['CT_ALARM_24HOUR'] = alarms
+        return (year, month, cube)
+
+    def setUp(self):
+        self.june = self.make_cube(2021, 6, {
+            (1, 1): (10, 3, 1), (1, 2): (-1022, cube_store.NULL_VOLUME, 1),
+            (2, 1): (20, 4, 0), (2, 2): (5, -1, 0),
+        })
+        self.july = self.make_cube(2021, 7, {
+            (1, 1): (30, 5, 2), (1, 2): (11, -1, 0),
+        })
+
+    def result(self, cubes):
+        partial = SeasonalityPartial.merge([
+            SeasonalityPartial.from_cube(cube, date(year, month, 1))
+            for year, month, cube in cubes
+        ])
+        return pd.read_json(BytesIO(partial.to_json()), orient='table')
+
+    def test_invalid_volumes_are_filled_with_range_means(self):
+        """
+        Test that invalid volumes are replaced by the mean of the detector
+        and time period over the range, and that the fill is re-applied
+        when the range is extended.
+        """
+        june = self.result([self.june])
+        self.assertEqual(list(pd.to_datetime(june.index).day), [1, 2])
+        self.assertEqual(list(june['V00']), [10 + 5, 20 + 5])
+        # Detector 2 has no valid V01 in June.
+        self.assertEqual(list(june['V01']), [3, 4])
+        self.assertEqual(list(june['V02']), [2, 2])
+        self.assertEqual(list(june['CT_ALARM_24HOUR']), [2, 0])
+
+        june_july = self.result([self.june, self.july])
+        self.assertEqual(list(june_july['V00']), [10 + 8, 20 + 5, 30 + 11])
+
+    def test_merged_partials_match_a_full_recompute(self):
+        """
+        Test that partials restored from their encoding give the same
+        result as partials computed from scratch.
+        """
+        partials = [
+            SeasonalityPartial.from_cube(cube, date(year, month, 1))
+            for year, month, cube in [self.june, self.july]
+        ]
+        restored = [SeasonalityPartial.from_bytes(p.to_bytes()) for p in partials]
+        self.assertEqual(
+            SeasonalityPartial.merge(restored).to_json(),
+            SeasonalityPartial.merge(partials).to_json()
+        )
+
+    def test_json_is_encoded_like_pandas_table_json(self):
+        """
+        Test that the JSON result is written with the same bytes as pandas
+        DataFrame.to_json(orient='table') of the volumes.
+        """
+        partial = SeasonalityPartial.merge([
+            SeasonalityPartial.from_cube(cube, date(year, month, 1))
+            for year, month, cube in [self.june, self.july]
+        ])
+        df = pd.DataFrame(
+            partial.volumes(partial.sums / np.maximum(partial.counts, 1)),
+            columns=COLUMNS,
+            index=pd.Index(
+                [date.fromordinal(int(day)) for day in partial.days],
+                name='QT_INTERVAL_COUNT', dtype=object
+            ),
+        )
+        self.assertEqual(partial.to_json(), df.to_json(orient='table').encode())
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': ''})
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_result_is_computed_one_month_at_a_time(self):
+        """
+        Test that the result computed month by month is the result of the
+        merged range, and that each month is read once.
+        """
+        cubes = {(2021, 6): self.june, (2021, 7): self.july}
+        with patch(
+            'scats.logics.results.get_scats_cubes',
+            side_effect=lambda scats_id, from_date, to_date, detectors, day_filter: [
+                cubes[from_date.year, from_date.month]
+            ]
+        ) as get_scats_cubes:
+            content = seasonality_result(100, date(2021, 6, 1), date(2021, 7, 31), [1, 2])
+        self.assertEqual(get_scats_cubes.call_count, 2)
+
+        merged = SeasonalityPartial.merge([
+            SeasonalityPartial.from_cube(cube, date(year, month, 1), [1, 2])
+            for year, month, cube in [self.june, self.july]
+        ])
+        self.assertEqual(content, merged.to_json())
+
+    def test_detector_rows_fill_each_detector(self):
+        """
+        Test that each reporting detector has its own volumes, with invalid
+        volumes filled with the mean of the detector over the range.
+        """
+        partials = [
+            SeasonalityPartial.from_cube(cube, date(year, month, 1))
+            for year, month, cube in [self.june, self.july]
+        ]
+        means, nb_days = SeasonalityPartial.detector_means(partials)
+        self.assertEqual(nb_days, 3)
+
+        year, month, cube = self.june
+        rows = [json.loads(row) for row in detector_rows(cube, date(2021, 6, 1), means, [1, 2, 3])]
+        self.assertEqual([row['QT_INTERVAL_COUNT'] for row in rows], ['2021-06-01', '2021-06-02'])
+        self.assertEqual(rows[0]['volumes']['1'][:3], [10, 3, 1])
+        self.assertEqual(rows[0]['volumes']['2'][:3], [8, 0, 1])
+        self.assertEqual(rows[1]['volumes']['2'][:3], [5, 0, 1])
+        self.assertEqual(rows[0]['CT_ALARM_24HOUR'], {'1': 1, '2': 1})
+
+        year, month, cube = self.july
+        rows = [json.loads(row) for row in detector_rows(cube, date(2021, 7, 1), means, [2])]
+        self.assertEqual(rows, [{
+            'QT_INTERVAL_COUNT': '2021-07-01',
+            'volumes': {'2': [11, 0] + [1] * 94},
+            'CT_ALARM_24HOUR': {'2': 0},
+        }])
+
+    def test_profiles_average_the_days_of_each_group(self):
+        """
+        Test that profiles are the mean filled volumes of the days of each
+        group, leaving out groups without days.
+        """
+        partials = [
+            SeasonalityPartial.from_cube(cube, date(year, month, 1))
+            for year, month, cube in [self.june, self.july]
+        ]
+        means, nb_days = SeasonalityPartial.detector_means(partials)
+
+        # 2021-06-01 is a Tuesday, the days are worth 18, 25 and 41.
+        content = json.loads(profile_json(partials, means, 'dow'))
+        self.assertEqual(content['aggregate'], 'dow')
+        self.assertEqual(
+            [(day['GROUP'], day['NB_DAYS'], day['V00']) for day in content['data']],
+            [('Tuesday', 1, 18.0), ('Wednesday', 1, 25.0), ('Thursday', 1, 41.0)]
+        )
+
+        content = json.loads(profile_json(partials, means, 'month'))
+        self.assertEqual(
+            [(month['GROUP'], month['NB_DAYS'], month['V00']) for month in content['data']],
+            [('June', 2, 21.5), ('July', 1, 41.0)]
+        )
+
+        content = json.loads(profile_json(iter(partials), means, 'weekday_weekend'))
+        self.assertEqual(
+            [(group['GROUP'], group['NB_DAYS'], group['V00']) for group in content['data']],
+            [('weekday', 3, 28.0)]
+        )
+
+    def test_percentile_bands_leave_out_invalid_volumes(self):
+        """
+        Test that percentile bands are those of the valid site totals of
+        each interval across the days, null if no day is valid.
+        """
+        rng = np.random.default_rng(0)
+        partials = []
+        for first_day, nb_days in [(date(2021, 6, 1), 30), (date(2021, 7, 1), 31)]:
+            missing = np.zeros((nb_days, 2, 96), dtype=np.bool_)
+            missing[:, 1, 95] = True
+            missing[:, 0] = rng.random((nb_days, 96)) < 0.2
+            partials.append(SeasonalityPartial(
+                days=first_day.toordinal() + np.arange(nb_days),
+                known=rng.integers(0, 200, (nb_days, 96)),
+                missing=missing,
+                alarms=np.zeros(nb_days, dtype=np.int64),
+                sums=np.zeros((2, 96), dtype=np.int64),
+                counts=np.zeros((2, 96), dtype=np.int64),
+            ))
+
+        content = json.loads(percentile_json(iter(partials)))
+
+        known = np.concatenate([partial.known for partial in partials])
+        missing = np.concatenate([partial.missing.any(axis=1) for partial in partials])
+        self.assertEqual(content['aggregate'], 'percentile')
+        self.assertEqual([band['GROUP'] for band in content['data']], [f'P{p}' for p in PERCENTILES])
+        for percentile, band in zip(PERCENTILES, content['data']):
+            self.assertEqual(band['NB_DAYS'], 61)
+            self.assertIsNone(band['V95'])
+            for interval in [0, 40, 94]:
+                valid = known[~missing[:, interval], interval]
+                self.assertAlmostEqual(
+                    band[f'V{interval:02d}'], round(np.percentile(valid, percentile), 2)
+                )
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': ''})
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_stream_matches_result(self):
+        """
+        Test that the NDJSON stream has the volumes of the JSON result.
+        """
+        cubes = {(2021, 6): self.june, (2021, 7): self.july}
+        with patch(
+            'scats.logics.results.get_scats_cubes',
+            side_effect=lambda scats_id, from_date, to_date, detectors, day_filter: [
+                cubes[from_date.year, from_date.month]
+            ]
+        ):
+            content = seasonality_result(100, date(2021, 6, 1), date(2021, 7, 31), [1, 2])
+            lines = list(seasonality_stream(100, date(2021, 6, 1), date(2021, 7, 31), [1, 2]))
+            self.assertIsNone(seasonality_stream(100, date(2021, 6, 3), date(2021, 6, 30), [1, 2]))
+
+        self.assertEqual(
+            [json.loads(line)['QT_INTERVAL_COUNT'] for line in lines],
+            ['2021-06-01', '2021-06-02', '2021-07-01']
+        )
+        for line, data in zip(lines, json.loads(content)['data']):
+            line = json.loads(line)
+            del line['QT_INTERVAL_COUNT'], data['QT_INTERVAL_COUNT']
+            self.assertEqual(line, data)
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'})
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_stream_fills_months_as_lines_are_sent(self):
+        """
+        Test that the stream reads every month once for the means, then one
+        month at a time from the result cache as lines are consumed.
+        """
+        get_result_cache().clear()
+        cubes = {(2021, 6): self.june, (2021, 7): self.july}
+        get_scats_cubes = Mock(
+            side_effect=lambda scats_id, from_date, to_date, detectors, day_filter: [
+                cubes[from_date.year, from_date.month]
+            ]
+        )
+        with patch('scats.logics.results.get_scats_cubes', get_scats_cubes), \
+                patch('scats.logics.results.seasonality_days', wraps=seasonality_days) as days:
+            lines = seasonality_stream(100, date(2021, 6, 1), date(2021, 7, 31), [1, 2])
+            self.assertEqual(days.call_count, 2)
+            next(lines)
+            self.assertEqual(days.call_count, 3)
+            self.assertEqual(len(list(lines)), 2)
+            self.assertEqual(days.call_count, 4)
+        self.assertEqual(get_scats_cubes.call_count, 2)
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'})
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_extending_a_range_only_reads_the_new_months(self):
+        """
+        Test that extending a range reuses the cached partials of the
+        months already analysed.
+        """
+        get_result_cache().clear()
+        cubes = {(2021, 6): self.june, (2021, 7): self.july}
+        with patch(
+            'scats.logics.results.get_scats_cubes',
+            side_effect=lambda scats_id, from_date, to_date, detectors, day_filter: [
+                cubes[from_date.year, from_date.month]
+            ]
+        ) as get_scats_cubes:
+            seasonality_result(100, date(2021, 6, 1), date(2021, 6, 30), [1, 2])
+            content = seasonality_result(100, date(2021, 6, 1), date(2021, 7, 31), [1, 2])
+
+        self.assertEqual(
+            [c.args[1] for c in get_scats_cubes.call_args_list],
+            [date(2021, 6, 1), date(2021, 7, 1)]
+        )
+        self.assertEqual(
+            [day['V00'] for day in json.loads(content)['data']], [18, 25, 41]
+        )
+
+
+class CorridorTests(SimpleTestCase):
+    """Test the seasonality analysis of several sites"""
+    def site_result(self, v00, days):
+        partial = SeasonalityPartial(
+            days=np.array([date(2021, 7, day).toordinal() for day in days]),
+            known=np.full((len(days), 96), v00),
+            missing=np.zeros((len(days), 1, 96), dtype=np.bool_),
+            alarms=np.zeros(len(days), dtype=np.int64),
+            sums=np.zeros((1, 96), dtype=np.int64),
+            counts=np.zeros((1, 96), dtype=np.int64),
+        )
+        return partial.to_json()
+
+    def setUp(self):
+        self.results = {100: self.site_result(2, [1, 2]), 101: self.site_result(3, [2, 3]), 102: None}
+
+    @override_settings(
+        SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'},
+        SCATS_CORRIDOR_WORKERS=0,
+    )
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_corridor_result_has_sites_and_total(self):
+        """
+        Test that the result of several sites has the result of each site,
+        null for sites without data, and the daily sum of the sites.
+        """
+        get_result_cache().clear()
+        with patch(
+            'scats.logics.corridor.seasonality_result',
+            side_effect=lambda scats_id, *args: self.results[scats_id]
+        ):
+            content, nb_sites = corridor_result(
+                [101, 100, 102], date(2021, 7, 1), date(2021, 7, 3), [1], total=True
+            )
+        self.assertEqual(nb_sites, 2)
+
+        content = json.loads(content)
+        self.assertEqual(list(content['sites']), ['101', '100', '102'])
+        self.assertEqual(content['sites']['100'], json.loads(self.results[100]))
+        self.assertIsNone(content['sites']['102'])
+        self.assertEqual(
+            [(day['QT_INTERVAL_COUNT'], day['V00']) for day in content['total']['data']],
+            [('2021-07-01T00:00:00.000', 2), ('2021-07-02T00:00:00.000', 5), ('2021-07-03T00:00:00.000', 3)]
+        )
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'})
+    @patch('scats.logics.result_cache.data_version', Mock(return_value=''))
+    def test_uncached_sites_are_computed_in_the_pool(self):
+        """
+        Test that only the sites not cached are sent to the process pool,
+        and that their results are cached in the requesting process.
+        """
+        get_result_cache().clear()
+        get_or_compute('seasonality', 100, date(2021, 7, 1), date(2021, 7, 3), '1', lambda: self.results[100])
+
+        def submit(fn, scats_id, *args):
+            future = Future()
+            future.set_result(self.results[scats_id])
+            return future
+
+        pool = Mock(submit=Mock(side_effect=submit))
+        with patch('scats.logics.corridor._get_pool', return_value=pool):
+            contents = site_results([100, 101, 102], date(2021, 7, 1), date(2021, 7, 3), [1])
+        self.assertEqual(contents, self.results)
+        self.assertEqual([c.args[1] for c in pool.submit.call_args_list], [101, 102])
+
+        with patch('scats.logics.corridor._get_pool', return_value=pool):
+            site_results([100, 101], date(2021, 7, 1), date(2021, 7, 3), [1])
+        self.assertEqual(pool.submit.call_count, 2)
+
+    def test_no_pool_below_two_workers(self):
+        """
+        Test that a single corridor worker computes the sites in the request.
+        """
+        for workers in (0, 1):
+            with self.settings(SCATS_CORRIDOR_WORKERS=workers):
+                self.assertIsNone(corridor._get_pool())
+
+
+class DayFilterTests(SimpleTestCase):
+    """Test the calendar day filters"""
+    def test_parse(self):
+        """
+        Test that days and exclusions are parsed and encoded as a key.
+        """
+        self.assertIsNone(DayFilter.parse(None, ''))
+        with self.assertRaises(ValueError):
+            DayFilter.parse('tuesday', None)
+        with self.assertRaises(ValueError):
+            DayFilter.parse(None, 'holidays')
+
+        day_filter = DayFilter.parse('Thu,tue,wed', 'school_holidays,public_holidays')
+        self.assertEqual(day_filter.key(), 'days=tue,wed,thu&exclude=public_holidays,school_holidays')
+        self.assertEqual(DayFilter.from_key(day_filter.key()).key(), day_filter.key())
+        self.assertIsNone(DayFilter.from_key(''))
+
+    def test_matches(self):
+        """
+        Test that days of other days of the week and excluded calendar days
+        do not match.
+        """
+        day_filter = DayFilter.parse('mon,tue', 'public_holidays')
+        # Queen's Birthday.
+        self.assertFalse(day_filter.matches(date(2021, 6, 14)))
+        self.assertTrue(day_filter.matches(date(2021, 6, 15)))
+        self.assertFalse(day_filter.matches(date(2021, 6, 16)))
+
+        day_filter = DayFilter.parse(None, 'school_holidays')
+        self.assertFalse(day_filter.matches(date(2021, 7, 5)))
+        self.assertTrue(day_filter.matches(date(2021, 7, 12)))
+        self.assertEqual(
+            list(day_filter.day_mask(date(2021, 7, 10), 4)), [False, False, True, True]
+        )
+
+    def test_calendar_coverage(self):
+        """
+        Test that exclusions are refused for ranges the calendars do not
+        cover, and that days of the week alone are never refused.
+        """
+        DayFilter.parse(None, 'public_holidays').check_coverage(date(2025, 12, 1), date(2025, 12, 31))
+        with self.assertRaises(ValueError):
+            DayFilter.parse(None, 'public_holidays').check_coverage(date(2025, 12, 1), date(2026, 1, 1))
+        with self.assertRaises(ValueError):
+            DayFilter.parse(None, 'school_holidays').check_coverage(date(2025, 12, 1), date(2025, 12, 31))
+        DayFilter.parse('mon', None).check_coverage(date(2030, 1, 1), date(2030, 12, 31))
+
+    def test_query_predicate(self):
+        """
+        Test that the filter is applied in the SQL date predicate.
+        """
+        day_filter = DayFilter.parse('tue,wed,thu', 'public_holidays')
+        sql = str(Scats.objects.filter(
+            day_filter.q('QT_INTERVAL_COUNT', date(2021, 6, 1), date(2021, 6, 30))
+        ).query)
+        self.assertIn('IN (3, 4, 5)', sql)
+        self.assertIn('IN (2021-06-14)', sql)
+
+    def test_cube_days_are_filtered(self):
+        """
+        Test that rows and seasonality cubes leave out the filtered days.
+        """
+        cube = np.zeros((31, 1), dtype=cube_store.CUBE_DTYPE)
+        cube['valid'] = True
+        cube['volumes'] = 7
+        day_filter = DayFilter.parse('sat,sun', None)
+
+        rows = cube_store.rows_from_cubes(
+            100, date(2021, 7, 1), date(2021, 7, 7), [(2021, 7, cube)], day_filter=day_filter
+        )
+        self.assertEqual(
+            [row['QT_INTERVAL_COUNT'] for row in rows], [date(2021, 7, 3), date(2021, 7, 4)]
+        )
+
+        selected = cube_store.select_days(cube[:7], date(2021, 7, 1), day_filter)
+        self.assertEqual(list(selected['valid'][:, 0]), [False, False, True, True, False, False, False])
+        # Excluded days are not copied.
+        self.assertEqual(list(selected['volumes'][:, 0, 0]), [0, 0, 7, 7, 0, 0, 0])
+        self.assertTrue(cube['valid'].all())
+
+
+class DesignVolumesTests(SimpleTestCase):
+    """Test the design volume computation"""
+    def test_matches_a_full_sort_of_the_hours(self):
+        """
+        Test that the AADT and the Nth highest hours kept by partial sorts
+        month by month are those of a full sort of all hours.
+        """
+        rng = np.random.default_rng(0)
+        partials = []
+        for first_day, nb_days in [(date(2021, 6, 1), 30), (date(2021, 7, 1), 31)]:
+            partials.append(SeasonalityPartial(
+                days=first_day.toordinal() + np.arange(nb_days),
+                known=rng.integers(0, 200, (nb_days, 96)),
+                missing=np.zeros((nb_days, 1, 96), dtype=np.bool_),
+                alarms=np.zeros(nb_days, dtype=np.int64),
+                sums=np.zeros((1, 96), dtype=np.int64),
+                counts=np.zeros((1, 96), dtype=np.int64),
+            ))
+        means = np.zeros((1, 96))
+
+        result = design_volumes(iter(partials), means, [1, 30, 100, 2000])
+
+        hourly = np.concatenate([
+            partial.known.reshape(len(partial.days), 24, 4).sum(axis=2) for partial in partials
+        ])
+        ranked = np.sort(hourly.ravel())[::-1]
+        aadt = hourly.sum() / 61
+        self.assertEqual(result['NB_DAYS'], 61)
+        self.assertEqual(result['AADT'], round(aadt, 1))
+        self.assertEqual(
+            [hour['volume'] for hour in result['design_hours']],
+            [ranked[0], ranked[29], ranked[99], None]
+        )
+        self.assertEqual(result['design_hours'][1]['K'], round(ranked[29] / aadt, 4))
+
+        peak = result['design_hours'][0]
+        day = date.fromisoformat(peak['QT_INTERVAL_COUNT']).toordinal() - date(2021, 6, 1).toordinal()
+        self.assertEqual(hourly[day, peak['hour']], ranked[0])
+
+
+class PeakHourTests(SimpleTestCase):
+    """Test the peak hour computation"""
+    def test_peak_hours_match_a_loop_over_the_hours(self):
+        """
+        Test that the vectorized peak hours and factors are those of a loop
+        over every hour of each period, skipping hours with invalid volumes.
+        """
+        rng = np.random.default_rng(0)
+        volumes = rng.integers(0, 200, (5, 3, 96)).astype(np.float64)
+        volumes[0, 0, 30] = np.nan
+        volumes[1, 1, 48:] = np.nan
+
+        peaks = peak_hours(volumes)
+
+        for day in range(5):
+            for detector in range(3):
+                for period, (first, last) in [('AM', (0, 48)), ('PM', (48, 96))]:
+                    hours = [
+                        (volumes[day, detector, start:start + 4].sum(), -start)
+                        for start in range(first, last - 3)
+                        if not np.isnan(volumes[day, detector, start:start + 4]).any()
+                    ]
+                    start, volume, phf = (array[day, detector] for array in peaks[period])
+                    if not hours:
+                        self.assertEqual(start, -1)
+                        continue
+                    expected, expected_start = max(hours)
+                    self.assertEqual((start, volume), (-expected_start, expected))
+                    self.assertAlmostEqual(
+                        phf, expected / (4 * volumes[day, detector, start:start + 4].max())
+                    )
+
+    def test_peak_rows_of_a_cube(self):
+        """
+        Test the peak hour rows of the site total and of each detector.
+        """
+        cube = np.zeros((2, 2), dtype=cube_store.CUBE_DTYPE)
+        cube['valid'][0] = True
+        cube['volumes'][0, 0, 32:36] = [10, 20, 30, 40]
+        cube['volumes'][0, 1, 68:72] = 25
+        cube['volumes'][0, 1, 10] = -1
+
+        [total] = [json.loads(row) for row in peak_rows(cube, date(2021, 7, 1), [1, 2])]
+        self.assertEqual(total['QT_INTERVAL_COUNT'], '2021-07-01')
+        # The invalid volume of detector 2 invalidates the hours 01:45 to 02:30.
+        self.assertEqual(total['AM_PEAK_START'], '08:00')
+        self.assertEqual(total['AM_PEAK_VOLUME'], 100)
+        self.assertEqual(total['AM_PHF'], 0.625)
+        self.assertEqual(total['PM_PEAK_START'], '17:00')
+        self.assertEqual(total['PM_PEAK_VOLUME'], 100)
+        self.assertEqual(total['PM_PHF'], 1.0)
+
+        rows = [json.loads(row) for row in peak_rows(cube, date(2021, 7, 1), [1, 2], 'detector')]
+        self.assertEqual([row['NB_DETECTOR'] for row in rows], [1, 2])
+        self.assertEqual(rows[0]['PM_PEAK_VOLUME'], 0)
+        self.assertEqual(rows[0]['PM_PHF'], None)
+        self.assertEqual(rows[1]['PM_PEAK_START'], '17:00')
+
+
+class MonthlyFactorTests(SimpleTestCase):
+    """Test the monthly seasonal adjustment factors"""
+    def test_factor_year(self):
+        """
+        Test that the factor year is the 12 months ending with the last month.
+        """
+        self.assertEqual(factor_year(date(2021, 7, 1)), (date(2020, 8, 1), date(2021, 7, 31)))
+        self.assertEqual(factor_year(date(2021, 12, 1)), (date(2021, 1, 1), date(2021, 12, 31)))
+
+    def test_factors_of_all_sites_at_once(self):
+        """
+        Test that month ADTs and AADTs are computed for every site, over the
+        days with data only.
+        """
+        from_date, to_date = date(2021, 6, 29), date(2021, 7, 2)
+        totals = np.array([
+            [100, np.nan, 200, 400],
+            [np.nan, np.nan, 50, 50],
+        ])
+        adt, nb_days, aadt = monthly_factors(totals, from_date, to_date)
+        np.testing.assert_array_equal(nb_days, [[1, 2], [0, 2]])
+        np.testing.assert_array_equal(adt, [[100, 300], [np.nan, 50]])
+        np.testing.assert_array_equal(aadt, [700 / 3, 50])
+
+
+class AccessStatsTests(TestCase):
+    """Test access statistics and cache warming"""
+    databases = '__all__'
+
+    def setUp(self):
+        # Requests counted by other tests.
+        access_stats._pending.clear()
+        for _ in range(3):
+            record_access('seasonality', 100, date(2021, 7, 1), date(2021, 7, 31), '1,2')
+        record_access('extract', 101, date(2021, 7, 1), date(2021, 7, 7))
+        flush_accesses()
+
+    def test_record_access(self):
+        """
+        Test that requests are counted per kind, site, range and parameters.
+        """
+        self.assertEqual(ResultAccess.objects.count(), 2)
+        self.assertEqual(
+            ResultAccess.objects.get(kind='seasonality', NB_SCATS_SITE=100).count, 3
+        )
+        self.assertEqual(
+            [access.NB_SCATS_SITE for access in most_requested(top=10)], [100, 101]
+        )
+        self.assertEqual(
+            [access.NB_SCATS_SITE for access in most_requested(top=1)], [100]
+        )
+
+    @override_settings(SCATS_ACCESS_FLUSH_SECONDS=60, SCATS_ACCESS_RETENTION_DAYS=30)
+    def test_counts_are_written_in_batches_and_pruned(self):
+        """
+        Test that requests are only written once the flush interval has
+        passed, and that results not requested recently are deleted.
+        """
+        ResultAccess.objects.filter(NB_SCATS_SITE=101).update(
+            last_accessed=timezone.now() - timedelta(days=31)
+        )
+        with self.assertNumQueries(0, using=scats_database()):
+            for _ in range(5):
+                record_access('seasonality', 100, date(2021, 7, 1), date(2021, 7, 31), '1,2')
+        self.assertEqual(ResultAccess.objects.get(NB_SCATS_SITE=100).count, 3)
+
+        with patch('scats.logics.access_stats._flushed_at', time.monotonic() - 60):
+            record_access('design-volumes', 100, date(2021, 7, 1), date(2021, 7, 31), '1,2;ranks=30')
+        self.assertEqual(ResultAccess.objects.get(kind='seasonality').count, 8)
+        self.assertEqual(ResultAccess.objects.get(kind='design-volumes').count, 1)
+        self.assertFalse(ResultAccess.objects.filter(NB_SCATS_SITE=101).exists())
+
+    @patch('scats.logics.results.seasonality_result')
+    @patch('scats.logics.results.extract_result')
+    def test_warm(self, extract_result, seasonality_result):
+        """
+        Test that the most requested results are recomputed, and that
+        nothing is started once the time budget is spent.
+        """
+        self.assertEqual(warm(top=10, workers=2), 2)
+        extract_result.assert_called_once_with(101, date(2021, 7, 1), date(2021, 7, 7), None)
+        seasonality_result.assert_called_once_with(
+            100, date(2021, 7, 1), date(2021, 7, 31), [1, 2], day_filter=None
+        )
+
+        self.assertEqual(warm(top=10, time_budget=0), 0)
+        self.assertEqual(extract_result.call_count, 1)
+
+    @patch('scats.logics.results.peak_hours_result')
+    @patch('scats.logics.results.design_volumes_result')
+    def test_warm_design_volumes_and_peak_hours(self, design_volumes_result, peak_hours_result):
+        """
+        Test that the design volumes and peak hours requested are recomputed.
+        """
+        ResultAccess.objects.all().delete()
+        record_access('design-volumes', 100, date(2021, 7, 1), date(2021, 7, 31), '1,2;ranks=30,50')
+        record_access('peak-hours-detector', 101, date(2021, 7, 1), date(2021, 7, 31), '3')
+        flush_accesses()
+
+        self.assertEqual(warm(top=10, workers=1), 2)
+        design_volumes_result.assert_called_once_with(
+            100, date(2021, 7, 1), date(2021, 7, 31), [1, 2], [30, 50]
+        )
+        peak_hours_result.assert_called_once_with(
+            101, date(2021, 7, 1), date(2021, 7, 31), [3], group='detector', day_filter=None
+        )
+
+    @patch('scats.logics.access_stats.warm')
+    def test_warming_is_skipped_without_shared_cache(self, warm):
+        """
+        Test that the caches are only warmed when the results outlive the
+        warming process.
+        """
+        local = {'BACKEND': 'scats.logics.result_cache.LocMemResultCache'}
+        shared = {'BACKEND': 'scats.logics.result_cache.FileResultCache'}
+        with override_settings(SCATS_RESULT_CACHE=local, SCATS_BLOCK_CACHE_MAX_BYTES=0):
+            self.assertFalse(is_warming_useful())
+            call_command('warm_scats_cache', stdout=StringIO())
+            warm.assert_not_called()
+        with override_settings(SCATS_RESULT_CACHE=shared, SCATS_BLOCK_CACHE_MAX_BYTES=0):
+            self.assertTrue(is_warming_useful())
+            call_command('warm_scats_cache', stdout=StringIO())
+            warm.assert_called_once()
+        if block_cache.shared_memory:
+            with override_settings(SCATS_RESULT_CACHE=local, SCATS_BLOCK_CACHE_MAX_BYTES=1024):
+                self.assertTrue(is_warming_useful())
+
+
+@skipUnless(block_cache.shared_memory, 'multiprocessing.shared_memory is not available.')
+class BlockCacheTests(SimpleTestCase):
+    """Test the shared memory block cache"""
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        cube = np.zeros((31, 4), dtype=cube_store.CUBE_DTYPE)
+        cube['valid'][0, 1] = True
+        cube['volumes'][0, 1] = 7
+        self.cube = cube
+
+        settings_override = override_settings(
+            SCATS_BLOCK_CACHE_MAX_BYTES=2 * (cube.nbytes + block_cache.HEADER_DTYPE.itemsize),
+            SCATS_BLOCK_CACHE_PREFIX=f'scats_test_{os.getpid()}',
+            SCATS_BLOCK_CACHE_INDEX=os.path.join(index_dir, 'index.sqlite3'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(block_cache.clear)
+
+    def test_blocks_are_built_once_and_shared(self):
+        """
+        Test that a block is loaded on the first request only and that
+        later requests attach to the shared copy.
+        """
+        load = Mock(return_value=self.cube)
+        first = block_cache.get_block(100, 2021, 7, 1, load)
+        second = block_cache.get_block(100, 2021, 7, 1, load)
+
+        self.assertEqual(load.call_count, 1)
+        np.testing.assert_array_equal(first, self.cube)
+        np.testing.assert_array_equal(second, self.cube)
+        self.assertFalse(second.flags.writeable)
+
+        # A new ingest manifest version is a different block.
+        block_cache.get_block(100, 2021, 7, 2, load)
+        self.assertEqual(load.call_count, 2)
+
+        stats = block_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_hits_only_read_the_index(self):
+        """
+        Test that hits within the touch interval do not write to the index
+        and are counted by the next write.
+        """
+        load = Mock(return_value=self.cube)
+        block_cache.get_block(100, 2021, 7, 1, load)
+        index = block_cache._index()
+        changes = index.total_changes
+        block_cache.get_block(100, 2021, 7, 1, load)
+        block_cache.get_block(100, 2021, 7, 1, load)
+
+        self.assertEqual(index.total_changes, changes)
+        self.assertEqual(index.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        stats = block_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    @patch('scats.logics.block_cache.TOUCH_INTERVAL', 0)
+    def test_least_recently_used_blocks_are_evicted(self):
+        """
+        Test that blocks are evicted in LRU order to stay under the byte budget.
+        """
+        load = Mock(return_value=self.cube)
+        block_cache.get_block(100, 2021, 7, 1, load)
+        block_cache.get_block(101, 2021, 7, 1, load)
+        block_cache.get_block(100, 2021, 7, 1, load)
+        block_cache.get_block(102, 2021, 7, 1, load)
+
+        stats = block_cache.stats()
+        self.assertEqual(stats['blocks'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+
+        block_cache.get_block(100, 2021, 7, 1, load)
+        self.assertEqual(load.call_count, 3)
+        block_cache.get_block(101, 2021, 7, 1, load)
+        self.assertEqual(load.call_count, 4)
+
+    def test_block_is_unlinked_when_indexing_fails(self):
+        """
+        Test that a block which could not be added to the index does not
+        stay in shared memory, and is published by the next request.
+        """
+        load = Mock(return_value=self.cube)
+        name = block_cache.block_name(100, 2021, 7, 1)
+        with patch('scats.logics.block_cache._evict', side_effect=sqlite3.OperationalError):
+            with self.assertRaises(sqlite3.OperationalError):
+                block_cache.get_block(100, 2021, 7, 1, load)
+        with self.assertRaises(FileNotFoundError):
+            block_cache.shared_memory.SharedMemory(name=name)
+
+        block_cache.get_block(100, 2021, 7, 1, load)
+        self.assertEqual(block_cache.stats()['blocks'], 1)
+
+    def test_stale_segments_are_reclaimed(self):
+        """
+        Test that a segment left not ready by a worker is only replaced once
+        PUBLISH_TIMEOUT has passed.
+        """
+        load = Mock(return_value=self.cube)
+        name = block_cache.block_name(100, 2021, 7, 1)
+        size = block_cache.HEADER_DTYPE.itemsize + self.cube.nbytes
+        shm = block_cache.shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.addCleanup(block_cache._unlink, name)
+        header = np.ndarray((), dtype=block_cache.HEADER_DTYPE, buffer=shm.buf)
+        header['created'] = time.time()
+
+        block_cache.get_block(100, 2021, 7, 1, load)
+        self.assertEqual(block_cache.stats()['blocks'], 0)
+
+        header['created'] = time.time() - block_cache.PUBLISH_TIMEOUT
+        del header
+        shm.close()
+        block_cache.get_block(100, 2021, 7, 1, load)
+        np.testing.assert_array_equal(block_cache.get_block(100, 2021, 7, 1, load), self.cube)
+        stats = block_cache.stats()
+        self.assertEqual((stats['blocks'], stats['hits'], stats['misses']), (1, 1, 2))
+
+
+class ResultCacheVersionTests(TestCase):
+    """Test that cached results follow the ingest manifest"""
+    databases = '__all__'
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'})
+    def test_results_are_recomputed_after_ingest(self):
+        """
+        Test that a cached result is reused until the site-month is ingested again.
+        """
+        get_result_cache().clear()
+        compute = Mock(side_effect=[b'1', b'2'])
+        args = ('extract', 100, date(2021, 7, 1), date(2021, 7, 7), '', compute)
+
+        self.assertEqual(get_or_compute(*args), b'1')
+        self.assertEqual(get_or_compute(*args), b'1')
+
+        record_ingest([(100, 2021, 7)])
+        self.assertEqual(get_or_compute(*args), b'2')
+        self.assertEqual(compute.call_count, 2)
+
+    @override_settings(SCATS_RESULT_CACHE={'BACKEND': 'scats.logics.result_cache.LocMemResultCache'})
+    def test_results_are_recomputed_for_a_new_format(self):
+        """
+        Test that bumping the result format version changes the ETag and
+        recomputes cached results.
+        """
+        get_result_cache().clear()
+        compute = Mock(side_effect=[b'1', b'2'])
+        args = ('extract', 100, date(2021, 7, 1), date(2021, 7, 7), '', compute)
+        etag = result_etag(*args[:5])
+
+        self.assertEqual(get_or_compute(*args), b'1')
+        with patch('scats.logics.result_cache.RESULT_FORMAT_VERSION', 2):
+            self.assertNotEqual(result_etag(*args[:5]), etag)
+            self.assertEqual(get_or_compute(*args), b'2')
@@ -2,7 +2,15 @@ from django.urls import path
 from .views import (
     OpsheetDownloadView,
     ExtractScatsDataView,
-    SeasonalityAnalysisView
+    SeasonalityAnalysisView,
+    DesignVolumesView,
+    PeakHoursView,
+    MonthlyFactorsView,
+    SeasonalityAnalysisJobView,
+    AnalysisJobView,
+    AnalysisJobResultView,
+    JobDownloadView,
+    ExportJobView,
 )
 
 app_name = 'scats'
@@ -22,5 +30,45 @@ urlpatterns = [
         'seasonality-analysis/',
         SeasonalityAnalysisView.as_view(),
         name='seasonality-analysis'
-    )
+    ),
+    path(
+        'design-volumes/',
+        DesignVolumesView.as_view(),
+        name='design-volumes'
+    ),
+    path(
+        'peak-hours/',
+        PeakHoursView.as_view(),
+        name='peak-hours'
+    ),
+    path(
+        'monthly-factors/',
+        MonthlyFactorsView.as_view(),
+        name='monthly-factors'
+    ),
+    path(
+        'jobs/seasonality-analysis/',
+        SeasonalityAnalysisJobView.as_view(),
+        name='seasonality-analysis-job'
+    ),
+    path(
+        'jobs/<int:job_id>/',
+        AnalysisJobView.as_view(),
+        name='job'
+    ),
+    path(
+        'jobs/<int:job_id>/result/',
+        AnalysisJobResultView.as_view(),
+        name='job-result'
+    ),
+    path(
+        'jobs/<int:job_id>/download/',
+        JobDownloadView.as_view(),
+        name='job-download'
+    ),
+    path(
+        'jobs/export/',
+        ExportJobView.as_view(),
+        name='export-job'
+    ),
 ]
\ No newline at end of file
@@ -5,11 +5,204 @@ from django.utils import timezone
 import boto3
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from .models import Scats
-from .serializers import ScatsSerializer
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from rest_framework.settings import api_settings
+from django.urls import reverse
+from django.utils.http import parse_etags
 from datetime import date, timedelta
-from .logics.seasonality_analysis import seasonality_analysis
-import json
+from functools import partial
+from .logics.results import (
+    extract_result,
+    seasonality_detector_result,
+    seasonality_detector_stream,
+    seasonality_percentile_result,
+    seasonality_profile_result,
+    seasonality_result,
+    seasonality_stream,
+    design_volumes_params,
+    design_volumes_result,
+    peak_hours_kind,
+    peak_hours_result,
+    result_etag,
+    filter_params,
+    seasonality_params,
+)
+from .logics.access_stats import record_access
+from .logics.corridor import corridor_etag, corridor_result
+from .logics.seasonality_analysis import AGGREGATES
+from .logics.holidays import DayFilter
+from .logics.design_volumes import DEFAULT_RANKS, MAX_RANK
+from .logics.jobs import create_job
+from .logics.exports import export_cost, local_path, presigned_url
+from .models import AnalysisJob, MonthlyFactor
+from .serializers import AnalysisJobSerializer, MonthlyFactorSerializer
+from .renderers import NDJSONRenderer
+
+
+def etag_matches(request, etag):
+    """
+    Whether the If-None-Match header of the request matches etag
+    (weak comparison, as required for If-None-Match).
+    """
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return '*' in etags or etag in [
+        e[2:] if e.startswith('W/') else e for e in etags
+    ]
+
+
+def charge_credit(user, credit_field, cost=1):
+    """
+    Deduct cost credit points of credit_field in the database, so that
+    concurrent requests of the same user are each charged.
+    Returns False if the user has not enough credit left.
+    """
+    charged = get_user_model().objects.filter(
+        pk=user.pk, **{f'{credit_field}__gte': cost}
+    ).update(**{credit_field: F(credit_field) - cost})
+    user.refresh_from_db(fields=[credit_field])
+    return bool(charged)
+
+
+def result_response(content, etag):
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    # Responses depend on the user's access, so only private caches may
+    # store them, and they must revalidate with If-None-Match.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def stream_response(lines, etag):
+    response = StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified_response(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def parse_day_filter(params, from_date, to_date):
+    """
+    DayFilter of the 'days' and 'exclude' parameters (see
+    logics.holidays.DayFilter.parse), for the range from_date to to_date.
+    Returns (day filter or None, None), or (None, error response).
+    """
+    try:
+        day_filter = DayFilter.parse(params.get('days'), params.get('exclude'))
+        if day_filter is not None:
+            day_filter.check_coverage(from_date, to_date)
+        return day_filter, None
+    except ValueError as e:
+        return None, Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+def parse_seasonality_params(params, multiple_sites=False):
+    """
+    Validate the parameters of a seasonality analysis.
+    Returns ((scats_id, from_date, to_date, detectors), None), or
+    (None, error response). If multiple_sites, scats_id is a list of
+    site numbers separated by comma.
+    """
+    scats_id = params.get('scats_id')
+    from_date = params.get('from')
+    to_date = params.get('to')
+    detectors = params.get('detectors')
+    
+    if detectors == 'all' or detectors == None or detectors == '':
+        detectors = [i+1 for i in range(50)]
+    else:
+        try:
+            detectors = [int(i) for i in detectors.split(',')]
+        except Exception:
+            return None, Response(
+                {'error': "'detectors' must be integers separated by comma."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    if multiple_sites:
+        try:
+            scats_id = list(dict.fromkeys(int(i) for i in scats_id.split(',')))
+        except Exception:
+            return None, Response(
+                {'error': "'scats_id' must be integers separated by comma."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(scats_id) > settings.SCATS_CORRIDOR_MAX_SITES:
+            return None, Response(
+                {'error': f"'scats_id' cannot contain more than {settings.SCATS_CORRIDOR_MAX_SITES} sites."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    else:
+        try:
+            scats_id = int(scats_id)
+        except Exception:
+            return None, Response(
+                {'error': "'scats_id' must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    try:
+        from_date_year, from_date_month, from_date_day = [int(i) for i in from_date.split('-')]
+        from_date = date(
+            from_date_year,
+            from_date_month,
+            from_date_day,
+        )
+    except Exception:
+        return None, Response(
+            {'error': "'from' must be a date of format YYYY-MM-DD."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        to_date_year, to_date_month, to_date_day = [int(i) for i in to_date.split('-')]
+        to_date = date(
+            to_date_year,
+            to_date_month,
+            to_date_day,
+        )
+    except Exception as e:
+        return None, Response(
+            {'error': "'to' must be a date of format YYYY-MM-DD."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if from_date < settings.QT_INTERVAL_COUNT_MIN:
+        return None, Response(
+            {'error': f"'from' must be a date later than or equal to {settings.QT_INTERVAL_COUNT_MIN}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if to_date > settings.QT_INTERVAL_COUNT_MAX:
+        return None, Response(
+            {'error': f"'to' must be a date earlier than or equal to {settings.QT_INTERVAL_COUNT_MAX}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if to_date - from_date > timedelta(days=365-1):
+        return None, Response(
+            {'error': "Time difference between 'from' and 'date' cannot be more than 365 days."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if from_date - to_date > timedelta(days=0):
+        return None, Response(
+            {'error': "'from' cannot be greater than 'to'."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return (scats_id, from_date, to_date, detectors), None
 
 
 class OpsheetDownloadView(APIView):
@@ -114,32 +307,60 @@ class ExtractScatsDataView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        scats_data = Scats.objects.filter(
-            NB_SCATS_SITE=scats_id,
-            QT_INTERVAL_COUNT__gte=from_date,
-            QT_INTERVAL_COUNT__lte=to_date
-        ).order_by('QT_INTERVAL_COUNT', 'NB_DETECTOR').distinct('QT_INTERVAL_COUNT', 'NB_DETECTOR')
+        day_filter, error_response = parse_day_filter(request.query_params, from_date, to_date)
+        if error_response is not None:
+            return error_response
+
+        record_access('extract', scats_id, from_date, to_date, filter_params(day_filter))
+
+        # The client already has the data of this range. A 304 is not
+        # charged, but the access check above still applies.
+        etag = result_etag('extract', scats_id, from_date, to_date, filter_params(day_filter))
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+
+        content = extract_result(scats_id, from_date, to_date, day_filter)
 
-        if len(scats_data) == 0:
+        if content is None:
             return Response(
                 {'error': "There was no data found. Please try again with a different request."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        serializer = ScatsSerializer(scats_data, many=True)
-
         if not user.subscribed and not is_user_free:
-            user.scats_credit = user.scats_credit - 1
-            user.save()
+            if not charge_credit(user, 'scats_credit'):
+                # Spent by a concurrent request of the same user.
+                return Response(
+                    {'error': 'Access denied. Please purchase scats credit points or sign up for the monthly subscription.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        return result_response(content, etag)
+
 
-        return Response(serializer.data)
+# Access kind and (result, stream) functions of the seasonality analysis
+# for each value of the 'group' parameter.
+SEASONALITY_GROUPS = {
+    '': ('seasonality', (seasonality_result, seasonality_stream)),
+    'detector': ('seasonality-detector', (seasonality_detector_result, seasonality_detector_stream)),
+}
 
 
 class SeasonalityAnalysisView(APIView):
     """
     Perform seasonality analysis.
+
+    With 'Accept: application/x-ndjson' (or '?format=ndjson') the result is
+    streamed as one JSON line per day. With 'group=detector' the volumes of
+    each detector are returned instead of the site total. With 'aggregate'
+    (dow, month or weekday_weekend) the mean daily profile of each day of
+    the week, month or weekdays and weekend days is returned instead of
+    the days, and with 'aggregate=percentile' the percentile bands of each
+    interval across the days. Several sites can be analysed at once with 'scats_id'
+    separated by comma.
     """
     permission_classes = [IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
 
     def get(self, request, format=None):
         user = request.user
@@ -154,37 +375,464 @@ class SeasonalityAnalysisView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        scats_id = from_date = request.query_params.get('scats_id')
-        from_date = request.query_params.get('from')
-        to_date = request.query_params.get('to')
-        detectors = request.query_params.get('detectors')
-        
-        if detectors == 'all' or detectors == None or detectors == '':
-            detectors = [i+1 for i in range(50)]
+        if ',' in request.query_params.get('scats_id', ''):
+            return self.get_corridor(request, user, is_user_free)
+
+        parsed, error_response = parse_seasonality_params(request.query_params)
+        if error_response is not None:
+            return error_response
+        scats_id, from_date, to_date, detectors = parsed
+
+        day_filter, error_response = parse_day_filter(request.query_params, from_date, to_date)
+        if error_response is not None:
+            return error_response
+
+        group = request.query_params.get('group', '')
+        if group not in SEASONALITY_GROUPS:
+            return Response(
+                {'error': "'group' must be 'detector'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        aggregate = request.query_params.get('aggregate', '')
+        if aggregate and aggregate not in AGGREGATES and aggregate != 'percentile':
+            return Response(
+                {'error': f"'aggregate' must be one of {', '.join(AGGREGATES)}, percentile."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if aggregate and group:
+            return Response(
+                {'error': "'group' and 'aggregate' cannot be combined."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if aggregate == 'percentile':
+            kind = 'seasonality-percentile'
+            compute_result = seasonality_percentile_result
+            compute_stream = None
+        elif aggregate:
+            kind = f'seasonality-profile-{aggregate}'
+            compute_result = partial(seasonality_profile_result, aggregate=aggregate)
+            compute_stream = None
+        else:
+            kind, (compute_result, compute_stream) = SEASONALITY_GROUPS[group]
+
+        record_access(
+            kind, scats_id, from_date, to_date, seasonality_params(detectors, day_filter)
+        )
+
+        is_ndjson = request.accepted_renderer.format == NDJSONRenderer.format
+        if is_ndjson and compute_stream is None:
+            return Response(
+                {'error': "Profiles are only available as JSON."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The client already has this result. A 304 is not charged,
+        # but the access check above still applies.
+        etag = result_etag(
+            f'{kind}-ndjson' if is_ndjson else kind,
+            scats_id, from_date, to_date, seasonality_params(detectors, day_filter)
+        )
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+
+        if is_ndjson:
+            content = compute_stream(scats_id, from_date, to_date, detectors, day_filter=day_filter)
         else:
+            content = compute_result(scats_id, from_date, to_date, detectors, day_filter=day_filter)
+
+        if content is None:
+            return Response(
+                {'error': "There was no data found. Please try again with a different request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not user.subscribed and not is_user_free:
+            if not charge_credit(user, 'seasonality_credit'):
+                # Spent by a concurrent request of the same user.
+                return Response(
+                    {'error': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        if is_ndjson:
+            return stream_response(content, etag)
+        return result_response(content, etag)
+
+    def get_corridor(self, request, user, is_user_free):
+        """
+        Seasonality analysis of several sites, computed in parallel, with
+        their daily total if 'total=1'.
+        """
+        parsed, error_response = parse_seasonality_params(request.query_params, multiple_sites=True)
+        if error_response is not None:
+            return error_response
+        scats_ids, from_date, to_date, detectors = parsed
+
+        day_filter, error_response = parse_day_filter(request.query_params, from_date, to_date)
+        if error_response is not None:
+            return error_response
+
+        if (
+            request.query_params.get('group') or request.query_params.get('aggregate')
+            or request.accepted_renderer.format == NDJSONRenderer.format
+        ):
+            return Response(
+                {'error': "The analysis of several sites is only available as JSON, without 'group' or 'aggregate'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        total = request.query_params.get('total') in ('1', 'true')
+
+        is_charged = not user.subscribed and not is_user_free
+        charge_per_site = settings.SCATS_CORRIDOR_CHARGE == 'site'
+        if is_charged and charge_per_site and user.seasonality_credit < len(scats_ids):
+            return Response(
+                {'error': f'Access denied. The analysis of {len(scats_ids)} sites needs {len(scats_ids)} seasonality analysis credit points.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        for scats_id in scats_ids:
+            record_access(
+                'seasonality', scats_id, from_date, to_date, seasonality_params(detectors, day_filter)
+            )
+
+        etag = corridor_etag(scats_ids, from_date, to_date, detectors, total, day_filter)
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+
+        content, nb_sites = corridor_result(
+            scats_ids, from_date, to_date, detectors, total, day_filter
+        )
+
+        if content is None:
+            return Response(
+                {'error': "There was no data found. Please try again with a different request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if is_charged:
+            # Sites without data are not charged.
+            if not charge_credit(user, 'seasonality_credit', nb_sites if charge_per_site else 1):
+                return Response(
+                    {'error': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        return result_response(content, etag)
+
+
+class DesignVolumesView(APIView):
+    """
+    Compute the AADT, K-factors and Nth highest hourly volumes of a site
+    for design, from the filled volumes of the seasonality analysis.
+    'ranks' are the N of the hours (30 and 100 by default).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        user = request.user
+
+        is_user_free = timezone.now() < user.free_until
+
+        if user.seasonality_credit == 0 and not user.subscribed and not is_user_free:
+            return Response(
+                {'error': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        parsed, error_response = parse_seasonality_params(request.query_params)
+        if error_response is not None:
+            return error_response
+        scats_id, from_date, to_date, detectors = parsed
+
+        ranks = request.query_params.get('ranks')
+        try:
+            ranks = sorted(set(int(i) for i in ranks.split(','))) if ranks else DEFAULT_RANKS
+        except Exception:
+            return Response(
+                {'error': "'ranks' must be integers separated by comma."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not 1 <= ranks[0] <= ranks[-1] <= MAX_RANK:
+            return Response(
+                {'error': f"'ranks' must be between 1 and {MAX_RANK}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        record_access(
+            'design-volumes', scats_id, from_date, to_date, design_volumes_params(detectors, ranks)
+        )
+
+        etag = result_etag(
+            'design-volumes', scats_id, from_date, to_date, design_volumes_params(detectors, ranks)
+        )
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+
+        content = design_volumes_result(scats_id, from_date, to_date, detectors, ranks)
+
+        if content is None:
+            return Response(
+                {'error': "There was no data found. Please try again with a different request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not user.subscribed and not is_user_free:
+            if not charge_credit(user, 'seasonality_credit'):
+                return Response(
+                    {'error': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        return result_response(content, etag)
+
+
+class PeakHoursView(APIView):
+    """
+    Compute the AM and PM peak hours and peak hour factors of each day, of
+    the site total or of each detector with group=detector.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        user = request.user
+
+        is_user_free = timezone.now() < user.free_until
+
+        if user.scats_credit == 0 and not user.subscribed and not is_user_free:
+            return Response(
+                {'error': 'Access denied. Please purchase scats credit points or sign up for the monthly subscription.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        parsed, error_response = parse_seasonality_params(request.query_params)
+        if error_response is not None:
+            return error_response
+        scats_id, from_date, to_date, detectors = parsed
+
+        group = request.query_params.get('group', '')
+        if group not in ('', 'detector'):
+            return Response(
+                {'error': "'group' must be 'detector' or empty."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        day_filter, error_response = parse_day_filter(request.query_params, from_date, to_date)
+        if error_response is not None:
+            return error_response
+
+        record_access(
+            peak_hours_kind(group), scats_id, from_date, to_date,
+            seasonality_params(detectors, day_filter)
+        )
+
+        etag = result_etag(
+            peak_hours_kind(group), scats_id, from_date, to_date,
+            seasonality_params(detectors, day_filter)
+        )
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+
+        content = peak_hours_result(scats_id, from_date, to_date, detectors, group, day_filter)
+
+        if content is None:
+            return Response(
+                {'error': "There was no data found. Please try again with a different request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not user.subscribed and not is_user_free:
+            if not charge_credit(user, 'scats_credit'):
+                return Response(
+                    {'error': 'Access denied. Please purchase scats credit points or sign up for the monthly subscription.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        return result_response(content, etag)
+
+
+class MonthlyFactorsView(APIView):
+    """
+    Return the precomputed monthly seasonal adjustment factors (month ADT /
+    AADT) of a site ('scats_id') or of all sites of a region ('region').
+    They are recomputed after every ingest and are not charged.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        scats_id = request.query_params.get('scats_id')
+        region = request.query_params.get('region')
+
+        if bool(scats_id) == bool(region):
+            return Response(
+                {'error': "Either 'scats_id' or 'region' must be given."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if scats_id:
             try:
-                detectors = [int(i) for i in detectors.split(',')]
+                factors = MonthlyFactor.objects.filter(NB_SCATS_SITE=int(scats_id))
             except Exception:
                 return Response(
-                    {'error': "'detectors' must be integers separated by comma."},
+                    {'error': "'scats_id' must be an integer."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+        else:
+            factors = MonthlyFactor.objects.filter(NM_REGION=region)
+
+        factors = factors.order_by('NB_SCATS_SITE', 'month')
+        if not factors:
+            return Response(
+                {'error': "There was no data found. Please try again with a different request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(MonthlyFactorSerializer(factors, many=True).data)
 
+
+class SeasonalityAnalysisJobView(APIView):
+    """
+    Start a seasonality analysis in the background.
+    Credit points are deducted when the job succeeds.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        user = request.user
+
+        is_user_free = timezone.now() < user.free_until
+
+        if user.seasonality_credit == 0 and not user.subscribed and not is_user_free:
+            # Not allowed if user has no credit and is not subscribed
+            #  and is not on the free period.
+            return Response(
+                {'error': 'Access denied. Please purchase seasonality analysis credit points or sign up for the monthly subscription.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        parsed, error_response = parse_seasonality_params(request.data)
+        if error_response is not None:
+            return error_response
+        scats_id, from_date, to_date, detectors = parsed
+
+        job = create_job(user, 'seasonality', {
+            'scats_id': scats_id,
+            'from': from_date.isoformat(),
+            'to': to_date.isoformat(),
+            'detectors': detectors,
+        })
+        return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class AnalysisJobView(APIView):
+    """
+    Status of a background job of the user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, format=None):
         try:
-            scats_id = int(scats_id)
+            job = AnalysisJob.objects.get(pk=job_id, user=request.user)
+        except AnalysisJob.DoesNotExist:
+            return Response(
+                {'error': 'Job not found.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(AnalysisJobSerializer(job).data)
+
+
+class AnalysisJobResultView(APIView):
+    """
+    Result of a succeeded background job of the user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, format=None):
+        try:
+            job = AnalysisJob.objects.get(pk=job_id, user=request.user)
+        except AnalysisJob.DoesNotExist:
+            return Response(
+                {'error': 'Job not found.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if job.status != AnalysisJob.SUCCEEDED:
+            return Response(
+                {'error': f'Job is {job.status}.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        if job.output:
+            if settings.SCATS_EXPORT_DIR:
+                url = request.build_absolute_uri(
+                    reverse('scats:job-download', kwargs={'job_id': job.id})
+                )
+            else:
+                url = presigned_url(job.output)
+            return Response({'url': url})
+        return HttpResponse(bytes(job.result), content_type='application/json')
+
+
+class JobDownloadView(APIView):
+    """
+    Download the file of a succeeded job of the user, when files are
+    stored in SCATS_EXPORT_DIR instead of the storage bucket.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, format=None):
+        try:
+            job = AnalysisJob.objects.get(
+                pk=job_id, user=request.user, status=AnalysisJob.SUCCEEDED
+            )
+        except AnalysisJob.DoesNotExist:
+            job = None
+        if job is None or not job.output or not settings.SCATS_EXPORT_DIR:
+            return Response(
+                {'error': 'File not found.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(
+            open(local_path(job.output), 'rb'), as_attachment=True,
+            filename=job.output.split('/')[-1]
+        )
+
+
+class ExportJobView(APIView):
+    """
+    Export SCATS data of several sites and long ranges in the background
+    as a gzipped CSV file. Scats credit points are deducted when the job
+    succeeds, one per site and started 7 days.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        user = request.user
+
+        is_user_free = timezone.now() < user.free_until
+
+        scats_ids = request.data.get('scats_ids')
+        from_date = request.data.get('from')
+        to_date = request.data.get('to')
+
+        try:
+            if isinstance(scats_ids, str):
+                scats_ids = scats_ids.split(',')
+            scats_ids = sorted(set(int(i) for i in scats_ids))
         except Exception:
             return Response(
-                {'error': "'scats_id' must be an integer."},
+                {'error': "'scats_ids' must be integers separated by comma."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            from_date_year, from_date_month, from_date_day = [int(i) for i in from_date.split('-')]
-            from_date = date(
-                from_date_year,
-                from_date_month,
-                from_date_day,
+        if not 1 <= len(scats_ids) <= settings.SCATS_EXPORT_MAX_SITES:
+            return Response(
+                {'error': f"'scats_ids' must contain 1 to {settings.SCATS_EXPORT_MAX_SITES} sites."},
+                status=status.HTTP_400_BAD_REQUEST
             )
+
+        try:
+            from_date = date.fromisoformat(from_date)
         except Exception:
             return Response(
                 {'error': "'from' must be a date of format YYYY-MM-DD."},
@@ -192,13 +840,8 @@ class SeasonalityAnalysisView(APIView):
             )
 
         try:
-            to_date_year, to_date_month, to_date_day = [int(i) for i in to_date.split('-')]
-            to_date = date(
-                to_date_year,
-                to_date_month,
-                to_date_day,
-            )
-        except Exception as e:
+            to_date = date.fromisoformat(to_date)
+        except Exception:
             return Response(
                 {'error': "'to' must be a date of format YYYY-MM-DD."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -218,7 +861,7 @@ class SeasonalityAnalysisView(APIView):
 
         if to_date - from_date > timedelta(days=365-1):
             return Response(
-                {'error': "Time difference between 'from' and 'date' cannot be more than 365 days."},
+                {'error': "Time difference between 'from' and 'to' cannot be more than 365 days."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
@@ -228,23 +871,17 @@ class SeasonalityAnalysisView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        scats_data = Scats.objects.filter(
-            NB_SCATS_SITE=scats_id,
-            QT_INTERVAL_COUNT__gte=from_date,
-            QT_INTERVAL_COUNT__lte=to_date,
-            NB_DETECTOR__in=detectors
-        ).order_by('QT_INTERVAL_COUNT', 'NB_DETECTOR').distinct('QT_INTERVAL_COUNT', 'NB_DETECTOR')
+        params = {
+            'scats_ids': scats_ids,
+            'from': from_date.isoformat(),
+            'to': to_date.isoformat(),
+        }
 
-        if len(scats_data) == 0:
+        if user.scats_credit < export_cost(params) and not user.subscribed and not is_user_free:
             return Response(
-                {'error': "There was no data found. Please try again with a different request."},
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': 'Access denied. Please purchase scats credit points or sign up for the monthly subscription.'},
+                status=status.HTTP_403_FORBIDDEN
             )
-        
-        json_data = seasonality_analysis(scats_data)
-
-        if not user.subscribed and not is_user_free:
-            user.seasonality_credit = user.seasonality_credit - 1
-            user.save()
 
-        return Response(json.loads(json_data))
+        job = create_job(user, 'export', params)
+        return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)